@@ -1,9 +1,8 @@
 import streamlit as st
-import time
-import subprocess
-import sys
 import os
-import shutil
+from ingest import config
+from ingest.jobs import (CANCELLED, FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue, JobScheduler,
+                         read_log_tail, repo_name_from_url)
 
 # Page Configuration and Title
 st.set_page_config(page_title="Add Repository", page_icon="➕")
@@ -13,6 +12,11 @@ st.info(
     "index it into a new vector store."
 )
 
+# Optionally preload the embedding model once per server process.
+if config.WARM_UP_ON_START:
+    from ingest.chain_setup import warm_up
+    warm_up()
+
 # Initialize Session State
 # Initialize our flag at the start. This runs only once.
 if "confirm_overwrite" not in st.session_state:
@@ -22,47 +26,72 @@ if "repo_to_overwrite" not in st.session_state:
 if "url_to_clone" not in st.session_state:
     st.session_state.url_to_clone = None
 
-# Helper Function for the Ingestion Process
-# Put the subprocess logic in a function to avoid repeating code.
+# Ingestion runs in background jobs, so it survives closing the tab and several
+# users cannot overload the machine. The scheduler is shared by every session.
+@st.cache_resource
+def get_job_queue():
+    queue = JobQueue()
+    JobScheduler(queue).start()
+    return queue
 
 
 def start_ingestion(github_url):
-    st.success(
-        f"Starting ingestion for {github_url}. This may take several minutes...")
-    log_placeholder = st.empty()
-    log_output = ""
-    command = [sys.executable, "-m",
-               "ingest.create_vectorstore", "--url", github_url]
-
-    try:
-        start_time = time.time()
-        process = subprocess.Popen(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            encoding="utf-8",
-            bufsize=1,
-        )
-        for line in process.stdout:
-            log_output += line
-            log_placeholder.code(log_output, language="log")
-        process.wait()
-        end_time = time.time()
-        duration = end_time-start_time
-        if process.returncode == 0:
-            st.success(
-                f"✅ Ingestion complete in {duration:.2f} seconds! "
-                "The new knowledge base is ready."
-            )
-            st.balloons()
-        else:
-            st.error(
-                "❌ Ingestion failed. See logs above for details. "
-                f"Exit code: {process.returncode}"
-            )
-    except Exception as e:
-        st.error(f"An error occurred while launching the script: {e}")
+    job_id, created = get_job_queue().submit(github_url)
+    if created:
+        st.success(
+            f"Queued ingestion job {job_id} for {github_url}. "
+            "You can follow its progress below, or close this page and come back later.")
+    else:
+        st.info(f"{github_url} is already being indexed (job {job_id}).")
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}m {seconds:02d}s" if minutes else f"{seconds}s"
+
+
+def show_job(job):
+    progress = job["progress"]
+    status = job["status"]
+    icons = {QUEUED: "⏳", RUNNING: "⚙️", SUCCEEDED: "✅", FAILED: "❌", CANCELLED: "🚫"}
+    st.markdown(f"{icons.get(status, '')} **{job['repo_name']}** (job {job['id']}): {status}")
+
+    if status == RUNNING:
+        files_total = progress.get("files_total")
+        files_done = progress.get("files_done", 0)
+        details = f"{progress.get('stage', 'starting').capitalize()}"
+        if files_total and "files_done" in progress:
+            details += f": {files_done}/{files_total} files, {progress.get('chunks', 0)} chunks"
+            if progress.get("eta_seconds") is not None:
+                details += f", about {format_duration(progress['eta_seconds'])} left"
+        st.progress(files_done / files_total if files_total and "files_done" in progress else 0.0,
+                    text=details)
+    elif status == SUCCEEDED and job["finished_at"] and job["started_at"]:
+        st.caption(
+            f"Indexed {progress.get('files_indexed', 0)} files ({progress.get('chunks', 0)} chunks) "
+            f"in {format_duration(job['finished_at'] - job['started_at'])}. The knowledge base is ready.")
+    if job["error"]:
+        retry = " Retrying soon." if status == QUEUED else ""
+        st.caption(f"Attempt {job['attempts']}/{job['max_attempts']} failed: {job['error']}{retry}")
+
+    if status in (QUEUED, RUNNING):
+        if st.button("Cancel", key=f"cancel_{job['id']}", disabled=job["cancel_requested"]):
+            get_job_queue().cancel(job["id"])
+    if job["log_path"]:
+        with st.expander("Logs"):
+            # Only the end of the log is read, however long the ingestion runs.
+            st.code(read_log_tail(job["log_path"]), language="log")
+
+
+# The job list is refreshed every few seconds, without rerunning the rest of the page.
+@st.fragment(run_every=2)
+def show_jobs():
+    jobs = get_job_queue().list_jobs(limit=10)
+    if not jobs:
+        return
+    st.subheader("Ingestion Jobs")
+    for job in jobs:
+        show_job(job)
 
 
 # Main UI Logic
@@ -72,7 +101,7 @@ if st.button("Download and Index Repository"):
     if github_url:
         # Calculate the path where the repo would be cloned.
         storage_dir = "data/github_repos"
-        repo_name = github_url.split("/")[-1].replace(".git", "")
+        repo_name = repo_name_from_url(github_url)
         clone_path = os.path.join(storage_dir, repo_name)
 
         # Check if the directory already exists.
@@ -92,26 +121,23 @@ if st.button("Download and Index Repository"):
 if st.session_state.confirm_overwrite:
     st.warning(
         f"Repository already exists at: `{st.session_state.repo_to_overwrite}`"
-        "\n\nDo you want to delete the existing folder and re-index it?"
+        "\n\nDo you want to update it to the latest commit and re-index it?"
     )
 
     # Create two columns for the Yes/No buttons.
     col1, col2 = st.columns(2)
 
     with col1:
-        if st.button("Yes, Overwrite"):
-            # If user says yes, perform the deletion and start ingestion.
-            st.info(f"Deleting existing repository...")
-            shutil.rmtree(st.session_state.repo_to_overwrite)
-
-            # Start the ingestion process.
+        if st.button("Yes, Update and Re-index"):
+            # If user says yes, queue a full re-index. The job updates the existing clone
+            # in place (git fetch and reset) before indexing it again, nothing is deleted.
             start_ingestion(st.session_state.url_to_clone)
 
             # Reset the flags to exit the confirmation state.
             st.session_state.confirm_overwrite = False
             st.session_state.repo_to_overwrite = None
             st.session_state.url_to_clone = None
-            # Rerun to clean up the UI.
+            # Rerun to clean up the UI, the new job is listed below.
             st.rerun()
 
     with col2:
@@ -123,3 +149,5 @@ if st.session_state.confirm_overwrite:
             st.session_state.url_to_clone = None
             # We force a rerun to clean up the UI.
             st.rerun()
+
+show_jobs()
@@ -0,0 +1,67 @@
+# This script provides deterministic stand-ins for the embedding model and Gemini, so benchmarks run offline
+import hashlib
+import re
+import threading
+import time
+import zlib
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# The stub chat model is shipped with the service (--stub-llm), benchmarks reuse it.
+from ingest.stubs import FakeStreamingChatModel
+
+__all__ = ["FAKE_EMBEDDING_DIMENSION", "FakeEmbeddings", "FakeStreamingChatModel"]
+
+# Same dimension as BAAI/bge-small-en-v1.5, so index sizes match the real model.
+FAKE_EMBEDDING_DIMENSION = 384
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    A deterministic embedding model based on feature hashing of the words of a text.
+
+    Texts sharing words get similar vectors, so retrieval returns meaningful
+    neighbours. The model also counts the texts it embedded and the time it spent.
+    """
+
+    def __init__(self, dimension: int = FAKE_EMBEDDING_DIMENSION, seconds_per_text: float = 0.0):
+        """
+        Args:
+            dimension (int): The size of the vectors.
+            seconds_per_text (float): Simulated compute time per text, to mimic a real model.
+        """
+        self.dimension = dimension
+        self.seconds_per_text = seconds_per_text
+        self.texts_embedded = 0
+        self.embed_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for token in _TOKEN_PATTERN.findall(text.lower()):
+            bucket = zlib.crc32(token.encode("utf-8"))
+            vector[bucket % self.dimension] += 1.0 if bucket & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            # Texts without words still get a stable, distinct vector.
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:4], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+            norm = np.linalg.norm(vector)
+        return (vector / norm).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        start_time = time.perf_counter()
+        if self.seconds_per_text:
+            time.sleep(self.seconds_per_text * len(texts))
+        vectors = [self._embed(text) for text in texts]
+        with self._lock:
+            self.texts_embedded += len(texts)
+            self.embed_seconds += time.perf_counter() - start_time
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
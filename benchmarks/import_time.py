@@ -0,0 +1,77 @@
+# This script measures how long it takes to import each entry point, to catch start-up regressions
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Modules imported by the CLI, the Streamlit pages and the ingestion workers,
+# with the import time (in seconds) they are allowed to take.
+IMPORT_BUDGETS = {
+    "ingest.config": 0.05,
+    "ingest.logger": 0.05,
+    "ingest.tracing": 0.05,
+    "ingest.file_collector": 0.1,
+    "ingest.manifest": 0.5,
+    "ingest.embedding_generator": 0.1,
+    "ingest.chain_setup": 1.5,
+    "ingest.document_loader": 1.5,
+    "ingest.create_vectorstore": 2.0,
+}
+
+_TIMER = (
+    "import time; start = time.perf_counter(); import {module}; "
+    "print(time.perf_counter() - start)"
+)
+
+
+def measure_import_time(module: str, runs: int) -> float:
+    """
+    Imports a module in fresh interpreters and returns the median import time.
+
+    Args:
+        module (str): The module to import.
+        runs (int): How many interpreters to start.
+
+    Returns:
+        float: The median import time in seconds.
+    """
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", _TIMER.format(module=module)],
+            capture_output=True, text=True, check=True)
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+
+def main():
+    """
+    Measures the import time of every entry point and fails if one is over its budget.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5,
+                        help="Number of fresh interpreters per module")
+    parser.add_argument("--json", type=str, help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    over_budget = []
+    for module, budget in IMPORT_BUDGETS.items():
+        seconds = measure_import_time(module, args.runs)
+        results[module] = {"seconds": seconds, "budget": budget}
+        status = "ok" if seconds <= budget else "OVER BUDGET"
+        if seconds > budget:
+            over_budget.append(module)
+        print(f"{module:<30} {seconds * 1000:8.1f} ms  (budget {budget * 1000:.0f} ms)  {status}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if over_budget:
+        print(f"\n{len(over_budget)} module(s) over budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# This script benchmarks ingestion throughput and query latency offline, on a synthetic repository
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.fakes import FakeEmbeddings, FakeStreamingChatModel
+from benchmarks.synthetic_repo import DEFAULT_MIX, generate_repo, sample_questions
+from ingest import config
+from ingest.logger import logger
+from ingest.tracing import tracer
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """
+    Summarizes latencies given in seconds as milliseconds percentiles.
+    """
+    values = np.array(latencies) * 1000
+    summary = {f"p{p}_ms": float(np.percentile(values, p)) for p in PERCENTILES}
+    summary["mean_ms"] = float(values.mean())
+    summary["count"] = len(values)
+    return summary
+
+
+def peak_rss_mb() -> Dict[str, float]:
+    """
+    Returns the peak resident memory of this process and of its finished children (the loader workers).
+    """
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+        "children_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit,
+    }
+
+
+def directory_size(path: str) -> int:
+    """
+    Returns the total size in bytes of the files below a directory.
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for filename in files:
+            total += os.path.getsize(os.path.join(root, filename))
+    return total
+
+
+def current_commit() -> str:
+    """
+    Returns the commit of the DevMentor checkout being benchmarked, so results can be compared.
+    """
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """
+    Parses a file mix such as "code=0.6,markdown=0.4".
+    """
+    mix = {}
+    for part in value.split(","):
+        kind, _, share = part.partition("=")
+        mix[kind.strip()] = float(share)
+    return mix
+
+
+def run_benchmarks(work_dir: str, num_files: int, mix: Dict[str, float], file_size: int,
+                   workers: int, index_type: str, num_queries: int, k: int,
+                   embed_seconds_per_text: float, time_to_first_token: float,
+                   seconds_per_token: float, seed: int = 0) -> dict:
+    """
+    Generates a synthetic repository, ingests it and queries it with the fake models.
+
+    Args:
+        work_dir (str): Scratch directory for the repository and the vector store.
+        num_files (int): Number of files of the synthetic repository.
+        mix (Dict[str, float]): Share of each file type.
+        file_size (int): Approximate number of characters per file.
+        workers (int): Number of loader processes.
+        index_type (str): FAISS index type of the vector store.
+        num_queries (int): Number of questions for the latency measurements.
+        k (int): Number of retrieved chunks per question.
+        embed_seconds_per_text (float): Simulated embedding cost per chunk.
+        time_to_first_token (float): Simulated LLM time to first token.
+        seconds_per_token (float): Simulated LLM time between tokens.
+        seed (int): Seed of the synthetic repository and questions.
+
+    Returns:
+        dict: The benchmark results.
+    """
+    # Imported here so the fake embedder is installed before anything asks for the model.
+    from ingest.chain_setup import build_rag_chain, load_vector_store
+    from ingest.create_vectorstore import run_ingestion
+    from ingest.embedding_generator import set_embedding_model
+
+    embeddings = FakeEmbeddings(seconds_per_text=embed_seconds_per_text)
+    set_embedding_model(embeddings)
+
+    repo_path = os.path.join(work_dir, "repo")
+    store_path = os.path.join(work_dir, "store")
+    start_time = time.perf_counter()
+    generate_repo(repo_path, num_files, mix, file_size, seed)
+    print(f"Generated {num_files} files in {time.perf_counter() - start_time:.2f}s.", file=sys.stderr)
+
+    start_time = time.perf_counter()
+    ingestion = run_ingestion(repo_path, store_path, workers=workers, index_type=index_type)
+    ingest_seconds = time.perf_counter() - start_time
+    if ingestion is None:
+        raise RuntimeError("The synthetic repository produced no chunks.")
+    memory_after_ingestion = peak_rss_mb()
+    # Read now, the questions are embedded by the same model later on.
+    embedded_texts, embed_seconds = embeddings.texts_embedded, embeddings.embed_seconds
+    print(f"Ingested {ingestion['chunks']} chunks in {ingest_seconds:.2f}s.", file=sys.stderr)
+
+    load_times = []
+    for _ in range(3):
+        start_time = time.perf_counter()
+        vector_store = load_vector_store(store_path, embeddings)
+        load_times.append(time.perf_counter() - start_time)
+
+    questions = sample_questions(num_queries, seed)
+    retrieval_latencies = []
+    for question in questions:
+        start_time = time.perf_counter()
+        vector_store.similarity_search(question, k=k)
+        retrieval_latencies.append(time.perf_counter() - start_time)
+
+    llm = FakeStreamingChatModel(time_to_first_token=time_to_first_token,
+                                 seconds_per_token=seconds_per_token)
+    chain = build_rag_chain(vector_store.as_retriever(search_kwargs={"k": k}), llm)
+    first_token_latencies = []
+    total_latencies = []
+    for question in questions:
+        start_time = time.perf_counter()
+        first_token = None
+        for _ in chain.stream(question):
+            if first_token is None:
+                first_token = time.perf_counter() - start_time
+        total_latencies.append(time.perf_counter() - start_time)
+        first_token_latencies.append(first_token)
+    print(f"Ran {len(questions)} retrieval and end-to-end queries.", file=sys.stderr)
+
+    return {
+        "commit": current_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "params": {
+            "files": num_files, "mix": mix, "file_size": file_size, "workers": workers,
+            "index_type": index_type, "queries": num_queries, "k": k, "seed": seed,
+            "embed_seconds_per_text": embed_seconds_per_text,
+            "time_to_first_token": time_to_first_token, "seconds_per_token": seconds_per_token,
+            "chunker": config.CHUNKER, "chunk_token_budget": config.CHUNK_TOKEN_BUDGET,
+            "chunk_size": config.CHUNK_SIZE, "chunk_overlap": config.CHUNK_OVERLAP,
+            "embed_batch_size": config.EMBED_BATCH_SIZE,
+        },
+        "ingestion": {
+            "seconds": ingest_seconds,
+            "files": ingestion["files_indexed"],
+            "chunks": ingestion["chunks"],
+            "files_per_second": ingestion["files_indexed"] / ingest_seconds,
+            "chunks_per_second": ingestion["chunks"] / ingest_seconds,
+            "embedded_texts": embedded_texts,
+            "embed_seconds": embed_seconds,
+            "embed_texts_per_second": embedded_texts / embed_seconds if embed_seconds else 0.0,
+            "peak_rss": memory_after_ingestion,
+        },
+        "index": {
+            "size_bytes": directory_size(store_path),
+            "load_seconds": min(load_times),
+            "store_class": type(vector_store).__name__,
+        },
+        "retrieval": latency_summary(retrieval_latencies),
+        "end_to_end": {
+            "time_to_first_token": latency_summary(first_token_latencies),
+            "total": latency_summary(total_latencies),
+        },
+        "peak_rss": peak_rss_mb(),
+        # Per-stage totals, when run with DEVMENTOR_TRACING=1.
+        "stages": tracer.snapshot() if tracer.enabled else None,
+    }
+
+
+def main():
+    """
+    Runs the offline benchmark suite and prints (or writes) the results as JSON.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=200, help="Number of files of the synthetic repository")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help='Share of each file type, e.g. "code=0.6,markdown=0.25,notebook=0.1,pdf=0.05"')
+    parser.add_argument("--file-size", type=int, default=4000, help="Approximate characters per file")
+    parser.add_argument("--workers", type=int, default=config.INGEST_WORKERS,
+                        help="Number of processes used to load and split files")
+    parser.add_argument("--index-type", type=str, default=config.INDEX_TYPE,
+                        help="FAISS index type of the vector store")
+    parser.add_argument("--queries", type=int, default=50, help="Number of questions")
+    parser.add_argument("--k", type=int, default=5, help="Number of retrieved chunks per question")
+    parser.add_argument("--embed-ms-per-text", type=float, default=0.0,
+                        help="Simulated embedding cost per chunk in milliseconds")
+    parser.add_argument("--ttft-ms", type=float, default=300.0,
+                        help="Simulated LLM time to first token in milliseconds")
+    parser.add_argument("--token-ms", type=float, default=10.0,
+                        help="Simulated LLM time between tokens in milliseconds")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument("--work-dir", type=str,
+                        help="Keep the repository and vector store in this directory")
+    parser.add_argument("--json", type=str, help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    # Per-file log lines would dominate the run time of small files.
+    logger.setLevel(logging.WARNING)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="devmentor-bench-")
+    try:
+        results = run_benchmarks(
+            work_dir, args.files, args.mix, args.file_size, args.workers, args.index_type,
+            args.queries, args.k, args.embed_ms_per_text / 1000, args.ttft_ms / 1000,
+            args.token_ms / 1000, args.seed)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
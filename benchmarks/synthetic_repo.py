@@ -0,0 +1,156 @@
+# This script generates synthetic repositories of a given size and file mix for the benchmarks
+import json
+import os
+import random
+from typing import Dict, List
+
+# The share of each file type in a generated repository.
+DEFAULT_MIX = {"code": 0.6, "markdown": 0.25, "notebook": 0.1, "pdf": 0.05}
+
+_WORDS = (
+    "vector store index chunk embedding query retriever answer context model "
+    "repository commit branch module function class config loader parser token "
+    "cache batch worker process thread request response stream latency memory "
+    "file path manifest schema service handler client server session user"
+).split()
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _paragraph(rng: random.Random, sentences: int) -> str:
+    return " ".join(_sentence(rng, rng.randint(6, 14)) for _ in range(sentences))
+
+
+def _identifier(rng: random.Random) -> str:
+    return "_".join(rng.sample(_WORDS, 2))
+
+
+def _code_file(rng: random.Random, size: int) -> str:
+    parts = [f'"""{_paragraph(rng, 2)}"""\nimport os\n']
+    while sum(len(part) for part in parts) < size:
+        name = _identifier(rng)
+        parts.append(
+            f"\n\ndef {name}({_identifier(rng)}, {_identifier(rng)}=None):\n"
+            f'    """{_sentence(rng, 10)}"""\n'
+            f"    {_identifier(rng)} = os.path.join(str({_identifier(rng)}), '{rng.choice(_WORDS)}')\n"
+            f"    for item in range({rng.randint(1, 100)}):\n"
+            f"        if item % {rng.randint(2, 9)} == 0:\n"
+            f"            continue\n"
+            f"    return {_identifier(rng)}\n")
+    return "".join(parts)
+
+
+def _markdown_file(rng: random.Random, size: int) -> str:
+    parts = [f"# {_sentence(rng, 4)}\n"]
+    while sum(len(part) for part in parts) < size:
+        parts.append(f"\n## {_sentence(rng, 3)}\n\n{_paragraph(rng, rng.randint(3, 6))}\n")
+    return "".join(parts)
+
+
+def _notebook_file(rng: random.Random, size: int) -> str:
+    cells = []
+    written = 0
+    while written < size:
+        markdown = _paragraph(rng, 2)
+        code = f"{_identifier(rng)} = {rng.randint(0, 1000)}\nprint({_identifier(rng)})\n"
+        cells.append({"cell_type": "markdown", "metadata": {}, "source": [markdown]})
+        cells.append({"cell_type": "code", "execution_count": None, "metadata": {},
+                      "outputs": [], "source": [code]})
+        written += len(markdown) + len(code)
+    notebook = {"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 5}
+    return json.dumps(notebook, indent=1)
+
+
+def _pdf_file(rng: random.Random, size: int) -> bytes:
+    # A minimal single-page PDF with one text line per sentence, enough for PyPDFLoader.
+    lines = []
+    while sum(len(line) for line in lines) < size:
+        lines.append(_sentence(rng, rng.randint(6, 12)))
+    text_ops = ["BT", "/F1 10 Tf", "12 TL", "40 800 Td"]
+    for line in lines[:60]:
+        text_ops.append(f"({line}) Tj T*")
+    text_ops.append("ET")
+    stream = "\n".join(text_ops).encode("latin-1")
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+        b"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+    ]
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b"%010d 00000 n \n" % offset
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, xref_offset)
+    return bytes(pdf)
+
+
+_GENERATORS = {
+    "code": (".py", _code_file),
+    "markdown": (".md", _markdown_file),
+    "notebook": (".ipynb", _notebook_file),
+    "pdf": (".pdf", _pdf_file),
+}
+
+
+def generate_repo(path: str, num_files: int, mix: Dict[str, float] = None,
+                  file_size: int = 4000, seed: int = 0) -> List[str]:
+    """
+    Writes a synthetic repository. The same arguments always produce the same files.
+
+    Args:
+        path (str): The directory to create the repository in.
+        num_files (int): The number of files to write.
+        mix (Dict[str, float]): The share of each file type ("code", "markdown", "notebook", "pdf").
+        file_size (int): The approximate number of characters of text per file.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        List[str]: The paths of the written files.
+    """
+    mix = mix or DEFAULT_MIX
+    unknown = set(mix) - set(_GENERATORS)
+    if unknown:
+        raise ValueError(f"Unknown file types in mix: {', '.join(sorted(unknown))}")
+
+    rng = random.Random(seed)
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=num_files)
+    written = []
+    for number, kind in enumerate(kinds):
+        extension, generator = _GENERATORS[kind]
+        # Spread the files over a few nested packages, like a real repository.
+        directory = os.path.join(path, f"pkg_{number % 8}", f"module_{number % 3}")
+        os.makedirs(directory, exist_ok=True)
+        file_path = os.path.join(directory, f"{kind}_{number}{extension}")
+        content = generator(rng, rng.randint(file_size // 2, file_size * 3 // 2))
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        with open(file_path, "wb") as f:
+            f.write(content)
+        written.append(file_path)
+    return written
+
+
+def sample_questions(count: int, seed: int = 0) -> List[str]:
+    """
+    Returns distinct questions built from the vocabulary of the synthetic repositories.
+    """
+    rng = random.Random(seed + 1)
+    questions = []
+    while len(questions) < count:
+        question = (f"How does the {rng.choice(_WORDS)} {rng.choice(_WORDS)} use the "
+                    f"{rng.choice(_WORDS)} {rng.choice(_WORDS)}?")
+        if question not in questions:
+            questions.append(question)
+    return questions
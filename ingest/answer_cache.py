@@ -0,0 +1,420 @@
+# This script caches answers of the RAG chain, so repeated questions skip retrieval and the LLM
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import Runnable
+
+from .logger import logger
+from .tracing import tracer
+
+ANSWER_CACHE_FILENAME = "answer_cache.sqlite3"
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalizes a question for exact matching: case, spacing and trailing punctuation are ignored.
+    """
+    return re.sub(r"\s+", " ", question).strip().rstrip("?!. ").lower()
+
+
+def index_version(store_path: str) -> str:
+    """
+    Identifies the current content of a vector store, so re-ingestion invalidates cached answers.
+    """
+    for filename in ("manifest.json", "index.faiss"):
+        path = os.path.join(store_path, filename)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            return f"{stat.st_mtime_ns}-{stat.st_size}"
+    return "unknown"
+
+
+class AnswerCache:
+    """
+    A persistent cache of answers for one vector store.
+
+    Questions are matched exactly (after normalization) and, failing that, by
+    the cosine similarity of their embeddings. Entries expire after a TTL and
+    the least recently used ones are evicted above a maximum size. Entries of
+    other index versions are dropped when the cache is opened.
+    """
+
+    def __init__(self, cache_path: str, version: str, embeddings: Optional[Embeddings],
+                 similarity_threshold: float, max_entries: int, ttl_seconds: float,
+                 exact_only: Optional[Callable[[str], bool]] = None):
+        """
+        Args:
+            cache_path (str): The SQLite file storing the answers.
+            version (str): The version of the vector store the answers were produced from.
+            embeddings (Optional[Embeddings]): Embeds questions for semantic matching, None disables it.
+            similarity_threshold (float): Minimum cosine similarity of a semantic match.
+            max_entries (int): Maximum number of cached answers.
+            ttl_seconds (float): Age after which an answer is no longer served.
+            exact_only (Optional[Callable[[str], bool]]): Tells which questions are only
+                matched exactly, and never embedded (e.g. identifier lookups).
+        """
+        self.version = version
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.exact_only = exact_only
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(cache_path, timeout=30, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "version TEXT NOT NULL, question_key TEXT NOT NULL, vector BLOB, answer TEXT NOT NULL, "
+            "created REAL NOT NULL, last_access REAL NOT NULL, PRIMARY KEY (version, question_key))")
+        self._conn.execute("DELETE FROM answers WHERE version != ?", (version,))
+        self._conn.execute(
+            "DELETE FROM answers WHERE created < ?", (time.time() - ttl_seconds,))
+        self._conn.commit()
+
+        # Question vectors are kept in memory for semantic matching, the cache is small.
+        self._keys = []
+        self._vectors = []
+        for question_key, blob in self._conn.execute(
+                "SELECT question_key, vector FROM answers WHERE vector IS NOT NULL"):
+            self._keys.append(question_key)
+            self._vectors.append(np.frombuffer(blob, dtype=np.float32))
+        logger.info(f"Answer cache opened with {len(self._keys)} entries.")
+
+    @staticmethod
+    def _key(question: str) -> str:
+        return hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+
+    def _embed(self, question: str) -> Optional[np.ndarray]:
+        if self.embeddings is None or (self.exact_only is not None and self.exact_only(question)):
+            return None
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _fetch(self, question_key: str) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT answer, created FROM answers WHERE version = ? AND question_key = ?",
+            (self.version, question_key)).fetchone()
+        if row is None:
+            return None
+        answer, created = row
+        if time.time() - created > self.ttl_seconds:
+            self._delete(question_key)
+            return None
+        self._conn.execute(
+            "UPDATE answers SET last_access = ? WHERE version = ? AND question_key = ?",
+            (time.time(), self.version, question_key))
+        self._conn.commit()
+        return answer
+
+    def _delete(self, question_key: str) -> None:
+        self._conn.execute(
+            "DELETE FROM answers WHERE version = ? AND question_key = ?", (self.version, question_key))
+        self._conn.commit()
+        if question_key in self._keys:
+            position = self._keys.index(question_key)
+            del self._keys[position]
+            del self._vectors[position]
+
+    def lookup_exact(self, question: str) -> Optional[str]:
+        """
+        Returns the cached answer of this exact question (after normalization), without embedding it.
+        """
+        with self._lock:
+            return self._fetch(self._key(question))
+
+    def lookup(self, question: str) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """
+        Returns the cached answer of a question or of a near-duplicate one.
+
+        Args:
+            question (str): The user's question.
+
+        Returns:
+            Tuple[Optional[str], Optional[np.ndarray]]: The cached answer, or None on a
+            miss, and the normalized question vector if it was computed, to pass to store.
+        """
+        question_key = self._key(question)
+        with self._lock:
+            answer = self._fetch(question_key)
+            if answer is not None:
+                self.exact_hits += 1
+                tracer.count("answer_cache", result="exact")
+                return answer, None
+            has_vectors = bool(self._vectors)
+
+        vector = self._embed(question) if has_vectors else None
+        if vector is not None:
+            with self._lock:
+                if self._vectors:
+                    similarities = np.stack(self._vectors) @ vector
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.similarity_threshold:
+                        answer = self._fetch(self._keys[best])
+                        if answer is not None:
+                            self.semantic_hits += 1
+                            tracer.count("answer_cache", result="semantic")
+                            return answer, vector
+        with self._lock:
+            self.misses += 1
+        tracer.count("answer_cache", result="miss")
+        return None, vector
+
+    def store(self, question: str, answer: str, vector: Optional[np.ndarray] = None) -> None:
+        """
+        Caches the answer of a question, evicting the least recently used answers if needed.
+
+        Args:
+            question (str): The user's question.
+            answer (str): Its answer.
+            vector (Optional[np.ndarray]): The question vector returned by lookup, so the
+                question is not embedded again; computed here if None.
+        """
+        question_key = self._key(question)
+        if vector is None:
+            vector = self._embed(question)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (version, question_key, vector, answer, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self.version, question_key, None if vector is None else vector.tobytes(), answer, now, now))
+            if vector is not None and question_key not in self._keys:
+                self._keys.append(question_key)
+                self._vectors.append(vector)
+            evicted = self._conn.execute(
+                "SELECT question_key FROM answers WHERE version = ? ORDER BY last_access DESC LIMIT -1 OFFSET ?",
+                (self.version, self.max_entries)).fetchall()
+            self._conn.commit()
+        for (evicted_key,) in evicted:
+            with self._lock:
+                self._delete(evicted_key)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the hit and miss counters of this process.
+        """
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            total = hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "entries": len(self._keys),
+            }
+
+
+class _InFlight:
+    """
+    An answer being generated, which identical concurrent questions can follow.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.chunks = []
+        self.done = False
+        self.failed = False
+        # Called, under the condition, whenever chunks are added or the answer ends (async followers).
+        self.listeners = []
+
+    def publish(self, chunk: Any = None, done: bool = False, failed: bool = False) -> None:
+        with self.condition:
+            if done:
+                self.done = True
+                self.failed = failed
+            else:
+                self.chunks.append(chunk)
+            self.condition.notify_all()
+            for listener in self.listeners:
+                listener()
+
+
+class CoalescedRequestFailed(RuntimeError):
+    """
+    The request a caller was following failed after part of its answer had been streamed.
+    """
+
+
+class CachedRagChain(Runnable):
+    """
+    Wraps the RAG chain with an AnswerCache.
+
+    Cache hits are returned without retrieval or LLM call. When the same question
+    is asked again while its answer is still being generated, the second caller
+    follows the first one's stream instead of starting another LLM call. Chunks
+    that are not text (e.g. the sources the query service streams first) are
+    passed to followers but not cached. Callers may be threads (stream, in the
+    app) or coroutines (astream, in the query service), and follow each other.
+    """
+
+    def __init__(self, chain: Runnable, cache: AnswerCache):
+        self.chain = chain
+        self.cache = cache
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+
+    def _join(self, question: str):
+        # Returns the in-flight entry of the question and whether this caller leads it, or
+        # the answer a leader stored since this caller's lookup.
+        key = normalize_question(question)
+        with self._in_flight_lock:
+            entry = self._in_flight.get(key)
+            if entry is not None:
+                return key, entry, False, None
+            # Leaders store their answer before leaving the table, under this lock: a caller that
+            # missed the cache just before that finds the answer here instead of asking the LLM again.
+            answer = self.cache.lookup_exact(question)
+            if answer is not None:
+                return key, None, False, answer
+            entry = _InFlight()
+            self._in_flight[key] = entry
+            return key, entry, True, None
+
+    def _finish(self, key: str, entry: _InFlight, failed: bool) -> None:
+        with self._in_flight_lock:
+            self._in_flight.pop(key, None)
+        entry.publish(done=True, failed=failed)
+
+    @staticmethod
+    def _answer(entry: _InFlight) -> str:
+        return "".join(chunk for chunk in entry.chunks if isinstance(chunk, str))
+
+    def _follow(self, entry: _InFlight) -> Iterator[Any]:
+        # Yields the leader's chunks as they arrive. Raises if the leader failed.
+        position = 0
+        while True:
+            with entry.condition:
+                while position == len(entry.chunks) and not entry.done:
+                    entry.condition.wait()
+                new_chunks = entry.chunks[position:]
+                done, failed = entry.done, entry.failed
+            position += len(new_chunks)
+            yield from new_chunks
+            if done:
+                if failed:
+                    raise CoalescedRequestFailed("The coalesced request failed.")
+                return
+
+    async def _afollow(self, entry: _InFlight) -> AsyncIterator[Any]:
+        # Like _follow, without blocking the event loop while waiting for the leader.
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+
+        def notify():
+            loop.call_soon_threadsafe(changed.set)
+
+        with entry.condition:
+            entry.listeners.append(notify)
+        try:
+            position = 0
+            while True:
+                with entry.condition:
+                    new_chunks = entry.chunks[position:]
+                    done, failed = entry.done, entry.failed
+                    if not new_chunks and not done:
+                        # Cleared under the condition, so a chunk published after this still wakes us.
+                        changed.clear()
+                if not new_chunks and not done:
+                    await changed.wait()
+                    continue
+                position += len(new_chunks)
+                for chunk in new_chunks:
+                    yield chunk
+                if done:
+                    if failed:
+                        raise CoalescedRequestFailed("The coalesced request failed.")
+                    return
+        finally:
+            with entry.condition:
+                entry.listeners.remove(notify)
+
+    def stream(self, input: str, config: Optional[Any] = None, **kwargs: Any) -> Iterator[Any]:
+        answer, vector = self.cache.lookup(input)
+        if answer is not None:
+            yield answer
+            return
+
+        key, entry, leader, answer = self._join(input)
+        if answer is not None:
+            yield answer
+            return
+        if not leader:
+            followed = 0
+            try:
+                for chunk in self._follow(entry):
+                    followed += 1
+                    yield chunk
+                return
+            except CoalescedRequestFailed:
+                # Part of an answer cannot be completed by another one, only a caller that got
+                # nothing yet answers the question independently.
+                if followed:
+                    raise
+            yield from self.chain.stream(input, config, **kwargs)
+            return
+
+        completed = False
+        try:
+            for chunk in self.chain.stream(input, config, **kwargs):
+                entry.publish(chunk)
+                yield chunk
+            # Stored before leaving the in-flight table, see _join.
+            self.cache.store(input, self._answer(entry), vector)
+            completed = True
+        finally:
+            self._finish(key, entry, failed=not completed)
+
+    async def astream(self, input: str, config: Optional[Any] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        answer, vector = await asyncio.to_thread(self.cache.lookup, input)
+        if answer is not None:
+            yield answer
+            return
+
+        key, entry, leader, answer = await asyncio.to_thread(self._join, input)
+        if answer is not None:
+            yield answer
+            return
+        if not leader:
+            followed = 0
+            try:
+                async for chunk in self._afollow(entry):
+                    followed += 1
+                    yield chunk
+                return
+            except CoalescedRequestFailed:
+                if followed:
+                    raise
+            async for chunk in self.chain.astream(input, config, **kwargs):
+                yield chunk
+            return
+
+        completed = False
+        try:
+            async for chunk in self.chain.astream(input, config, **kwargs):
+                entry.publish(chunk)
+                yield chunk
+            await asyncio.to_thread(self.cache.store, input, self._answer(entry), vector)
+            completed = True
+        finally:
+            self._finish(key, entry, failed=not completed)
+
+    def invoke(self, input: str, config: Optional[Any] = None, **kwargs: Any) -> str:
+        return "".join(chunk for chunk in self.stream(input, config, **kwargs) if isinstance(chunk, str))
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the statistics of the answer cache.
+        """
+        return self.cache.stats()
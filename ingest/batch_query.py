@@ -0,0 +1,267 @@
+# This script answers a file of questions in batch, with vectorized retrieval and concurrent LLM calls
+import asyncio
+import json
+import random
+import time
+from typing import Iterator, List, Optional, TextIO
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from . import config
+from .embedding_cache import CachedEmbeddings
+from .logger import logger
+from .tracing import tracer
+
+# Error class names and message fragments of the rate-limit errors of LLM providers.
+_RATE_LIMIT_ERRORS = ("ResourceExhausted", "RateLimitError", "TooManyRequests")
+_RATE_LIMIT_MESSAGES = ("429", "rate limit", "quota", "resource exhausted")
+
+
+def read_questions(input_file: TextIO) -> List[dict]:
+    """
+    Reads questions from JSONL, one {"question": ..., "id": ...} object (or plain JSON string) per line.
+
+    Args:
+        input_file (TextIO): The open JSONL file.
+
+    Returns:
+        List[dict]: The questions with their id, the line number when none is given.
+    """
+    questions = []
+    for line_number, line in enumerate(input_file, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if isinstance(record, str):
+            record = {"question": record}
+        if not record.get("question"):
+            raise ValueError(f"Line {line_number} has no question.")
+        record.setdefault("id", line_number)
+        questions.append(record)
+    return questions
+
+
+def embed_questions(embeddings: Embeddings, questions: List[str]) -> np.ndarray:
+    """
+    Embeds all questions in one batch.
+    """
+    # Like embed_query, questions bypass the embedding cache, which is meant for chunks.
+    if isinstance(embeddings, CachedEmbeddings):
+        embeddings = embeddings.embeddings
+    return np.asarray(embeddings.embed_documents(questions), dtype=np.float32)
+
+
+def retrieve_batch(vector_store, query_vectors: np.ndarray, k: int) -> List[List[Document]]:
+    """
+    Runs a single multi-query search and returns the chunks retrieved for each query.
+
+    Args:
+        vector_store (MmapVectorStore | FAISS): The vector store to search.
+        query_vectors (np.ndarray): The question embeddings, one per row.
+        k (int): The number of chunks per question.
+
+    Returns:
+        List[List[Document]]: The chunks of each question, most relevant first.
+    """
+    if hasattr(vector_store, "search_vectors_batch"):
+        _, positions = vector_store.search_vectors_batch(query_vectors, k)
+        unique = sorted({int(p) for row in positions for p in row if p >= 0})
+        by_position = dict(zip(unique, vector_store.get_documents(unique)))
+        return [[by_position[int(p)] for p in row if p >= 0] for row in positions]
+
+    # Pickled FAISS stores: search the index directly, then read the docstore.
+    _, positions = vector_store.index.search(query_vectors, k)
+    results = []
+    for row in positions:
+        documents = []
+        for position in row:
+            if position < 0:
+                continue
+            chunk_id = vector_store.index_to_docstore_id[int(position)]
+            documents.append(vector_store.docstore.search(chunk_id))
+        results.append(documents)
+    return results
+
+
+def retrieve_questions(vector_store, questions: List[str], k: int, symbol_index=None,
+                       history_store=None) -> List[List[Document]]:
+    """
+    Retrieves the chunks of a group of questions like the chat's retriever, with one multi-query search.
+
+    Pure identifier lookups are answered from the symbol index and never embedded,
+    like HybridRetriever does; the other questions are embedded in one batch and
+    searched together, their symbol hits fused with the vector hits. Questions
+    about the history also search the commit history with their vector, like
+    HistoryRetriever does.
+
+    Args:
+        vector_store (MmapVectorStore | FAISS): The vector store to search.
+        questions (List[str]): The questions.
+        k (int): The number of chunks per question.
+        symbol_index (Optional[SymbolIndex]): The symbol index of the store, if any.
+        history_store: The commit history store of the repository, if any.
+
+    Returns:
+        List[List[Document]]: The chunks of each question, most relevant first.
+    """
+    from .git_history import is_history_question
+    from .symbol_index import fuse
+
+    results: List[Optional[List[Document]]] = [None] * len(questions)
+    symbol_hits = [[] for _ in questions]
+    if symbol_index is not None:
+        with tracer.span("symbol_lookup", questions=len(questions)):
+            for number, question in enumerate(questions):
+                symbol_query = symbol_index.parse_query(question)
+                symbol_hits[number] = symbol_index.documents(
+                    vector_store, symbol_index.lookup(symbol_query, k))
+                if symbol_hits[number] and symbol_query.pure:
+                    results[number] = symbol_hits[number]
+    history = [history_store is not None and is_history_question(question) for question in questions]
+    # Lookups are only embedded when the commit history must be searched too.
+    embedded = [number for number in range(len(questions)) if results[number] is None or history[number]]
+    if not embedded:
+        return results
+
+    query_vectors = embed_questions(vector_store.embeddings, [questions[number] for number in embedded])
+    vector_hits = retrieve_batch(vector_store, query_vectors, k)
+    for number, query_vector, hits in zip(embedded, query_vectors, vector_hits):
+        if results[number] is not None:
+            hits = results[number]
+        elif symbol_hits[number]:
+            hits = fuse([symbol_hits[number], hits], k)
+        if history[number]:
+            commits = history_store.similarity_search_by_vector(query_vector.tolist(), k=k)
+            hits = fuse([hits, commits], k)
+        results[number] = hits
+    return results
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """
+    Tells whether an LLM error is a rate limit (HTTP 429 / quota) that is worth retrying later.
+    """
+    if type(error).__name__ in _RATE_LIMIT_ERRORS:
+        return True
+    message = str(error).lower()
+    return any(fragment in message for fragment in _RATE_LIMIT_MESSAGES)
+
+
+def _sources(documents: List[Document]) -> List[dict]:
+    return [{"id": doc.id, "source": doc.metadata.get("source"),
+             "start_index": doc.metadata.get("start_index"), "start_line": doc.metadata.get("start_line"),
+             "end_line": doc.metadata.get("end_line")} for doc in documents]
+
+
+async def _answer_one(answer_chain, record: dict, documents: List[Document], context: str,
+                      semaphore: asyncio.Semaphore, max_retries: int, backoff_seconds: float) -> dict:
+    result = {"id": record["id"], "question": record["question"], "sources": _sources(documents)}
+    async with semaphore:
+        start_time = time.perf_counter()
+        for attempt in range(max_retries + 1):
+            try:
+                chunks = []
+                async for chunk in answer_chain.astream(
+                        {"context": context, "question": record["question"]}):
+                    chunks.append(chunk)
+                result["answer"] = "".join(chunks)
+                break
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == max_retries:
+                    logger.warning(f"Question {record['id']} failed: {e}")
+                    result["error"] = f"{type(e).__name__}: {e}"
+                    break
+                # Exponential backoff with jitter, so throttled requests do not retry in lockstep.
+                delay = backoff_seconds * 2 ** attempt * (0.5 + random.random())
+                tracer.count("llm_rate_limited")
+                logger.info(f"Rate limited on question {record['id']}, retrying in {delay:.1f}s.")
+                await asyncio.sleep(delay)
+        result["attempts"] = attempt + 1
+        result["seconds"] = time.perf_counter() - start_time
+    return result
+
+
+async def answer_batch(answer_chain, records: List[dict], documents: List[List[Document]],
+                       concurrency: int, max_retries: int = config.BATCH_MAX_RETRIES,
+                       backoff_seconds: float = config.BATCH_BACKOFF_SECONDS):
+    """
+    Answers the questions concurrently, yielding each result as soon as it is ready.
+
+    At most `concurrency` LLM calls run at the same time. Rate-limit errors are
+    retried with exponential backoff, other errors are reported in the result.
+
+    Args:
+        answer_chain: The runnable built by chain_setup.build_answer_chain.
+        records (List[dict]): The questions, as returned by read_questions.
+        documents (List[List[Document]]): The retrieved chunks of each question.
+        concurrency (int): The maximum number of concurrent LLM calls.
+        max_retries (int): How many times a rate-limited call is retried.
+        backoff_seconds (float): The delay before the first retry.
+
+    Yields:
+        dict: The id, question, answer (or error), sources, attempts and seconds of each question.
+    """
+    from .chain_setup import format_docs
+
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [
+        asyncio.create_task(_answer_one(
+            answer_chain, record, docs, format_docs(docs), semaphore, max_retries, backoff_seconds))
+        for record, docs in zip(records, documents)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _batches(records: List[dict], size: int) -> Iterator[List[dict]]:
+    for start in range(0, len(records), size):
+        yield records[start:start + size]
+
+
+async def run_batch(vector_store, llm, records: List[dict], output_file: TextIO, k: int,
+                    concurrency: int, symbol_index=None, history_store=None) -> dict:
+    """
+    Answers a list of questions and writes one JSON line per answer to output_file.
+
+    Questions are processed in groups of BATCH_QUERY_GROUP_SIZE: each group is
+    retrieved by retrieve_questions (one embedding call and one multi-query
+    search), then its LLM calls run concurrently. Lines are written in
+    completion order.
+
+    Args:
+        vector_store (MmapVectorStore | FAISS): The vector store to search.
+        llm: The chat model generating the answers.
+        records (List[dict]): The questions, as returned by read_questions.
+        output_file (TextIO): The JSONL file receiving the results.
+        k (int): The number of chunks retrieved per question.
+        concurrency (int): The maximum number of concurrent LLM calls.
+        symbol_index (Optional[SymbolIndex]): The symbol index of the store, if any.
+        history_store: The commit history store of the repository, if any.
+
+    Returns:
+        dict: The number of answered and failed questions and the elapsed time.
+    """
+    from .chain_setup import build_answer_chain
+
+    answer_chain = build_answer_chain(llm)
+    start_time = time.perf_counter()
+    answered = failed = 0
+    for group in _batches(records, config.BATCH_QUERY_GROUP_SIZE):
+        with tracer.span("batch_retrieve", questions=len(group)):
+            documents = retrieve_questions(
+                vector_store, [record["question"] for record in group], k, symbol_index, history_store)
+        async for result in answer_batch(answer_chain, group, documents, concurrency):
+            output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output_file.flush()
+            if "error" in result:
+                failed += 1
+            else:
+                answered += 1
+        logger.info(f"{answered + failed}/{len(records)} questions processed.")
+    return {"answered": answered, "failed": failed, "seconds": time.perf_counter() - start_time}
@@ -1,75 +1,328 @@
 # This script is main engine of our code
 import os
+import threading
+from functools import partial
+from typing import Tuple
 import streamlit as st
 from dotenv import load_dotenv
 
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.output_parsers import StrOutputParser
-
-from ingest.embedding_generator import embedding_model
+from ingest.embedding_generator import get_embedding_model
 from ingest.logger import logger
+from ingest.tracing import tracer
 from ingest import config
 
+# The StoreManager holding the loaded RAG chains, created on first use.
+_store_manager = None
+_store_manager_lock = threading.Lock()
+
 # Helper function to reduce context leakage
 def format_docs(docs):
     """
-    Formats a list of LangChain Document objects into a single string,
-    joining their page_content with newlines.
+    Formats a list of LangChain Document objects into a single string.
+
+    Overlapping chunks of the same file are merged, duplicates are dropped and
+    the result is cut to config.CONTEXT_TOKEN_BUDGET tokens.
     """
-    return "\n\n".join(doc.page_content for doc in docs)
+    from ingest.context_packer import pack_context
 
-@st.cache_resource
-def load_rag_chain(repo_name: str):
+    with tracer.span("pack_context", chunks=len(docs)):
+        context, stats = pack_context(docs, config.CONTEXT_TOKEN_BUDGET)
+    tracer.count("context_tokens", stats["tokens_out"])
+    tracer.count("context_tokens_saved", stats["tokens_saved"])
+    logger.info(
+        f"Context packed: {stats['chunks']} chunks into {stats['segments']} segments, "
+        f"{stats['tokens_out']} tokens ({stats['tokens_saved']} saved).")
+    return context
+
+def load_vector_store(store_path: str, embeddings):
     """
-    Loads and configures the complete RAG chain.
+    Opens a vector store for querying.
 
-    This function handles all the expensive setup operations, including loading the
-    FAISS vector store and initializing the Gemini language model. It uses
-    Streamlit's caching to ensure this setup runs only once.
+    Args:
+        store_path (str): The directory of the vector store.
+        embeddings (Embeddings): The model used to embed questions.
 
     Returns:
-        A runnable LangChain object representing the RAG chain.
+        The vector store, or None if it does not exist.
     """
-    # Load environment variables from .env file for the GOOGLE_API_KEY.
-    load_dotenv()
-    logger.info("Environment variables loaded.")
-    vector_store_dir = "data/vector_stores"
-    store_path = os.path.join(vector_store_dir, repo_name)
+    from langchain_community.vectorstores import FAISS
+    from ingest.index_factory import load_index_meta, apply_search_params
+    from ingest.mmap_store import MmapVectorStore, has_mmap_store
+
     if not os.path.exists(store_path):
         logger.warning(
             "Vector Store is not yet created.")
         return None
-    # Load the FAISS vector store from the local disk.
     logger.info(
         f"Attempting to load vector store from path: '{store_path}'")
-    db = FAISS.load_local(
-        store_path,
-        embeddings=embedding_model,
-        allow_dangerous_deserialization=True
-    )
+    with tracer.span("load_store", path=store_path):
+        if has_mmap_store(store_path):
+            # Memory-mapped stores open in milliseconds and never unpickle anything.
+            db = MmapVectorStore(store_path, embeddings)
+        else:
+            # Stores built before the memory-mapped format fall back to the pickled FAISS store.
+            db = FAISS.load_local(
+                store_path,
+                embeddings=embeddings,
+                allow_dangerous_deserialization=True
+            )
+            # Approximate indexes need their query-time parameters (nprobe / efSearch) set again.
+            apply_search_params(db.index, load_index_meta(store_path))
     logger.info("Vector store loaded successfully.")
+    return db
 
-    # Create a retriever from the vector store to fetch relevant documents.
-    retriever = db.as_retriever(search_kwargs={"k": 5})
 
-    # Initialize the Google Gemini language model.
+def create_llm():
+    """
+    Creates the Google Gemini chat model answering the questions.
+    """
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    # Load environment variables from .env file for the GOOGLE_API_KEY.
+    load_dotenv()
     logger.info("Initializing Google Gemini model...")
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0.1)
+    return ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0.1)
+
+
+def build_answer_chain(llm):
+    """
+    Builds the generation half of the RAG chain, which answers a question from an
+    already formatted context.
+
+    Args:
+        llm: The chat model generating the answer.
+
+    Returns:
+        A runnable taking {"context": str, "question": str} and returning the answer.
+    """
+    from langchain_core.prompts import PromptTemplate
+    from langchain_core.output_parsers import StrOutputParser
 
     # Create the prompt template from the config file.
     prompt = PromptTemplate.from_template(config.RAG_PROMPT_TEMPLATE)
+    return prompt | llm | StrOutputParser()
+
+
+def load_search_indexes(store_path: str, embeddings):
+    """
+    Loads what is searched along with a vector store: its symbol index and its commit history.
+
+    Args:
+        store_path (str): The directory of the vector store.
+        embeddings (Embeddings): The model used to embed questions.
+
+    Returns:
+        Tuple: The SymbolIndex (None if disabled or missing) and the history
+        vector store (None if the history was not ingested).
+    """
+    from ingest.git_history import history_path
+    from ingest.symbol_index import SymbolIndex
+
+    symbol_index = SymbolIndex.load(store_path) if config.SYMBOL_INDEX_ENABLED else None
+    history_store = None
+    if os.path.exists(history_path(store_path)):
+        history_store = load_vector_store(history_path(store_path), embeddings)
+    return symbol_index, history_store
+
+
+def build_retriever(vector_store, symbol_index, history_store, k: int):
+    """
+    Builds the retriever of a repository from the indexes returned by load_search_indexes.
+
+    Args:
+        vector_store: The vector store of the repository.
+        symbol_index (Optional[SymbolIndex]): Answers identifier and file lookups, fused with vector search.
+        history_store: The commit history store, searched for questions about the history.
+        k (int): The number of chunks retrieved.
+
+    Returns:
+        BaseRetriever: The retriever.
+    """
+    from ingest.git_history import HistoryRetriever
+    from ingest.symbol_index import HybridRetriever
+
+    if symbol_index is not None:
+        retriever = HybridRetriever(vector_store=vector_store, symbol_index=symbol_index, k=k)
+    else:
+        retriever = vector_store.as_retriever(search_kwargs={"k": k})
+    if history_store is not None:
+        retriever = HistoryRetriever(retriever=retriever, history_store=history_store, k=k)
+    return retriever
+
+
+def build_rag_chain(retriever, llm):
+    """
+    Builds the RAG chain around a retriever and a chat model.
+
+    Args:
+        retriever: Fetches the documents relevant to a question.
+        llm: The chat model generating the answer.
+
+    Returns:
+        A runnable LangChain object representing the RAG chain.
+    """
+    from langchain_core.runnables import RunnablePassthrough
 
     # Define the RAG chain using LangChain Expression Language (LCEL).
     rag_chain = (
         {"context": retriever|format_docs, "question": RunnablePassthrough()}
-        | prompt
-        | llm
-        | StrOutputParser()
+        | build_answer_chain(llm)
     )
     logger.info("RAG chain created.")
 
-    # Return the fully constructed RAG chain.
+    # Time retrieval, prompt building and the LLM of every question when tracing is enabled.
+    if tracer.enabled:
+        from ingest.trace_callbacks import TracingCallbackHandler
+        rag_chain = rag_chain.with_config(callbacks=[TracingCallbackHandler(tracer)])
     return rag_chain
+
+
+class KnowledgeBase:
+    """
+    What is kept loaded for one repository: its vector store and its RAG chain.
+    """
+
+    def __init__(self, vector_store, rag_chain):
+        self.vector_store = vector_store
+        self.rag_chain = rag_chain
+
+
+def create_knowledge_base(repo_name: str):
+    """
+    Loads the vector store of a repository and configures its complete RAG chain.
+
+    This function handles all the expensive setup operations, including loading the
+    FAISS vector store and initializing the Gemini language model. Use
+    load_rag_chain or load_knowledge_base, which cache the result, instead of
+    calling it directly.
+
+    Returns:
+        Optional[KnowledgeBase]: The vector store and RAG chain, or None if the
+        vector store does not exist.
+    """
+    # LangChain, FAISS and Gemini are imported here so importing this module stays cheap.
+    from ingest.answer_cache import (AnswerCache, CachedRagChain, ANSWER_CACHE_FILENAME,
+                                     index_version)
+    from ingest.symbol_index import is_identifier_lookup
+
+    # Load environment variables from .env file for the GOOGLE_API_KEY.
+    load_dotenv()
+    logger.info("Environment variables loaded.")
+    vector_store_dir = "data/vector_stores"
+    store_path = os.path.join(vector_store_dir, repo_name)
+    db = load_vector_store(store_path, get_embedding_model())
+    if db is None:
+        return None
+
+    # Identifiers and file names named by the question are looked up exactly as well, and
+    # questions about why and when the code changed also search the commit history.
+    symbol_index, history_db = load_search_indexes(store_path, get_embedding_model())
+    retriever = build_retriever(db, symbol_index, history_db, k=5)
+
+    # Initialize the Google Gemini language model.
+    rag_chain = build_rag_chain(retriever, create_llm())
+    if config.METRICS_PORT:
+        tracer.start_metrics_server(config.METRICS_PORT)
+
+    # Serve repeated and near-duplicate questions from the answer cache.
+    if config.ANSWER_CACHE_ENABLED:
+        cache = AnswerCache(
+            os.path.join(store_path, ANSWER_CACHE_FILENAME),
+            version=index_version(store_path),
+            embeddings=get_embedding_model(),
+            similarity_threshold=config.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+            max_entries=config.ANSWER_CACHE_MAX_ENTRIES,
+            ttl_seconds=config.ANSWER_CACHE_TTL_SECONDS,
+            # "Where is X defined?" is close to "Where is Y defined?", only exact repeats are served.
+            exact_only=partial(is_identifier_lookup, symbol_index) if symbol_index is not None else None)
+        rag_chain = CachedRagChain(rag_chain, cache)
+
+    # Return the fully constructed RAG chain.
+    return KnowledgeBase(db, rag_chain)
+
+
+def get_store_manager():
+    """
+    Returns the StoreManager caching the knowledge bases of this process, creating it on first use.
+    """
+    global _store_manager
+    if _store_manager is None:
+        with _store_manager_lock:
+            if _store_manager is None:
+                from ingest.store_manager import StoreManager
+                _store_manager = StoreManager(
+                    create_knowledge_base,
+                    store_dir="data/vector_stores",
+                    memory_budget_bytes=config.STORE_MEMORY_BUDGET_MB * 1024 * 1024,
+                    check_interval_seconds=config.STORE_RELOAD_CHECK_SECONDS)
+    return _store_manager
+
+
+def load_rag_chain(repo_name: str):
+    """
+    Returns the RAG chain of a repository, loading it on first use.
+
+    Chains are shared by every session of the process. The least recently used
+    ones are unloaded above config.STORE_MEMORY_BUDGET_MB, and a chain is
+    rebuilt in the background when its store is re-ingested.
+
+    Returns:
+        A runnable LangChain object representing the RAG chain, or None if the
+        vector store does not exist.
+    """
+    knowledge_base = get_store_manager().get(repo_name)
+    return knowledge_base.rag_chain if knowledge_base is not None else None
+
+
+def load_knowledge_base(repo_name: str):
+    """
+    Returns the KnowledgeBase of a repository (see load_rag_chain), or None if
+    the vector store does not exist.
+    """
+    return get_store_manager().get(repo_name)
+
+
+@st.cache_resource
+def load_federated_chain(repo_names: Tuple[str, ...]):
+    """
+    Builds a RAG chain answering from several knowledge bases at once.
+
+    The question is embedded once and the vector stores are searched in parallel;
+    the hits are merged into one top-k, each tagged with its repository.
+
+    Args:
+        repo_names (Tuple[str, ...]): The repositories to search.
+
+    Returns:
+        A runnable LangChain object representing the RAG chain.
+    """
+    from ingest.federated_search import FederatedRetriever
+
+    def get_vector_store(repo_name):
+        knowledge_base = load_knowledge_base(repo_name)
+        return knowledge_base.vector_store if knowledge_base is not None else None
+
+    retriever = FederatedRetriever(
+        repo_names=list(repo_names), k=5, get_vector_store=get_vector_store,
+        embeddings=get_embedding_model())
+    return build_rag_chain(retriever, create_llm())
+
+
+@st.cache_resource
+def warm_up(repo_names=()):
+    """
+    Loads the embedding model, and optionally the RAG chains of some repositories,
+    ahead of the first question. Everything is otherwise loaded lazily on first use.
+
+    Server deployments that prefer paying the start-up cost once can enable it
+    with the DEVMENTOR_WARM_UP environment variable.
+
+    Args:
+        repo_names (Tuple[str]): The repositories whose RAG chain should be preloaded.
+    """
+    logger.info("Warming up the embedding model...")
+    # Embedding a query forces the model weights to be fully initialized.
+    get_embedding_model().embed_query("warm up")
+    for repo_name in repo_names:
+        load_rag_chain(repo_name)
+    logger.info("Warm-up complete.")
@@ -0,0 +1,280 @@
+# This script splits documents into chunks that fill the embedding model's token window along the structure of their content
+import ast
+import bisect
+import math
+import os
+import re
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from . import config
+from .logger import logger
+
+# Loader workers are already one per core, the tokenizer's own thread pool would oversubscribe them.
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+# Languages split on the definitions matched by _DEFINITION_RE.
+_CODE_EXTS = {
+    ".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx", ".java", ".kt", ".kts", ".scala", ".go", ".rs",
+    ".c", ".h", ".cc", ".cpp", ".cxx", ".hpp", ".cs", ".swift", ".rb", ".php", ".lua", ".pl",
+    ".r", ".jl", ".ex", ".exs", ".sh", ".bash", ".zsh",
+}
+_MARKDOWN_EXTS = {".md", ".markdown", ".mdx"}
+
+# A line starting a function, class or similar definition, after optional modifiers.
+_DEFINITION_RE = re.compile(
+    r"[ \t]*(?:(?:export|default|public|private|protected|internal|static|final|abstract|sealed|"
+    r"async|pub(?:\([\w:]+\))?|override|virtual|inline|extern|unsafe|const|open|data|suspend)\s+)*"
+    r"(?:function\*?|class|interface|struct|enum|trait|impl|fn|func|def|defp|module|namespace|"
+    r"type|object|fun|sub|macro_rules!)[\s(<{]")
+# Comments, decorators and annotations kept with the definition below them.
+_PREAMBLE_RE = re.compile(r"[ \t]*(?:#|//|/\*|\*|@|--|;;|\"\"\"|''')")
+_HEADING_RE = re.compile(r"(#{1,6})[ \t]")
+_FENCE_RE = re.compile(r"[ \t]*(?:```|~~~)")
+# How NotebookLoader starts every cell.
+_CELL_RE = re.compile(r"'(?:code|markdown|raw)' cell: ")
+
+
+class TokenCounter:
+    """
+    Counts tokens with the fast (Rust) tokenizer of the embedding model.
+
+    Texts are tokenized in batches. If the tokenizer cannot be loaded, counts
+    are estimated from the text length with CHARS_PER_TOKEN.
+    """
+
+    def __init__(self, model_name: str = config.EMBEDDING_MODEL_NAME):
+        self._tokenizer = None
+        try:
+            from transformers import AutoTokenizer
+
+            self._tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+        except Exception as e:
+            logger.warning(
+                f"Could not load the tokenizer of {model_name}, estimating token counts instead: {e}")
+
+    @property
+    def exact(self) -> bool:
+        return self._tokenizer is not None
+
+    def count(self, texts: Sequence[str]) -> List[int]:
+        """
+        Returns the number of tokens of each text, special tokens excluded.
+        """
+        if not texts:
+            return []
+        if self._tokenizer is None:
+            return [math.ceil(len(text) / config.CHARS_PER_TOKEN) for text in texts]
+        encoded = self._tokenizer(list(texts), add_special_tokens=False, return_attention_mask=False,
+                                  return_token_type_ids=False, verbose=False)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+
+def document_kind(source: str) -> str:
+    """
+    Returns how a file is structured from its path: "python", "code", "markdown", "notebook" or "text".
+    """
+    extension = os.path.splitext(source)[1].lower()
+    if extension == ".py":
+        return "python"
+    if extension in _CODE_EXTS:
+        return "code"
+    if extension in _MARKDOWN_EXTS:
+        return "markdown"
+    if extension == ".ipynb":
+        return "notebook"
+    return "text"
+
+
+def _with_preamble(lines: List[str], line: int) -> int:
+    # Moves a boundary up over the comments and decorators right above a definition.
+    while line > 0 and lines[line - 1].strip() and _PREAMBLE_RE.match(lines[line - 1]):
+        line -= 1
+    return line
+
+
+def _python_levels(text: str, lines: List[str]) -> Optional[List[List[int]]]:
+    # Top-level statements, then the statements of top-level classes and functions (0-based lines).
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return None
+
+    def first_line(node: ast.stmt) -> int:
+        decorators = getattr(node, "decorator_list", [])
+        return min([node.lineno] + [decorator.lineno for decorator in decorators]) - 1
+
+    top_level = [_with_preamble(lines, first_line(node)) for node in tree.body]
+    nested = []
+    for node in tree.body:
+        if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+            nested.extend(_with_preamble(lines, first_line(child)) for child in node.body)
+    return [top_level, nested]
+
+
+def _definition_levels(lines: List[str]) -> List[List[int]]:
+    # Definitions at the start of a line, then indented ones (methods).
+    top_level, nested = [], []
+    for number, line in enumerate(lines):
+        if _DEFINITION_RE.match(line):
+            (nested if line[:1] in (" ", "\t") else top_level).append(_with_preamble(lines, number))
+    return [top_level, nested]
+
+
+def _markdown_levels(lines: List[str]) -> List[List[int]]:
+    # "#" and "##" headings, then deeper ones; "#" lines inside code fences are not headings.
+    sections, subsections = [], []
+    in_fence = False
+    for number, line in enumerate(lines):
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+            continue
+        match = None if in_fence else _HEADING_RE.match(line)
+        if match:
+            (sections if len(match.group(1)) <= 2 else subsections).append(number)
+    return [sections, subsections]
+
+
+def _paragraph_starts(lines: List[str]) -> List[int]:
+    # The first line of every block of text that follows a blank line.
+    return [number for number in range(1, len(lines))
+            if lines[number].strip() and not lines[number - 1].strip()]
+
+
+class StructureAwareChunker:
+    """
+    Splits documents into chunks of at most a number of embedding model tokens.
+
+    Documents are cut on the boundaries of their structure, coarsest first:
+    top-level definitions then methods for code (Python with its syntax tree,
+    other languages by their definition keywords), headings for Markdown,
+    cells for notebooks, then paragraphs and lines for everything. Consecutive
+    pieces are packed greedily until the next one would exceed the budget, so a
+    chunk holds as many whole functions or sections as fit, and only a piece
+    larger than the budget is cut on a finer boundary. Chunks tile their
+    document without overlap and record their character offset (start_index)
+    and their first and last lines (start_line, end_line, 1-based).
+
+    It has the split_documents method of LangChain's text splitters, so it can
+    replace them in the loaders.
+    """
+
+    def __init__(self, token_budget: int = config.CHUNK_TOKEN_BUDGET,
+                 token_counter: Optional[TokenCounter] = None):
+        """
+        Args:
+            token_budget (int): The maximum number of tokens per chunk.
+            token_counter (Optional[TokenCounter]): Counts tokens, the embedding model's tokenizer by default.
+        """
+        self.token_budget = token_budget
+        self.token_counter = token_counter or TokenCounter()
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        """
+        Splits documents into chunks.
+
+        Args:
+            documents (Iterable[Document]): The documents, e.g. the pages of one file.
+
+        Returns:
+            List[Document]: The chunks, with the metadata of their document and their position in it.
+        """
+        chunks = []
+        for document in documents:
+            chunks.extend(self._split_document(document))
+        return chunks
+
+    def _split_document(self, document: Document) -> List[Document]:
+        text = document.page_content
+        if not text.strip():
+            return []
+        lines = text.split("\n")
+        line_starts = [0]
+        for line in lines[:-1]:
+            line_starts.append(line_starts[-1] + len(line) + 1)
+
+        kind = document_kind(document.metadata.get("source", ""))
+        structure = []
+        if kind == "python":
+            structure = _python_levels(text, lines) or _definition_levels(lines)
+        elif kind == "code":
+            structure = _definition_levels(lines)
+        elif kind == "markdown":
+            structure = _markdown_levels(lines)
+        elif kind == "notebook":
+            structure = [[number for number, line in enumerate(lines) if _CELL_RE.match(line)]]
+        # Every document can fall back to paragraphs, then lines.
+        structure += [_paragraph_starts(lines), list(range(1, len(lines)))]
+        levels = [sorted({line_starts[line] for line in level if line > 0}) for level in structure]
+
+        chunks = []
+        for start, end in self._split_range(text, 0, len(text), levels, 0):
+            content = text[start:end]
+            stripped = content.strip()
+            if not stripped:
+                continue
+            # The line span covers the text, not the blank lines around it.
+            first = start + content.index(stripped[0])
+            last = start + content.rindex(stripped[-1])
+            metadata = dict(document.metadata)
+            metadata["start_index"] = start
+            metadata["start_line"] = bisect.bisect_right(line_starts, first)
+            metadata["end_line"] = bisect.bisect_right(line_starts, last)
+            chunks.append(Document(page_content=content, metadata=metadata))
+        return chunks
+
+    def _split_range(self, text: str, start: int, end: int, levels: List[List[int]],
+                     level: int) -> List[Tuple[int, int]]:
+        # Cuts text[start:end] on the boundaries of a level and packs the pieces up to the budget.
+        while level < len(levels):
+            boundaries = levels[level]
+            cuts = boundaries[bisect.bisect_right(boundaries, start):bisect.bisect_left(boundaries, end)]
+            if cuts:
+                break
+            level += 1
+        else:
+            return self._split_characters(text, start, end)
+
+        edges = [start] + cuts + [end]
+        pieces = list(zip(edges, edges[1:]))
+        counts = self.token_counter.count([text[a:b] for a, b in pieces])
+        ranges = []
+        current_start, current_end, current_tokens = None, None, 0
+        for (piece_start, piece_end), tokens in zip(pieces, counts):
+            if tokens > self.token_budget:
+                if current_start is not None:
+                    ranges.append((current_start, current_end))
+                    current_start = None
+                ranges.extend(self._split_range(text, piece_start, piece_end, levels, level + 1))
+                continue
+            if current_start is not None and current_tokens + tokens > self.token_budget:
+                ranges.append((current_start, current_end))
+                current_start = None
+            if current_start is None:
+                current_start, current_tokens = piece_start, 0
+            current_end = piece_end
+            current_tokens += tokens
+        if current_start is not None:
+            ranges.append((current_start, current_end))
+        return ranges
+
+    def _split_characters(self, text: str, start: int, end: int) -> List[Tuple[int, int]]:
+        # A single line over the budget (minified code, base64, CJK...): cut it at a proportional
+        # length, then cut again every piece the tokenizer still counts over the budget, since
+        # tokens are rarely spread evenly over a line.
+        ranges = []
+        pending = [(start, end)]
+        while pending:
+            counts = self.token_counter.count([text[a:b] for a, b in pending])
+            oversized = []
+            for (piece_start, piece_end), tokens in zip(pending, counts):
+                if tokens <= self.token_budget or piece_end - piece_start == 1:
+                    ranges.append((piece_start, piece_end))
+                    continue
+                # 10% of margin, so most pieces fit at the first cut.
+                size = max(1, (piece_end - piece_start) * self.token_budget * 9 // (tokens * 10))
+                oversized.extend((position, min(position + size, piece_end))
+                                 for position in range(piece_start, piece_end, size))
+            pending = oversized
+        return sorted(ranges)
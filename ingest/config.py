@@ -53,17 +53,193 @@ IGNORE_EXTS = [
     ".env", # Avoid indexing environment variables
 ]
 
+# Files larger than the limit of their type ("text", "pdf", "docx" or "notebook") are not
+# indexed. Text files are streamed (see below), so their limit only bounds indexing time;
+# PDF, Word and notebook files are parsed whole in memory.
+FILE_SIZE_LIMITS = {
+    "text": int(os.getenv("MAX_TEXT_FILE_MB", 256)) * 1024 * 1024,
+    "pdf": int(os.getenv("MAX_PDF_FILE_MB", 20)) * 1024 * 1024,
+    "docx": int(os.getenv("MAX_DOCX_FILE_MB", 10)) * 1024 * 1024,
+    "notebook": int(os.getenv("MAX_NOTEBOOK_FILE_MB", 10)) * 1024 * 1024,
+}
+# Text files above this size are read, decoded and split STREAM_WINDOW_BYTES at a time
+# in the main process instead of whole in a loader worker, so memory stays constant.
+STREAM_THRESHOLD_BYTES = 2 * 1024 * 1024
+STREAM_WINDOW_BYTES = 1024 * 1024
+# Threads scanning directories in parallel when collecting files, and how many leading
+# bytes of each file are read to detect binaries.
+WALK_WORKERS = int(os.getenv("WALK_WORKERS", 8))
+SNIFF_BYTES = 8192
+
+# Number of commits downloaded when cloning a repository (0 downloads the full history),
+# and an optional partial clone filter, e.g. "blob:none" for the full commit history
+# without the file contents of older commits.
+GIT_CLONE_DEPTH = int(os.getenv("GIT_CLONE_DEPTH", 1))
+GIT_CLONE_FILTER = os.getenv("GIT_CLONE_FILTER", "")
+# Keep bare clones and read the files straight from the git object database, instead
+# of writing a working tree that is read only once.
+GIT_CHECKOUT_FREE = os.getenv("GIT_CHECKOUT_FREE", "").lower() in ("1", "true", "yes")
+
+# Also index the commit history (messages, authors and changed paths) into the "history"
+# directory of the store; later runs only index the commits added since the last one.
+# Needs a clone with history (--depth 0, "blob:none" is enough unless diffs are indexed).
+HISTORY_ENABLED = os.getenv("DEVMENTOR_HISTORY", "").lower() in ("1", "true", "yes")
+# Add the start of each commit's diff, up to HISTORY_DIFF_MAX_CHARS characters.
+HISTORY_DIFFS = os.getenv("DEVMENTOR_HISTORY_DIFFS", "").lower() in ("1", "true", "yes")
+HISTORY_DIFF_MAX_CHARS = 1500
+# Changed paths listed per commit, the others are only counted.
+HISTORY_MAX_PATHS = 40
+
 # Path to the FAISS vector store, configurable via environment variable.
 VECTOR_STORE_PATH = os.getenv("VECTOR_STORE_PATH", "../vector_store")
 
+# Number of worker processes used to load and split files during ingestion. They run at the
+# same time as the CPU embedding workers (EMBED_WORKERS), and splitting costs far less than
+# encoding, so they get a quarter of the cores and the embedding workers the rest (EMBED_THREADS).
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", max(1, (os.cpu_count() or 1) // 4)))
+
+# Number of chunks embedded and added to the index at a time.
+EMBED_BATCH_SIZE = 256
+# A checkpoint of the vector store is saved every this many batches.
+CHECKPOINT_EVERY_BATCHES = 20
+
+# FAISS index type of new vector stores: "flat" (exact), "hnsw", "ivf_flat" or "ivf_pq".
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat")
+# Number of vectors collected to train IVF indexes before anything is added to them.
+INDEX_TRAIN_SIZE = 50_000
+# HNSW graph degree and build/search candidate list sizes.
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 64))
+# Number of IVF lists, and how many of them are visited per query.
+IVF_NLIST = 1024
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 16))
+# Product quantizer sub-vectors (must divide the embedding dimension) and bits per code.
+PQ_M = 48
+PQ_NBITS = 8
+
+# Also export each store in the memory-mapped format opened at query time, and the
+# storage type of its flat vectors ("float16" halves the size, "float32" is exact).
+MMAP_STORE_ENABLED = True
+MMAP_VECTOR_DTYPE = "float16"
+
+# Index each distinct file and chunk (whitespace-normalized) only once; a chunk lists every
+# file containing it in metadata["sources"]. Near-duplicate chunks (MinHash estimated
+# Jaccard similarity of their word shingles at least the threshold) are optionally merged too.
+DEDUP_ENABLED = True
+DEDUP_NEAR_DUPLICATES = os.getenv("DEDUP_NEAR_DUPLICATES", "").lower() in ("1", "true", "yes")
+DEDUP_NEAR_DUPLICATE_THRESHOLD = 0.9
+
+# How documents are split: "structure" packs whole functions, sections or notebook cells
+# into chunks of up to CHUNK_TOKEN_BUDGET embedding model tokens, "character" uses
+# fixed-size character chunks of CHUNK_SIZE with CHUNK_OVERLAP.
+CHUNKER = os.getenv("DEVMENTOR_CHUNKER", "structure")
+# Maximum model tokens per chunk. bge-small-en-v1.5 reads 512 tokens including its two
+# special tokens; the rest is a margin for the few tokens counted differently at the seams.
+CHUNK_TOKEN_BUDGET = 480
+
 # Maximum characters per text chunk.
 CHUNK_SIZE = 500
 # Overlap between consecutive text chunks.
 CHUNK_OVERLAP = 100
 
+# Load the embedding model when the web app starts instead of on the first question.
+WARM_UP_ON_START = os.getenv("DEVMENTOR_WARM_UP", "").lower() in ("1", "true", "yes")
+
 # Hugging Face model for generating embeddings.
 EMBEDDING_MODEL_NAME = "BAAI/bge-small-en-v1.5"
 
+# Embedding on CPU (when no GPU is available): the model backend, "torch" (fp32), "int8"
+# (dynamically quantized linear layers) or "onnx" (ONNX Runtime, needs optimum[onnxruntime]),
+# the number of encoding processes (1 encodes in the calling process), and the torch threads they
+# share: the cores left by the INGEST_WORKERS loaders.
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", max(1, (os.cpu_count() or 1) // 4)))
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", max(1, (os.cpu_count() or 1) - INGEST_WORKERS)))
+# Texts are batched by length so a batch holds at most this many tokens, padding included,
+# and at most EMBED_MAX_BATCH_SIZE texts.
+EMBED_MAX_BATCH_TOKENS = 16384
+EMBED_MAX_BATCH_SIZE = 128
+# int8 and ONNX vectors must have a cosine similarity of at least 1 - EMBED_COSINE_TOLERANCE
+# with the fp32 ones, checked once per model on the first EMBED_VERIFY_SAMPLE chunks embedded
+# and a few reference texts; otherwise the fp32 model is used. The outcome is saved to
+# EMBED_CHECKS_PATH, so queries, in any process, use the same model as the ingestion that
+# filled the stores (a query process checks on the reference texts alone if none was saved).
+EMBED_COSINE_TOLERANCE = 0.01
+EMBED_VERIFY_SAMPLE = 32
+EMBED_CHECKS_PATH = os.getenv("EMBED_CHECKS_PATH", "data/embedding_cache/backend_checks.json")
+
+# On-disk cache of chunk embeddings, shared by every repository.
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", "data/embedding_cache/embeddings.sqlite3")
+# Least recently used vectors are evicted above this many entries (~1.5 KB each).
+EMBEDDING_CACHE_MAX_ENTRIES = 1_000_000
+
+# Also index the definitions, identifiers and file names of every chunk (symbols.json next to
+# the store). Questions naming identifiers get the matching chunks fused with the vector hits,
+# and pure lookups ("where is `load_rag_chain` defined?") are answered without any embedding.
+SYMBOL_INDEX_ENABLED = True
+
+# Maximum number of tokens of retrieved context put in the prompt, and the average
+# number of characters per token used to estimate it. The budget fits the 5 retrieved
+# chunks of up to CHUNK_TOKEN_BUDGET model tokens each.
+CONTEXT_TOKEN_BUDGET = 2500
+CHARS_PER_TOKEN = 4
+
+# Answers are cached per vector store. Near-duplicate questions whose embeddings have at
+# least this cosine similarity are served the cached answer of the original question.
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.95
+ANSWER_CACHE_MAX_ENTRIES = 1000
+ANSWER_CACHE_TTL_SECONDS = 7 * 24 * 3600
+
+# Loaded knowledge bases are evicted, least recently used first, above this estimated
+# memory footprint. A store is reloaded when its ingestion generation changes, checked
+# at most every STORE_RELOAD_CHECK_SECONDS.
+STORE_MEMORY_BUDGET_MB = int(os.getenv("DEVMENTOR_STORE_MEMORY_MB", 2048))
+STORE_RELOAD_CHECK_SECONDS = 5
+
+# Batch mode of query_rag.py: maximum concurrent LLM calls, retries of rate-limited calls
+# with exponential backoff starting at BATCH_BACKOFF_SECONDS, and how many questions are
+# embedded and searched together.
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+BATCH_MAX_RETRIES = 5
+BATCH_BACKOFF_SECONDS = 2.0
+BATCH_QUERY_GROUP_SIZE = 512
+
+# Worker threads searching the selected knowledge bases in parallel in multi-repo mode.
+FEDERATED_SEARCH_WORKERS = int(os.getenv("FEDERATED_SEARCH_WORKERS", 8))
+
+# Background ingestion jobs of the web app: the SQLite queue, the per-job log files, the
+# maximum number of concurrent ingestions, and the attempts of a failing job, retried
+# with exponential backoff starting at JOB_RETRY_BACKOFF_SECONDS. A running job whose
+# scheduler sent no heartbeat for JOB_STALE_SECONDS is queued again.
+JOB_DB_PATH = os.getenv("DEVMENTOR_JOB_DB", "data/jobs/jobs.sqlite3")
+JOB_LOG_DIR = os.getenv("DEVMENTOR_JOB_LOG_DIR", "data/jobs/logs")
+JOB_MAX_RUNNING = int(os.getenv("DEVMENTOR_JOB_MAX_RUNNING", 1))
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_BACKOFF_SECONDS = 30.0
+JOB_STALE_SECONDS = 30
+
+# Streamed answers of the chat page are redrawn at most STREAM_MAX_FPS times per second.
+# The optional typewriter effect reveals them at TYPEWRITER_CHARS_PER_SECOND, and ends at
+# most TYPEWRITER_MAX_SECONDS after the answer is complete.
+STREAM_MAX_FPS = 15
+TYPEWRITER_ENABLED = os.getenv("DEVMENTOR_TYPEWRITER", "").lower() in ("1", "true", "yes")
+TYPEWRITER_CHARS_PER_SECOND = 600
+TYPEWRITER_MAX_SECONDS = 1.0
+
+# Port of the HTTP query service (python -m ingest.service).
+SERVICE_PORT = int(os.getenv("DEVMENTOR_SERVICE_PORT", 8000))
+
+# Record timing spans and counters of the ingest and query pipelines. Each process writes
+# its trace to TRACE_DIR on exit, as JSON viewable in chrome://tracing or Perfetto.
+TRACING_ENABLED = os.getenv("DEVMENTOR_TRACING", "").lower() in ("1", "true", "yes")
+TRACE_DIR = os.getenv("DEVMENTOR_TRACE_DIR", "data/traces")
+# Port of the Prometheus text endpoint (/metrics) of the query side, 0 disables it.
+METRICS_PORT = int(os.getenv("DEVMENTOR_METRICS_PORT", 0))
+
 # The prompt template that defines the AI's persona and instructions for the RAG chain.
 RAG_PROMPT_TEMPLATE = """
 You are DevMentor, a helpful and patient AI assistant for developers who are new to this project. Your main goal is to provide clear, step-by-step, beginner-friendly guidance.
@@ -0,0 +1,121 @@
+# This script assembles the retrieved chunks into the prompt context within a token budget
+import hashlib
+import math
+import re
+from typing import Dict, List, Tuple
+
+from langchain_core.documents import Document
+
+from . import config
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of LLM tokens of a text from its length.
+    """
+    return math.ceil(len(text) / config.CHARS_PER_TOKEN)
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def _merge_group(ranked_docs: List[Tuple[int, Document]]) -> List[Tuple[int, str]]:
+    """
+    Merges the chunks of one source file whose character ranges overlap or touch.
+
+    Args:
+        ranked_docs (List[Tuple[int, Document]]): The chunks of the file with their retrieval rank.
+
+    Returns:
+        List[Tuple[int, str]]: The merged segments with the best rank of their chunks.
+    """
+    with_offsets = [(rank, doc) for rank, doc in ranked_docs
+                    if doc.metadata.get("start_index") is not None]
+    # Chunks from stores built without offsets cannot be merged, they stay as they are.
+    segments = [(rank, doc.page_content) for rank, doc in ranked_docs
+                if doc.metadata.get("start_index") is None]
+
+    with_offsets.sort(key=lambda item: item[1].metadata["start_index"])
+    current = None
+    for rank, doc in with_offsets:
+        start = doc.metadata["start_index"]
+        end = start + len(doc.page_content)
+        if current is not None and start <= current["end"]:
+            # Only append the part of the chunk that is not already in the segment.
+            if end > current["end"]:
+                current["text"] += doc.page_content[current["end"] - start:]
+                current["end"] = end
+            current["rank"] = min(current["rank"], rank)
+            continue
+        if current is not None:
+            segments.append((current["rank"], current["text"]))
+        current = {"rank": rank, "text": doc.page_content, "end": end}
+    if current is not None:
+        segments.append((current["rank"], current["text"]))
+    return segments
+
+
+def pack_context(docs: List[Document], token_budget: int) -> Tuple[str, Dict[str, int]]:
+    """
+    Builds the prompt context from the retrieved chunks.
+
+    Chunks are grouped by source file and overlapping or adjacent chunks are
+    merged using their start offsets, which removes the text repeated by
+    CHUNK_OVERLAP. Exact and contained duplicates (e.g. copied files) are
+    dropped. Segments are then added in relevance order until the token budget
+    is spent.
+
+    Args:
+        docs (List[Document]): The retrieved chunks, most relevant first.
+        token_budget (int): The maximum number of context tokens.
+
+    Returns:
+        Tuple[str, Dict[str, int]]: The context and statistics on the tokens saved.
+    """
+    groups = {}
+    for rank, doc in enumerate(docs):
+        # Federated search tags chunks with their repository: equal paths of two repos differ.
+        key = (doc.metadata.get("repo"), doc.metadata.get("source"), doc.metadata.get("page"))
+        groups.setdefault(key, []).append((rank, doc))
+
+    segments = []
+    for ranked_docs in groups.values():
+        segments.extend(_merge_group(ranked_docs))
+    segments.sort(key=lambda segment: segment[0])
+
+    kept = []
+    seen_hashes = set()
+    for _, text in segments:
+        normalized = _normalize(text)
+        digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        if digest in seen_hashes or any(normalized in other for _, other in kept):
+            continue
+        seen_hashes.add(digest)
+        kept.append((text, normalized))
+
+    parts = []
+    remaining = token_budget
+    for text, _ in kept:
+        tokens = estimate_tokens(text)
+        if tokens <= remaining:
+            parts.append(text)
+            remaining -= tokens
+        elif not parts:
+            # Always give the LLM the start of the most relevant segment.
+            parts.append(text[:remaining * config.CHARS_PER_TOKEN])
+            remaining = 0
+        if remaining <= 0:
+            break
+
+    context = "\n\n".join(parts)
+    tokens_in = sum(estimate_tokens(doc.page_content) for doc in docs)
+    tokens_out = estimate_tokens(context)
+    stats = {
+        "chunks": len(docs),
+        "segments": len(parts),
+        "tokens_in": tokens_in,
+        "tokens_out": tokens_out,
+        "tokens_saved": max(tokens_in - tokens_out, 0),
+    }
+    return context, stats
@@ -1,124 +1,615 @@
-from .file_collector import collect_target_files
-from .embedding_generator import embedding_model
+from .file_collector import scan_target_files
+from .document_loader import load_document_parts
+from .embedding_generator import get_embedding_model
+from .embedding_cache import CachedEmbeddings
+from .index_factory import (INDEX_TYPES, build_index, index_params, needs_training, rebuild_index,
+                            load_index_meta, save_index_meta, apply_search_params)
+from .mmap_store import export_mmap_store
+from .symbol_index import SymbolIndex
+from .dedup import Deduplicator, remove_sources
+from .git_source import GitObjectSource, clone_or_update
+from .git_history import run_history_ingestion
+from .manifest import (load_manifest, save_manifest, new_manifest, plan_update, plan_update_from_hashes,
+                       hash_file, relative_path, make_chunk_id, get_head_commit)
 from .logger import logger
+from .tracing import tracer
 from . import config
 
 import os
 import argparse
-import shutil
-from git import Repo
+import time
+from typing import Callable, Optional
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import TextLoader, PyPDFLoader, Docx2txtLoader, NotebookLoader
 
 
-def main():
+def _compact_ivf(index, kept_positions):
+    # Copies the codes of the kept vectors into an empty clone of the trained index, list by
+    # list, so they are renumbered 0..n-1 without being decoded and quantized again.
+    compacted = faiss.clone_index(index)
+    compacted.reset()
+    ivf, compacted_ivf = faiss.extract_index_ivf(index), faiss.extract_index_ivf(compacted)
+    new_positions = np.full(index.ntotal, -1, dtype=np.int64)
+    new_positions[kept_positions] = np.arange(len(kept_positions), dtype=np.int64)
+    code_size = ivf.invlists.code_size
+    for list_no in range(ivf.nlist):
+        size = ivf.invlists.list_size(list_no)
+        if not size:
+            continue
+        ids = faiss.rev_swig_ptr(ivf.invlists.get_ids(list_no), size).copy()
+        codes = faiss.rev_swig_ptr(ivf.invlists.get_codes(list_no), size * code_size).copy()
+        keep = new_positions[ids] >= 0
+        if not keep.any():
+            continue
+        kept_ids = np.ascontiguousarray(new_positions[ids[keep]])
+        kept_codes = np.ascontiguousarray(codes.reshape(size, code_size)[keep])
+        compacted_ivf.invlists.add_entries(
+            list_no, len(kept_ids), faiss.swig_ptr(kept_ids), faiss.swig_ptr(kept_codes))
+    compacted_ivf.ntotal = len(kept_positions)
+    if compacted is not compacted_ivf:
+        compacted.ntotal = len(kept_positions)
+    return compacted
+
+
+def compact_without(vector_store, chunk_ids, index_meta):
     """
-    Main function to run the data ingestion and vector store creation pipeline.
+    Rebuilds the index without the given chunks, renumbering the kept vectors
+    0..n-1 in their current order like LangChain's index_to_docstore_id expects.
+
+    HNSW graphs cannot remove vectors, and IVF indexes keep the ids of the
+    remaining ones, so both are rebuilt: HNSW from the kept vectors, IVF from
+    its trained quantizer with the kept codes copied over.
     """
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--url", type=str, help="Github url")
-    args = parser.parse_args()
+    to_delete = set(chunk_ids)
+    kept = [(position, chunk_id) for position, chunk_id in sorted(vector_store.index_to_docstore_id.items())
+            if chunk_id not in to_delete]
+    positions = np.array([position for position, _ in kept], dtype=np.int64)
+    if needs_training(index_meta["index_type"]):
+        index = _compact_ivf(vector_store.index, positions)
+    else:
+        vectors = vector_store.index.reconstruct_batch(positions) if len(positions) else \
+            np.empty((0, vector_store.index.d), dtype=np.float32)
+        index = rebuild_index(index_meta, vectors)
+        index.add(vectors)
+    # Query-time settings (nprobe, efSearch) are kept.
+    apply_search_params(index, index_meta)
+    vector_store.index = index
+    vector_store.docstore.delete(list(to_delete))
+    vector_store.index_to_docstore_id = {
+        new_position: chunk_id for new_position, (_, chunk_id) in enumerate(kept)}
 
-    repo_path = ""
-    if args.url:
-        storage_dir = "data/github_repos"
-        repo_name = args.url.split("/")[-1].replace(".git", "")
-        clone_path = os.path.join(storage_dir, repo_name)
 
-        logger.info(f"Cloning repository from {args.url} into {clone_path}...")
+def remove_chunks(vector_store, chunk_ids, index_meta):
+    """
+    Deletes the vectors and documents of the given chunks from the vector store.
 
-        os.makedirs(storage_dir, exist_ok=True)
+    Args:
+        vector_store (FAISS): The loaded vector store.
+        chunk_ids (List[str]): The ids of the chunks to delete.
+        index_meta (dict): The metadata of the store's index.
+    """
+    # Ids that are not in the store (e.g. from a run that crashed before saving) are ignored.
+    existing_ids = set(vector_store.index_to_docstore_id.values())
+    chunk_ids = [chunk_id for chunk_id in chunk_ids if chunk_id in existing_ids]
+    if not chunk_ids:
+        return
+    with tracer.span("delete", chunks=len(chunk_ids)):
+        if index_meta["index_type"] == "flat":
+            # Flat indexes remove the rows in place and shift the following ones, like
+            # LangChain renumbers index_to_docstore_id.
+            vector_store.delete(chunk_ids)
+        else:
+            # HNSW cannot remove vectors, and IVF keeps the ids of the remaining ones, which
+            # would no longer match their docstore positions: the index is compacted instead.
+            logger.info(f"Compacting the {index_meta['index_type']} index...")
+            compact_without(vector_store, chunk_ids, index_meta)
+    logger.info(f"Deleted {len(chunk_ids)} stale chunks from the vector store.")
 
-        if os.path.exists(clone_path):
-            shutil.rmtree(clone_path)
-        Repo.clone_from(args.url, clone_path)
-        repo_path = clone_path
-        logger.info("Repository cloned successfully.")
 
-    else:
-        repo_path = config.TARGET_REPO_PATH
-        logger.info(f"Using local repository at {repo_path}.")
+def iter_file_chunks(files_to_index, repo_path, new_hashes, workers, file_stats=None,
+                     dedup=None, copies=None):
+    """
+    Loads and splits the files one by one, without keeping their chunks around.
+
+    Args:
+        files_to_index (Iterable[FileItem]): The files to load, or their (path, content) pairs.
+        repo_path (str): The path of the repository, used for relative paths.
+        new_hashes (Dict[str, str]): Content hashes already computed while planning.
+        workers (int): The number of loader processes.
+        file_stats (Optional[Dict[str, Tuple[int, int]]]): The size and mtime of the files,
+            recorded in their manifest entries.
+        dedup (Optional[Deduplicator]): Drops the chunks that are already indexed.
+        copies (Optional[Dict[str, List[str]]]): Files with the same content as a loaded
+            file; they are yielded right after it, sharing its chunks.
+
+    Yields:
+        Tuple[str, Optional[dict], List[Tuple[Document, str]]]: The relative path of
+        each file, its manifest entry and its new chunks with their ids. Large text
+        files come in several parts, the entry is None on all but the last one.
+    """
+    # The distinct chunk ids of the file being loaded so far, and its number of chunks.
+    file_chunk_ids, seen_ids, offset = [], set(), 0
+    # Files are parsed in parallel, but come back in the order they were collected.
+    for file_path, chunks, last in load_document_parts(files_to_index, workers):
+        rel_path = relative_path(file_path, repo_path)
+        chunk_ids = [make_chunk_id(rel_path, offset + i) for i in range(len(chunks))]
+        offset += len(chunks)
+        if dedup is not None:
+            chunk_ids, new_chunks = dedup.assign(chunks, chunk_ids)
+        else:
+            new_chunks = list(zip(chunks, chunk_ids))
+        file_chunk_ids.extend(chunk_id for chunk_id in chunk_ids if chunk_id not in seen_ids)
+        seen_ids.update(chunk_ids)
+        if not last:
+            yield rel_path, None, new_chunks
+            continue
+        chunk_ids = file_chunk_ids
+        file_chunk_ids, seen_ids, offset = [], set(), 0
+
+        file_hash = new_hashes.get(rel_path)
+        if file_hash is None:
+            try:
+                file_hash = hash_file(file_path)
+            except OSError:
+                logger.warning(f"Could not read file, skipping: {file_path}")
+                continue
+        entry = {"hash": file_hash, "chunk_ids": chunk_ids}
+        if file_stats and file_path in file_stats:
+            entry["size"], entry["mtime_ns"] = file_stats[file_path]
+        yield rel_path, entry, new_chunks
+
+        for copy_path in (copies or {}).get(file_path, ()):
+            dedup.add_sources(chunk_ids, copy_path)
+            copy_entry = {"hash": file_hash, "chunk_ids": list(chunk_ids)}
+            if file_stats and copy_path in file_stats:
+                copy_entry["size"], copy_entry["mtime_ns"] = file_stats[copy_path]
+            yield relative_path(copy_path, repo_path), copy_entry, []
+
+
+def iter_batches(file_chunks, batch_size):
+    """
+    Groups the stream of file chunks into fixed-size batches.
+
+    A file is reported as completed with the batch holding its last chunk (or a
+    later one), so a checkpoint never records a file whose chunks are not all
+    in the index yet.
+
+    Args:
+        file_chunks (Iterable): The output of iter_file_chunks.
+        batch_size (int): The number of chunks per batch.
+
+    Yields:
+        Tuple[List[Document], List[str], Dict[str, dict]]: The chunks of the
+        batch, their ids, and the manifest entries of the completed files.
+    """
+    documents, chunk_ids, completed_files = [], [], {}
+    for rel_path, entry, new_chunks in file_chunks:
+        for chunk, chunk_id in new_chunks:
+            documents.append(chunk)
+            chunk_ids.append(chunk_id)
+            if len(documents) == batch_size:
+                yield documents, chunk_ids, completed_files
+                documents, chunk_ids, completed_files = [], [], {}
+        # Files without chunks are recorded too, so they are not retried on every run.
+        if entry is not None:
+            completed_files[rel_path] = entry
+    if documents or completed_files:
+        yield documents, chunk_ids, completed_files
+
+
+class StoreWriter:
+    """
+    Embeds batches of chunks and adds them to the vector store.
+
+    The vector store is created on the first batch with the requested index type.
+    Index types that need training (IVF) buffer the first batches until
+    INDEX_TRAIN_SIZE vectors are available and train the index on them.
+    """
+
+    def __init__(self, vector_store, index_meta, index_type):
+        """
+        Args:
+            vector_store (Optional[FAISS]): An existing vector store to extend, or None.
+            index_meta (Optional[dict]): The metadata of the existing store's index.
+            index_type (str): The index type used when creating a new store.
+        """
+        self.vector_store = vector_store
+        self.index_meta = index_meta
+        self.index_type = index_type
+        self._pending = []
+        self._pending_count = 0
+        # Embedding throughput, reported at the end of the ingestion.
+        self.embedded = 0
+        self.embed_seconds = 0.0
+
+    def add(self, documents, chunk_ids):
+        """
+        Embeds a batch of chunks and adds them to the vector store.
+
+        Args:
+            documents (List[Document]): The chunks to add.
+            chunk_ids (List[str]): The ids of the chunks.
+        """
+        texts = [doc.page_content for doc in documents]
+        metadatas = [doc.metadata for doc in documents]
+        embed_started = time.perf_counter()
+        with tracer.span("embed", chunks=len(texts)):
+            embeddings = get_embedding_model().embed_documents(texts)
+        self.embed_seconds += time.perf_counter() - embed_started
+        self.embedded += len(texts)
+        tracer.count("embedded_chunks", len(texts))
+        if self.vector_store is not None:
+            with tracer.span("index", chunks=len(texts)):
+                self.vector_store.add_embeddings(
+                    zip(texts, embeddings), metadatas=metadatas, ids=chunk_ids)
+            return
+        self._pending.append((texts, embeddings, metadatas, chunk_ids))
+        self._pending_count += len(texts)
+        if not needs_training(self.index_type) or self._pending_count >= config.INDEX_TRAIN_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Creates the vector store from the buffered batches, if it does not exist yet.
+        """
+        if self.vector_store is not None or not self._pending:
+            return
+        sample = np.array(
+            [vector for _, embeddings, _, _ in self._pending for vector in embeddings], dtype=np.float32)
+        with tracer.span("build_index", index_type=self.index_type, vectors=len(sample)):
+            index, self.index_meta = build_index(
+                self.index_type, index_params(self.index_type), sample)
+        self.vector_store = FAISS(
+            get_embedding_model(), index, InMemoryDocstore(), {})
+        with tracer.span("index", chunks=self._pending_count):
+            for texts, embeddings, metadatas, chunk_ids in self._pending:
+                self.vector_store.add_embeddings(
+                    zip(texts, embeddings), metadatas=metadatas, ids=chunk_ids)
+        self._pending = []
+        self._pending_count = 0
+        logger.info(
+            f"Created a {self.index_meta['index_type']} FAISS vector store.")
+
+
+def save_store(vector_store, store_save_path, manifest, index_meta, complete):
+    """
+    Saves the vector store and its manifest, either as a checkpoint or as the final result.
+
+    The manifest is written last and records the index size, so a crash while
+    saving is detected on the next run instead of loading mismatched files.
+    """
+    os.makedirs(store_save_path, exist_ok=True)
+    with tracer.span("save", complete=complete, chunks=vector_store.index.ntotal):
+        vector_store.save_local(store_save_path)
+        save_index_meta(store_save_path, index_meta)
+        # The query side opens the memory-mapped copy, so it is only refreshed once the store is complete.
+        if complete and config.MMAP_STORE_ENABLED:
+            with tracer.span("export_mmap"):
+                export_mmap_store(vector_store, store_save_path,
+                                  index_meta, config.MMAP_VECTOR_DTYPE)
+        if complete and config.SYMBOL_INDEX_ENABLED:
+            with tracer.span("symbol_index"):
+                SymbolIndex.build(vector_store).save(store_save_path)
+        manifest["complete"] = complete
+        manifest["index_size"] = vector_store.index.ntotal
+        if complete:
+            # Running apps reload a store when its generation changes.
+            manifest["generation"] = manifest.get("generation", 0) + 1
+        save_manifest(store_save_path, manifest)
+
 
+def load_existing_store(store_save_path, index_type):
+    """
+    Loads a previously saved vector store and its manifest, if they can be reused.
+
+    Args:
+        store_save_path (str): The directory of the saved vector store.
+        index_type (str): The index type requested for this run.
+
+    Returns:
+        Tuple[Optional[FAISS], Optional[dict], Optional[dict]]: The vector store,
+        its manifest and its index metadata, or Nones when the store must be
+        rebuilt from scratch.
+    """
+    manifest = load_manifest(store_save_path)
+    if not manifest or not os.path.exists(os.path.join(store_save_path, "index.faiss")):
+        return None, None, None
+    if manifest["embedding_model"] != config.EMBEDDING_MODEL_NAME:
+        logger.warning(
+            "Embedding model changed since the last ingestion, rebuilding from scratch.")
+        return None, None, None
+    index_meta = load_index_meta(store_save_path)
+    if index_meta["requested_type"] != index_type:
+        logger.warning(
+            f"Index type changed from {index_meta['requested_type']} to {index_type}, rebuilding from scratch.")
+        return None, None, None
+    vector_store = FAISS.load_local(
+        store_save_path,
+        embeddings=get_embedding_model(),
+        allow_dangerous_deserialization=True
+    )
+    if vector_store.index.ntotal != manifest.get("index_size", vector_store.index.ntotal):
+        logger.warning(
+            "Vector store does not match its manifest (interrupted save?), rebuilding from scratch.")
+        return None, None, None
+
+    # Drop chunks of files that were only partly indexed when the last checkpoint was written.
+    referenced_ids = {chunk_id for entry in manifest["files"].values()
+                      for chunk_id in entry["chunk_ids"]}
+    orphan_ids = [chunk_id for chunk_id in vector_store.index_to_docstore_id.values()
+                  if chunk_id not in referenced_ids]
+    remove_chunks(vector_store, orphan_ids, index_meta)
+    return vector_store, manifest, index_meta
+
+
+def run_ingestion(repo_path: str, store_save_path: str, incremental: bool = False,
+                  workers: int = config.INGEST_WORKERS,
+                  index_type: str = config.INDEX_TYPE,
+                  progress: Optional[Callable[[dict], None]] = None,
+                  git_source: Optional[GitObjectSource] = None) -> Optional[dict]:
+    """
+    Ingests a local repository into the vector store at store_save_path.
+
+    Args:
+        repo_path (str): The repository to ingest.
+        store_save_path (str): The directory of the vector store.
+        incremental (bool): Only re-index the files that changed since the last ingestion.
+        workers (int): Number of processes used to load and split files.
+        index_type (str): FAISS index type of the vector store.
+        progress (Optional[Callable[[dict], None]]): Called with the stage, the number of
+            files indexed out of the total, the chunks embedded and an ETA in seconds.
+        git_source (Optional[GitObjectSource]): Read the files of this commit from the git
+            object database instead of walking repo_path, which may then be a bare clone.
+
+    Returns:
+        Optional[dict]: The number of collected, indexed files and embedded chunks,
+        or None if nothing was ingested.
+    """
     logger.info("Ingestion pipeline is starting.")
 
     # Collect files from the target repository
-    collected_files = collect_target_files(
-        repo_path)
+    blob_hashes = None
+    file_stats = None
+    with tracer.span("walk") as span:
+        if git_source is not None:
+            # Blob ids identify file contents like the hashes of plan_update, without reading anything.
+            # They are prefixed so a store switching between checkout and git object modes is rebuilt.
+            blob_hashes = {os.path.join(repo_path, rel_path): "git:" + blob_id
+                           for rel_path, blob_id in git_source.list_files().items()}
+            collected_files = list(blob_hashes)
+        else:
+            entries = scan_target_files(repo_path)
+            collected_files = [entry.path for entry in entries]
+            # Kept from the walk, so unchanged files are recognized without reading them.
+            file_stats = {entry.path: (entry.size, entry.mtime_ns) for entry in entries}
+        span.set(files=len(collected_files))
     if not collected_files:
         logger.warning(
             "No files collected. Please check the TARGET_REPO_PATH and FILE_EXTENSIONS in config.py.")
-        return
+        return None
     logger.info(f"Collected {len(collected_files)} files.")
+    if progress:
+        progress({"stage": "planning", "files_total": len(collected_files)})
 
-    # Process each file to create Langchain documents
-    all_langchain_documents = []
-
-    # Initialize a text splitter that we can use for all document types.
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=config.CHUNK_SIZE,
-        chunk_overlap=config.CHUNK_OVERLAP
-    )
+    # Reuse the existing vector store when running incrementally, or when resuming
+    # an ingestion that was interrupted after a checkpoint.
+    manifest = None
+    vector_store = None
+    index_meta = None
+    checkpoint = load_manifest(store_save_path)
+    resuming = checkpoint is not None and not checkpoint.get("complete", True)
+    if incremental or resuming:
+        vector_store, manifest, index_meta = load_existing_store(
+            store_save_path, index_type)
+        if manifest and resuming:
+            logger.info(
+                f"Resuming interrupted ingestion from its last checkpoint "
+                f"({len(manifest['files'])} files already indexed).")
 
-    for file_path in collected_files:
-        # As a safety measure, skip files larger than 2MB to avoid memory issues.
-        try:
-            file_size = os.path.getsize(file_path)
-            if file_size > 2 * 1024 * 1024:  # 2MB limit
-                logger.warning(
-                    f"Skipping large file: {file_path} ({file_size / (1024*1024):.2f} MB)")
-                continue
-        except OSError:
-            # This can happen for broken symlinks or other file system issues.
-            logger.warning(
-                f"Could not get size of file, skipping: {file_path}")
-            continue
+    if manifest:
+        with tracer.span("plan_update"):
+            if blob_hashes is not None:
+                files_to_index, stale_paths, new_hashes = plan_update_from_hashes(
+                    manifest, blob_hashes, repo_path)
+            else:
+                files_to_index, stale_paths, new_hashes = plan_update(
+                    manifest, collected_files, repo_path, file_stats)
+        logger.info(
+            f"Incremental update: {len(files_to_index)} new or changed files, "
+            f"{len(stale_paths)} changed or removed files to delete.")
+        stale_entries = {rel_path: manifest["files"].pop(rel_path) for rel_path in stale_paths}
+        # Deduplicated chunks are shared by several files: they are only deleted with the last of them.
+        referenced_ids = {chunk_id for entry in manifest["files"].values() for chunk_id in entry["chunk_ids"]}
+        stale_chunk_ids = set()
+        for rel_path, entry in stale_entries.items():
+            stale_chunk_ids.update(chunk_id for chunk_id in entry["chunk_ids"] if chunk_id not in referenced_ids)
+            remove_sources(vector_store, [chunk_id for chunk_id in entry["chunk_ids"] if chunk_id in referenced_ids],
+                           rel_path, repo_path)
+        remove_chunks(vector_store, sorted(stale_chunk_ids), index_meta)
+    else:
+        manifest = new_manifest()
+        # A rebuild keeps counting generations, so running apps still see a new one.
+        manifest["generation"] = checkpoint.get("generation", 0) if checkpoint else 0
+        files_to_index = collected_files
+        new_hashes = {relative_path(file_path, repo_path): file_hash
+                      for file_path, file_hash in blob_hashes.items()} if blob_hashes is not None else {}
 
-        logger.info(f"Processing file: {file_path}")
-        file_extension = os.path.splitext(file_path)[1].lower()
-
-        specially_loaded_documents = []
-        if file_extension == '.ipynb':
-            loader = NotebookLoader(file_path)
-            specially_loaded_documents = loader.load()
-        elif file_extension == '.pdf':
-            loader = PyPDFLoader(file_path)
-            specially_loaded_documents = loader.load()
-        elif file_extension == '.docx':
-            loader = Docx2txtLoader(file_path)
-            specially_loaded_documents = loader.load()
-        else:
-            loader = TextLoader(file_path, encoding='utf-8')
-            try:
-                specially_loaded_documents = loader.load()
-            except Exception as e:
-                logger.warning(
-                    f"Skipping file {file_path} due to loading error: {e}")
+    # Copies of files and chunks that are already indexed (or will be in this run) are not loaded or embedded.
+    dedup = None
+    files_to_load, copies, indexed_copies = files_to_index, None, {}
+    if config.DEDUP_ENABLED:
+        dedup = Deduplicator()
+        with tracer.span("dedup_plan"):
+            if vector_store is not None:
+                dedup.register_store(vector_store)
+            files_to_load, copies, indexed_copies = dedup.plan_files(
+                files_to_index, repo_path, new_hashes, manifest["files"])
+        for file_path, original in indexed_copies.items():
+            chunk_ids = list(manifest["files"][original]["chunk_ids"])
+            dedup.add_sources(chunk_ids, file_path)
+            manifest["files"][relative_path(file_path, repo_path)] = {
+                "hash": manifest["files"][original]["hash"], "chunk_ids": chunk_ids}
 
-        if specially_loaded_documents:
-            chunk = text_splitter.split_documents(specially_loaded_documents)
-            all_langchain_documents.extend(chunk)
+    # Stream the chunks through the embedding model in fixed-size batches, so memory
+    # is bounded by the batch size instead of the size of the repository.
+    logger.info("Embedding chunks and building the FAISS vector store...")
+    total_chunks = 0
+    files_done = len(indexed_copies)
+    start_time = time.monotonic()
+    writer = StoreWriter(vector_store, index_meta, index_type)
+    files = files_to_load
+    if git_source is not None:
+        # Streamed from a single cat-file process, in the order they are loaded.
+        files = git_source.iter_blobs(
+            (file_path, blob_hashes[file_path][len("git:"):]) for file_path in files_to_load)
+    file_chunks = iter_file_chunks(
+        files, repo_path, new_hashes, workers, file_stats, dedup, copies)
+    for batch_number, (documents, chunk_ids, completed_files) in enumerate(
+            iter_batches(file_chunks, config.EMBED_BATCH_SIZE), start=1):
+        if documents:
+            writer.add(documents, chunk_ids)
+            total_chunks += len(documents)
+        manifest["files"].update(completed_files)
+        files_done += len(completed_files)
+        if progress:
+            elapsed = time.monotonic() - start_time
+            remaining = len(files_to_index) - files_done
+            progress({"stage": "indexing", "files_done": files_done, "files_total": len(files_to_index),
+                      "chunks": total_chunks,
+                      "eta_seconds": remaining * elapsed / files_done if files_done else None})
+        if writer.vector_store is not None and batch_number % config.CHECKPOINT_EVERY_BATCHES == 0:
+            if dedup is not None:
+                dedup.apply_sources(writer.vector_store)
+            save_store(writer.vector_store, store_save_path,
+                       manifest, writer.index_meta, complete=False)
+            logger.info(
+                f"Checkpoint saved after {total_chunks} chunks ({len(manifest['files'])} files).")
 
-    if not all_langchain_documents:
+    writer.flush()
+    vector_store = writer.vector_store
+    if vector_store is None:
         logger.error("No langchain documents were created halting pipeline")
-        return
-    logger.info(
-        f"Created a total of {len(all_langchain_documents)} documents (chunks).")
-
-    # Create FAISS vector store from the documents
-    logger.info("Creating FAISS vector store...")
-    vector_store = FAISS.from_documents(
-        documents=all_langchain_documents,
-        embedding=embedding_model
-    )
-    logger.info("FAISS vector store created successfully")
+        return None
+    if total_chunks:
+        logger.info(
+            f"Created a total of {total_chunks} documents (chunks).")
+        logger.info(
+            f"Embedded {writer.embedded} chunks in {writer.embed_seconds:.2f}s "
+            f"({writer.embedded / writer.embed_seconds if writer.embed_seconds else 0:.1f} chunks/s).")
+    else:
+        logger.info("No new chunks to embed, the vector store is up to date.")
+    if dedup is not None:
+        dedup.apply_sources(vector_store)
+        dedup.log_stats()
+        tracer.count("duplicate_files", dedup.duplicate_files)
+        tracer.count("duplicate_chunks", dedup.duplicate_chunks)
+    embedding_model = get_embedding_model()
+    if isinstance(embedding_model, CachedEmbeddings):
+        stats = embedding_model.stats()
+        logger.info(
+            f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%} hit rate), {stats['entries']} entries.")
 
     # Save the vector store locally
+    if progress:
+        progress({"stage": "saving", "files_done": files_done, "files_total": len(files_to_index),
+                  "chunks": total_chunks, "eta_seconds": None})
+    manifest["commit"] = git_source.commit if git_source is not None else get_head_commit(repo_path)
+    save_store(vector_store, store_save_path,
+               manifest, writer.index_meta, complete=True)
+    logger.info(f"Vector store saved locally at: {store_save_path}")
+    return {
+        "files_collected": len(collected_files),
+        "files_indexed": len(files_to_index),
+        "chunks": total_chunks,
+        "duplicate_files": dedup.duplicate_files if dedup else 0,
+        "duplicate_chunks": dedup.duplicate_chunks if dedup else 0,
+    }
+
+
+def main():
+    """
+    Main function to run the data ingestion and vector store creation pipeline.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", type=str, help="Github url")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-index files that changed since the last ingestion")
+    parser.add_argument("--workers", type=int, default=config.INGEST_WORKERS,
+                        help="Number of processes used to load and split files")
+    parser.add_argument("--index-type", type=str, choices=INDEX_TYPES, default=config.INDEX_TYPE,
+                        help="FAISS index type of the vector store")
+    parser.add_argument("--depth", type=int, default=config.GIT_CLONE_DEPTH,
+                        help="Number of commits to download, 0 for the full history")
+    parser.add_argument("--filter", type=str, default=config.GIT_CLONE_FILTER,
+                        help='Partial clone filter, e.g. "blob:none"')
+    # Boolean options default to the configuration and can be switched either way (--no-history...).
+    parser.add_argument("--checkout", action=argparse.BooleanOptionalAction, default=not config.GIT_CHECKOUT_FREE,
+                        help="Check the files out, --no-checkout keeps a bare clone and reads files "
+                             "from the git object database")
+    parser.add_argument("--history", action=argparse.BooleanOptionalAction, default=config.HISTORY_ENABLED,
+                        help="Also index the commits added since the last run; this needs the full "
+                             "history, so --depth is ignored and a shallow clone is deepened")
+    parser.add_argument("--history-diffs", action=argparse.BooleanOptionalAction, default=config.HISTORY_DIFFS,
+                        help="Add the start of each commit's diff to the indexed history")
+    parser.add_argument("--job-id", type=int,
+                        help="Report progress to this job of the ingestion job queue")
+    args = parser.parse_args()
+
+    if args.history and args.depth > 0:
+        # Commits left out of a shallow clone could never be indexed later.
+        logger.info("Indexing the history needs the full clone, ignoring --depth.")
+        args.depth = 0
+
+    progress = None
+    if args.job_id is not None:
+        from .jobs import JobQueue
+        progress = JobQueue().progress_reporter(args.job_id)
+
+    repo_path = ""
+    if args.url:
+        storage_dir = "data/github_repos"
+        repo_name = args.url.split("/")[-1].replace(".git", "")
+        clone_path = os.path.join(storage_dir, repo_name)
+
+        os.makedirs(storage_dir, exist_ok=True)
+
+        # An existing clone is updated in place, only the new objects are downloaded.
+        updating = os.path.exists(clone_path)
+        if progress:
+            progress({"stage": "fetching" if updating else "cloning"})
+        with tracer.span("fetch" if updating else "clone", url=args.url):
+            clone_or_update(args.url, clone_path, args.depth, args.filter, bare=not args.checkout)
+        logger.info("Repository is up to date.")
+        repo_path = clone_path
+
+    else:
+        repo_path = config.TARGET_REPO_PATH
+        repo_name = os.path.basename(os.path.normpath(repo_path))
+        logger.info(f"Using local repository at {repo_path}.")
+
+    git_source = None
+    if not args.checkout:
+        # Reads the committed files; uncommitted changes of a local repository are not indexed.
+        git_source = GitObjectSource(repo_path)
+        logger.info(f"Reading files from git objects at commit {git_source.commit[:12]}.")
+
     vector_store_dir = "data/vector_stores"
     store_save_path = os.path.join(vector_store_dir, repo_name)
-    os.makedirs(store_save_path, exist_ok=True)
-    vector_store.save_local(store_save_path)
-    logger.info(f"Vector store saved locally at: {store_save_path}")
+    with tracer.span("ingest", repo=repo_name):
+        result = run_ingestion(repo_path, store_save_path, args.incremental,
+                               args.workers, args.index_type, progress, git_source)
+    if args.history:
+        if progress:
+            progress({"stage": "history"})
+        history = run_history_ingestion(repo_path, store_save_path, args.index_type,
+                                        args.history_diffs, progress)
+        if result is not None and history is not None:
+            result["history_commits"] = history["commits"]
+    if progress:
+        progress({"stage": "done", **(result or {})})
 
 
 if __name__ == "__main__":
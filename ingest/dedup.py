@@ -0,0 +1,276 @@
+# This script finds duplicate files and chunks, so each distinct chunk is embedded and indexed only once
+import hashlib
+import re
+import zlib
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from . import config
+from .logger import logger
+
+# A Mersenne prime larger than any 32-bit shingle hash, for the MinHash permutations.
+_MERSENNE_PRIME = (1 << 61) - 1
+_WORD_RE = re.compile(r"\w+")
+
+
+def content_hash(text: str) -> str:
+    """
+    Hashes a chunk's text with its whitespace normalized, so reindented or
+    rewrapped copies of the same text get the same hash.
+    """
+    normalized = " ".join(text.split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class MinHashIndex:
+    """
+    Finds near-duplicate texts with MinHash signatures and locality-sensitive hashing.
+
+    Texts are compared on their sets of word shingles. The signature of a text
+    is split into bands; texts sharing a band are candidates, and a candidate
+    is a near-duplicate when its estimated Jaccard similarity reaches the threshold.
+    """
+
+    def __init__(self, threshold: float, num_perm: int = 64, bands: int = 16, shingle_size: int = 5):
+        """
+        Args:
+            threshold (float): The minimum estimated Jaccard similarity of near-duplicates.
+            num_perm (int): The number of hash permutations of a signature.
+            bands (int): The number of LSH bands; num_perm must be a multiple of it.
+            shingle_size (int): The number of words per shingle.
+        """
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        # Fixed seed: signatures must be comparable from one run to the next.
+        rng = np.random.default_rng(1)
+        # 31-bit coefficients keep a * x + b below 2^64 for 32-bit shingle hashes.
+        self._a = rng.integers(1, 1 << 31, num_perm, dtype=np.uint64)[:, None]
+        self._b = rng.integers(0, 1 << 31, num_perm, dtype=np.uint64)[:, None]
+        self._buckets: List[Dict[bytes, List[str]]] = [defaultdict(list) for _ in range(bands)]
+        self._signatures: Dict[str, np.ndarray] = {}
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """
+        Returns the MinHash signature of a text, or None if it is too short to compare.
+        """
+        words = _WORD_RE.findall(text.lower())
+        if len(words) < self.shingle_size:
+            return None
+        shingles = {" ".join(words[i:i + self.shingle_size])
+                    for i in range(len(words) - self.shingle_size + 1)}
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        # (a * x + b) mod p for every permutation and shingle at once.
+        permuted = (self._a * hashes[None, :] + self._b) % np.uint64(_MERSENNE_PRIME)
+        return permuted.min(axis=1)
+
+    def query(self, signature: np.ndarray) -> Optional[str]:
+        """
+        Returns the key of an indexed near-duplicate of a signature, if any.
+        """
+        seen = set()
+        for band, buckets in enumerate(self._buckets):
+            band_key = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            for key in buckets.get(band_key, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                if np.mean(self._signatures[key] == signature) >= self.threshold:
+                    return key
+        return None
+
+    def add(self, key: str, signature: np.ndarray) -> None:
+        self._signatures[key] = signature
+        for band, buckets in enumerate(self._buckets):
+            buckets[signature[band * self.rows:(band + 1) * self.rows].tobytes()].append(key)
+
+
+class Deduplicator:
+    """
+    Keeps one copy of every distinct file and chunk of a vector store.
+
+    Files with the same content hash are loaded once; the copies reuse the
+    chunk ids of the first one. Chunks are keyed by the hash of their
+    whitespace-normalized text (and, optionally, by MinHash similarity), so a
+    chunk already in the store or seen earlier in the run is not embedded
+    again. Every indexed chunk lists the files it appears in under
+    metadata["sources"]; metadata["source"] stays the first of them.
+    """
+
+    def __init__(self, near_duplicates: bool = config.DEDUP_NEAR_DUPLICATES,
+                 threshold: float = config.DEDUP_NEAR_DUPLICATE_THRESHOLD):
+        """
+        Args:
+            near_duplicates (bool): Also detect near-duplicate chunks with MinHash.
+            threshold (float): The minimum estimated Jaccard similarity of near-duplicates.
+        """
+        self._chunk_ids: Dict[str, str] = {}
+        self._taken_ids: Set[str] = set()
+        self._minhash = MinHashIndex(threshold) if near_duplicates else None
+        # Sources gained by chunks that are already indexed or buffered, applied before saving.
+        self._new_sources: Dict[str, Set[str]] = defaultdict(set)
+        self.files = 0
+        self.duplicate_files = 0
+        self.chunks = 0
+        self.duplicate_chunks = 0
+        self.near_duplicate_chunks = 0
+
+    def register_store(self, vector_store) -> None:
+        """
+        Registers the chunks of an existing vector store, so new copies of them are not indexed.
+        """
+        for chunk_id, doc in vector_store.docstore._dict.items():
+            text_hash = doc.metadata.get("content_hash") or content_hash(doc.page_content)
+            self._chunk_ids.setdefault(text_hash, chunk_id)
+            self._taken_ids.add(chunk_id)
+            if self._minhash is not None:
+                signature = self._minhash.signature(doc.page_content)
+                if signature is not None:
+                    self._minhash.add(chunk_id, signature)
+
+    def plan_files(self, files_to_index: List[str], repo_path: str, new_hashes: Dict[str, str],
+                   indexed_files: Dict[str, dict]) -> Tuple[List[str], Dict[str, List[str]], Dict[str, str]]:
+        """
+        Finds the files to index whose content is identical to another file.
+
+        Args:
+            files_to_index (List[str]): The files to index, in order.
+            repo_path (str): The path of the repository.
+            new_hashes (Dict[str, str]): The content hashes already known, completed in place.
+            indexed_files (Dict[str, dict]): The manifest entries of the files already indexed.
+
+        Returns:
+            Tuple[List[str], Dict[str, List[str]], Dict[str, str]]: The files to load,
+            the copies of each of them, and the copies of already indexed files
+            (file path -> relative path of the indexed file).
+        """
+        from .manifest import hash_file, relative_path
+
+        indexed_by_hash = {}
+        for rel_path, entry in indexed_files.items():
+            indexed_by_hash.setdefault(entry["hash"], rel_path)
+
+        to_load = []
+        copies: Dict[str, List[str]] = {}
+        indexed_copies = {}
+        loading_by_hash = {}
+        for file_path in files_to_index:
+            self.files += 1
+            rel_path = relative_path(file_path, repo_path)
+            file_hash = new_hashes.get(rel_path)
+            if file_hash is None:
+                try:
+                    file_hash = new_hashes[rel_path] = hash_file(file_path)
+                except OSError:
+                    # Left to the loader, which skips unreadable files.
+                    to_load.append(file_path)
+                    continue
+            if file_hash in indexed_by_hash:
+                indexed_copies[file_path] = indexed_by_hash[file_hash]
+            elif file_hash in loading_by_hash:
+                copies.setdefault(loading_by_hash[file_hash], []).append(file_path)
+            else:
+                loading_by_hash[file_hash] = file_path
+                to_load.append(file_path)
+                continue
+            self.duplicate_files += 1
+        return to_load, copies, indexed_copies
+
+    def add_sources(self, chunk_ids: Iterable[str], source: str) -> None:
+        """
+        Records that a file also contains chunks that are already indexed or buffered.
+        """
+        for chunk_id in chunk_ids:
+            self._new_sources[chunk_id].add(source)
+
+    def assign(self, chunks: List[Document], chunk_ids: List[str]) -> Tuple[List[str], List[Tuple[Document, str]]]:
+        """
+        Deduplicates the chunks of one file.
+
+        Args:
+            chunks (List[Document]): The chunks of the file.
+            chunk_ids (List[str]): The ids the chunks get if they are new.
+
+        Returns:
+            Tuple[List[str], List[Tuple[Document, str]]]: The ids of all the chunks
+            of the file (distinct, in order), and the new chunks to embed with their ids.
+        """
+        file_chunk_ids = []
+        new_chunks = []
+        for chunk, chunk_id in zip(chunks, chunk_ids):
+            self.chunks += 1
+            text_hash = content_hash(chunk.page_content)
+            existing_id = self._chunk_ids.get(text_hash)
+            signature = None
+            if existing_id is None and self._minhash is not None:
+                signature = self._minhash.signature(chunk.page_content)
+                if signature is not None:
+                    existing_id = self._minhash.query(signature)
+                    if existing_id is not None:
+                        self.near_duplicate_chunks += 1
+            if existing_id is not None:
+                self.duplicate_chunks += 1
+                self.add_sources([existing_id], chunk.metadata.get("source"))
+                if existing_id not in file_chunk_ids:
+                    file_chunk_ids.append(existing_id)
+                continue
+            if chunk_id in self._taken_ids:
+                # The path's old chunk at this position is kept alive by another file that shares it.
+                chunk_id = f"{chunk_id}:{text_hash[:12]}"
+            self._chunk_ids[text_hash] = chunk_id
+            self._taken_ids.add(chunk_id)
+            if signature is not None:
+                self._minhash.add(chunk_id, signature)
+            chunk.metadata["content_hash"] = text_hash
+            chunk.metadata["sources"] = [chunk.metadata.get("source")]
+            file_chunk_ids.append(chunk_id)
+            new_chunks.append((chunk, chunk_id))
+        return file_chunk_ids, new_chunks
+
+    def apply_sources(self, vector_store) -> None:
+        """
+        Writes the sources gained since the last call into the metadata of the indexed chunks.
+        """
+        pending = {}
+        for chunk_id, sources in self._new_sources.items():
+            doc = vector_store.docstore.search(chunk_id)
+            if not isinstance(doc, Document):
+                # Still buffered for index training, applied on a later call.
+                pending[chunk_id] = sources
+                continue
+            known = doc.metadata.setdefault("sources", [doc.metadata.get("source")])
+            known.extend(sorted(source for source in sources if source not in known))
+        self._new_sources = defaultdict(set, pending)
+
+    def log_stats(self) -> None:
+        """
+        Logs how many of the files and chunks of this run were duplicates.
+        """
+        logger.info(
+            f"Deduplication: {self.duplicate_files}/{self.files} files "
+            f"({self.duplicate_files / self.files if self.files else 0:.0%}) and "
+            f"{self.duplicate_chunks}/{self.chunks} chunks "
+            f"({self.duplicate_chunks / self.chunks if self.chunks else 0:.0%}) were duplicates"
+            + (f", {self.near_duplicate_chunks} of them near-duplicates." if self._minhash else "."))
+
+
+def remove_sources(vector_store, chunk_ids: Iterable[str], source_rel_path: str, repo_path: str) -> None:
+    """
+    Removes a deleted or changed file from the sources of chunks that other files still share.
+    """
+    from .manifest import relative_path
+
+    for chunk_id in chunk_ids:
+        doc = vector_store.docstore.search(chunk_id)
+        if not isinstance(doc, Document) or "sources" not in doc.metadata:
+            continue
+        sources = [source for source in doc.metadata["sources"]
+                   if relative_path(source, repo_path) != source_rel_path]
+        doc.metadata["sources"] = sources
+        if sources and relative_path(doc.metadata.get("source", ""), repo_path) == source_rel_path:
+            doc.metadata["source"] = sources[0]
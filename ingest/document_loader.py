@@ -0,0 +1,421 @@
+# This script loads and splits the collected files, optionally on a pool of worker processes
+import io
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, BinaryIO, ContextManager, Iterable, Iterator, List, Optional, Tuple, Union
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import TextLoader, PyPDFLoader, Docx2txtLoader, NotebookLoader
+
+from . import config
+from .chunker import StructureAwareChunker
+from .file_collector import size_limit
+from .logger import logger
+from .text_stream import iter_stream_chunks
+from .tracing import tracer
+
+if TYPE_CHECKING:
+    from .git_source import GitBlob
+
+# How many files are queued per worker, this bounds the memory held by pending results.
+_IN_FLIGHT_PER_WORKER = 4
+
+# The text splitter of the current process, created once per worker by _init_worker.
+_text_splitter = None
+
+
+def make_text_splitter() -> Union[StructureAwareChunker, RecursiveCharacterTextSplitter]:
+    """
+    Initializes the text splitter used for all document types (see config.CHUNKER).
+    """
+    if config.CHUNKER == "structure":
+        return StructureAwareChunker()
+    return RecursiveCharacterTextSplitter(
+        chunk_size=config.CHUNK_SIZE,
+        chunk_overlap=config.CHUNK_OVERLAP,
+        # Offsets let the context packer merge overlapping chunks at query time.
+        add_start_index=True
+    )
+
+
+# A file to load: its path, or its path and content when it was read from git objects
+# (a GitBlob when the blob is large enough to be streamed).
+FileItem = Union[str, Tuple[str, Union[bytes, "GitBlob"]]]
+
+
+def _load_content(file_path: str, data: bytes, file_extension: str) -> List[Document]:
+    # Loads a file that only exists as bytes, with the same metadata as if it was on disk.
+    if file_extension not in ('.ipynb', '.pdf', '.docx'):
+        return [Document(page_content=data.decode('utf-8'), metadata={"source": file_path})]
+    # The loaders of these formats need a real file.
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = os.path.join(tmp_dir, "file" + file_extension)
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        if file_extension == '.ipynb':
+            documents = NotebookLoader(tmp_path).load()
+        elif file_extension == '.pdf':
+            documents = PyPDFLoader(tmp_path).load()
+        else:
+            documents = Docx2txtLoader(tmp_path).load()
+    for document in documents:
+        document.metadata["source"] = file_path
+    return documents
+
+
+def _data_size(file_path: str, data: Union[None, bytes, "GitBlob"]) -> int:
+    if data is None:
+        return os.path.getsize(file_path)
+    return len(data) if isinstance(data, bytes) else data.size
+
+
+def _open_data(file_path: str, data: Union[None, bytes, "GitBlob"]) -> ContextManager[BinaryIO]:
+    # A binary stream over a file on disk, its content, or a blob read from git as it is consumed.
+    if data is None:
+        return open(file_path, "rb")
+    return io.BytesIO(data) if isinstance(data, bytes) else data.open()
+
+
+def _file_size(file_path: str, data: Union[None, bytes, "GitBlob"]) -> Optional[int]:
+    # The size of a file, or None if it must be skipped.
+    try:
+        file_size = _data_size(file_path, data)
+    except OSError:
+        # This can happen for broken symlinks or other file system issues.
+        logger.warning(
+            f"Could not get size of file, skipping: {file_path}")
+        return None
+    # As a safety measure, skip files above the limit of their type to avoid memory issues.
+    if file_size > size_limit(os.path.basename(file_path)):
+        logger.warning(
+            f"Skipping large file: {file_path} ({file_size / (1024*1024):.2f} MB)")
+        return None
+    return file_size
+
+
+def _is_streamed(file_path: str, file_size: int) -> bool:
+    # Text files above the threshold are split window by window (see text_stream).
+    return (file_size > config.STREAM_THRESHOLD_BYTES
+            and os.path.splitext(file_path)[1].lower() not in ('.ipynb', '.pdf', '.docx'))
+
+
+def iter_stream_parts(file_path: str,
+                      text_splitter: Union[StructureAwareChunker, RecursiveCharacterTextSplitter],
+                      data: Union[None, bytes, "GitBlob"] = None) -> Iterator[List[Document]]:
+    """
+    Splits a large text file window by window, yielding the chunks of each window.
+
+    Args:
+        file_path (str): The file to load.
+        text_splitter (Union[StructureAwareChunker, RecursiveCharacterTextSplitter]): The splitter
+            from make_text_splitter.
+        data (Union[None, bytes, GitBlob]): The content of the file, or the blob to stream it
+            from, when it is read from git objects.
+
+    Yields:
+        List[Document]: The chunks of each window, with their byte and line offsets in the file.
+    """
+    with _open_data(file_path, data) as stream:
+        yield from iter_stream_chunks(stream, file_path, text_splitter)
+
+
+def load_file_documents(file_path: str,
+                        text_splitter: Union[StructureAwareChunker, RecursiveCharacterTextSplitter],
+                        timings: Optional[dict] = None,
+                        data: Union[None, bytes, "GitBlob"] = None) -> List[Document]:
+    """
+    Loads a single file with the loader matching its type and splits it into chunks.
+
+    Text files above STREAM_THRESHOLD_BYTES are never read whole, they are
+    split window by window with iter_stream_parts.
+
+    Args:
+        file_path (str): The file to load.
+        text_splitter (Union[StructureAwareChunker, RecursiveCharacterTextSplitter]): The splitter
+            used for all document types, from make_text_splitter.
+        timings (Optional[dict]): If given, receives the file size and the parse and split times.
+        data (Union[None, bytes, GitBlob]): The content of the file, or the blob to read it
+            from, when it is read from git objects.
+
+    Returns:
+        List[Document]: The chunks of the file, empty if it was skipped.
+    """
+    file_size = _file_size(file_path, data)
+    if not file_size:
+        # Also the binary and missing blobs of a git source, which are handed out empty.
+        return []
+
+    logger.info(f"Processing file: {file_path}")
+    parse_started = time.perf_counter()
+    file_extension = os.path.splitext(file_path)[1].lower()
+
+    if _is_streamed(file_path, file_size):
+        chunks = [chunk for part in iter_stream_parts(file_path, text_splitter, data) for chunk in part]
+        if timings is not None:
+            timings["bytes"] = file_size
+        return chunks
+
+    specially_loaded_documents = []
+    if data is not None and not isinstance(data, bytes):
+        # Large notebooks, PDFs and Word files cannot be streamed, their blob is read whole.
+        data = data.read()
+    if data is not None:
+        try:
+            specially_loaded_documents = _load_content(file_path, data, file_extension)
+        except Exception as e:
+            logger.warning(
+                f"Skipping file {file_path} due to loading error: {e}")
+    elif file_extension == '.ipynb':
+        loader = NotebookLoader(file_path)
+        specially_loaded_documents = loader.load()
+    elif file_extension == '.pdf':
+        loader = PyPDFLoader(file_path)
+        specially_loaded_documents = loader.load()
+    elif file_extension == '.docx':
+        loader = Docx2txtLoader(file_path)
+        specially_loaded_documents = loader.load()
+    else:
+        loader = TextLoader(file_path, encoding='utf-8')
+        try:
+            specially_loaded_documents = loader.load()
+        except Exception as e:
+            logger.warning(
+                f"Skipping file {file_path} due to loading error: {e}")
+
+    split_started = time.perf_counter()
+    if not specially_loaded_documents:
+        chunks = []
+    else:
+        chunks = text_splitter.split_documents(specially_loaded_documents)
+    if timings is not None:
+        timings["bytes"] = file_size
+        timings["parse"] = split_started - parse_started
+        timings["split"] = time.perf_counter() - split_started
+    return chunks
+
+
+def _init_worker() -> None:
+    global _text_splitter
+    _text_splitter = make_text_splitter()
+
+
+def _load_in_worker(file_path: str, data: Union[None, bytes, "GitBlob"] = None) -> Tuple[List[Document], int, float, dict]:
+    """
+    Loads one file (from disk, or from its content if given) inside a worker.
+    Any error is caught here, so a bad file never takes the worker down with it.
+
+    Returns:
+        Tuple[List[Document], int, float, dict]: The chunks, the worker pid, the
+        time spent, and the start time, size, parse and split times of the file.
+    """
+    start_time = time.perf_counter()
+    timings = {"start": time.time()}
+    try:
+        chunks = load_file_documents(file_path, _text_splitter, timings, data)
+    except Exception as e:
+        logger.warning(f"Skipping file {file_path} due to loading error: {e}")
+        chunks = []
+    return chunks, os.getpid(), time.perf_counter() - start_time, timings
+
+
+def _record_file(file_path: str, chunks: List[Document], pid: int, timings: dict) -> None:
+    # Workers cannot reach the parent's tracer, so their timings are recorded here.
+    if not tracer.enabled:
+        return
+    tracer.count("files_loaded")
+    tracer.count("chunks", len(chunks))
+    tracer.count("bytes_loaded", timings.get("bytes", 0))
+    if "parse" in timings:
+        tracer.add_span("parse", timings["start"], timings["parse"], pid=pid, file=file_path)
+        tracer.add_span("split", timings["start"] + timings["parse"], timings["split"],
+                        pid=pid, file=file_path, chunks=len(chunks))
+
+
+def _log_worker_stats(worker_stats: dict, wall_time: float) -> None:
+    for pid, (files, chunks, busy_time) in sorted(worker_stats.items()):
+        logger.info(
+            f"Worker {pid}: {files} files, {chunks} chunks in {busy_time:.2f}s "
+            f"({files / busy_time if busy_time else 0:.1f} files/s).")
+    total_files = sum(stats[0] for stats in worker_stats.values())
+    logger.info(
+        f"Loaded {total_files} files with {len(worker_stats)} workers in {wall_time:.2f}s "
+        f"({total_files / wall_time if wall_time else 0:.1f} files/s).")
+
+
+def load_document_parts(file_paths: Iterable[FileItem],
+                        workers: int) -> Iterator[Tuple[str, List[Document], bool]]:
+    """
+    Loads and splits files, yielding their chunks in the same order as the input.
+
+    With more than one worker the files are parsed on a process pool. Only a few
+    files per worker are in flight at any time, so results never pile up in memory.
+    Loading errors are isolated per file. If a file crashes its worker process,
+    the files that were in flight are retried one by one to find the culprit,
+    which is then skipped.
+
+    Text files above STREAM_THRESHOLD_BYTES are split in this process, window by
+    window, when their turn comes (the pool keeps working on the next files):
+    their chunks are yielded in several parts, so a file of hundreds of megabytes
+    is indexed without ever being held in memory.
+
+    Args:
+        file_paths (Iterable[FileItem]): The files to load, as paths or (path, content) pairs.
+        workers (int): The number of worker processes, 1 loads in this process.
+
+    Yields:
+        Tuple[str, List[Document], bool]: Each file path with chunks (empty if
+        skipped), and whether they are the last part of the file.
+    """
+    start_time = time.perf_counter()
+    # pid -> [files, chunks, busy seconds]
+    worker_stats = {}
+
+    def streamed(file_path: str, data: Union[None, bytes, "GitBlob"]) -> bool:
+        try:
+            file_size = _data_size(file_path, data)
+        except OSError:
+            return False
+        return _is_streamed(file_path, file_size)
+
+    def stream(file_path: str, data: Union[None, bytes, "GitBlob"]) -> Iterator[Tuple[str, List[Document], bool]]:
+        if _text_splitter is None:
+            _init_worker()
+        file_size = _file_size(file_path, data)
+        if file_size is None:
+            yield file_path, [], True
+            return
+        logger.info(f"Streaming large file: {file_path} ({file_size / (1024*1024):.2f} MB)")
+        started_at = time.time()
+        parts = iter_stream_parts(file_path, _text_splitter, data)
+        chunk_count = 0
+        # Only the time spent splitting is counted, not the time the caller takes with each part.
+        busy_time = 0.0
+        while True:
+            part_started = time.perf_counter()
+            try:
+                part = next(parts, None)
+            except Exception as e:
+                logger.warning(f"Skipping the rest of file {file_path} due to loading error: {e}")
+                part = None
+            busy_time += time.perf_counter() - part_started
+            if part is None:
+                break
+            chunk_count += len(part)
+            yield file_path, part, False
+        tracer.count("files_loaded")
+        tracer.count("streamed_files")
+        tracer.count("chunks", chunk_count)
+        tracer.count("bytes_loaded", file_size)
+        tracer.add_span("stream_file", started_at, busy_time, file=file_path, chunks=chunk_count)
+        stats = worker_stats.setdefault(os.getpid(), [0, 0, 0.0])
+        stats[0] += 1
+        stats[1] += chunk_count
+        stats[2] += busy_time
+        yield file_path, [], True
+
+    if workers <= 1:
+        _init_worker()
+        for item in file_paths:
+            file_path, data = (item, None) if isinstance(item, str) else item
+            if streamed(file_path, data):
+                yield from stream(file_path, data)
+                continue
+            chunks, pid, elapsed, timings = _load_in_worker(file_path, data)
+            _record_file(file_path, chunks, pid, timings)
+            stats = worker_stats.setdefault(pid, [0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += len(chunks)
+            stats[2] += elapsed
+            yield file_path, chunks, True
+        _log_worker_stats(worker_stats, time.perf_counter() - start_time)
+        return
+
+    paths = iter(file_paths)
+    retry = deque()
+    pending = deque()
+    # Number of upcoming files that must run alone because a worker crashed.
+    isolate = 0
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+    try:
+        while True:
+            limit = 1 if isolate else workers * _IN_FLIGHT_PER_WORKER
+            while len(pending) < limit:
+                item = retry.popleft() if retry else next(paths, None)
+                if item is None:
+                    break
+                file_path, data = (item, None) if isinstance(item, str) else item
+                # Large text files have no future, they are streamed here when their turn comes.
+                future = None
+                if not streamed(file_path, data):
+                    try:
+                        future = executor.submit(_load_in_worker, file_path, data)
+                    except BrokenProcessPool as e:
+                        # A file in flight already crashed the pool: this one is retried with them below.
+                        future = Future()
+                        future.set_exception(e)
+                pending.append((item, future))
+            if not pending:
+                break
+
+            item, future = pending.popleft()
+            file_path, data = (item, None) if isinstance(item, str) else item
+            if future is None:
+                if isolate:
+                    isolate -= 1
+                yield from stream(file_path, data)
+                continue
+            try:
+                chunks, pid, elapsed, timings = future.result()
+            except BrokenProcessPool:
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = ProcessPoolExecutor(
+                    max_workers=workers, initializer=_init_worker)
+                if isolate:
+                    # The file ran alone, so it is the one killing the worker.
+                    logger.error(
+                        f"Skipping file {file_path}: it crashed the worker process.")
+                    isolate -= 1
+                    yield file_path, [], True
+                else:
+                    retry.extend([item] + [pending_item for pending_item, _ in pending])
+                    isolate = len(retry)
+                    logger.warning(
+                        f"A worker process crashed, retrying {isolate} files one by one.")
+                pending.clear()
+                continue
+
+            if isolate:
+                isolate -= 1
+            _record_file(file_path, chunks, pid, timings)
+            stats = worker_stats.setdefault(pid, [0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += len(chunks)
+            stats[2] += elapsed
+            yield file_path, chunks, True
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    _log_worker_stats(worker_stats, time.perf_counter() - start_time)
+
+
+def load_documents(file_paths: Iterable[FileItem], workers: int) -> Iterator[Tuple[str, List[Document]]]:
+    """
+    Loads and splits files like load_document_parts, yielding all the chunks of a file at once.
+
+    Args:
+        file_paths (Iterable[FileItem]): The files to load, as paths or (path, content) pairs.
+        workers (int): The number of worker processes, 1 loads in this process.
+
+    Yields:
+        Tuple[str, List[Document]]: Each file path with its chunks (empty if skipped).
+    """
+    chunks = []
+    for file_path, part, last in load_document_parts(file_paths, workers):
+        chunks.extend(part)
+        if last:
+            yield file_path, chunks
+            chunks = []
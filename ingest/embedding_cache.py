@@ -0,0 +1,184 @@
+# This script caches embeddings on disk so identical chunks are never embedded twice
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+from .logger import logger
+from .tracing import tracer
+
+# SQLite limits the number of parameters of a single statement, so lookups are chunked.
+_LOOKUP_BATCH_SIZE = 500
+
+
+def hash_text(text: str) -> str:
+    """
+    Returns the SHA-256 hex digest of a chunk's text, used as its cache key.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model and stores document vectors in a SQLite file.
+
+    Vectors are keyed by (model name, chunk text hash), so the same cache file can
+    be shared by every repository and is safe to keep when the model changes. The
+    cache is capped at a number of entries and evicts the least recently used ones.
+
+    A model that checks itself before its first use (CPUEmbeddingEngine.verify,
+    which may fall back from int8 or ONNX to fp32) is checked on the first texts
+    embedded, before anything is looked up, and its vectors are cached under its
+    cache_key from then on.
+
+    Only documents are cached: embed_query always calls the model. Questions are
+    rarely asked twice, and a repeated one is answered by the answer cache first,
+    so cached query vectors would mostly evict chunk vectors that are reused.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, cache_path: str, max_entries: int):
+        """
+        Args:
+            embeddings (Embeddings): The embedding model computing cache misses.
+            model_name (str): The model name, part of every cache key.
+            cache_path (str): The SQLite file storing the vectors.
+            max_entries (int): The maximum number of vectors kept in the cache.
+        """
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._verified = not hasattr(embeddings, "verify")
+
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        # The connection is shared by Streamlit's threads, access is serialized by the lock.
+        self._conn = sqlite3.connect(
+            cache_path, timeout=30, check_same_thread=False)
+        # WAL lets several ingestion processes read the cache while one of them writes.
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "last_access REAL NOT NULL, PRIMARY KEY (model, text_hash))")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+        self._conn.commit()
+        self._entries = self._conn.execute(
+            "SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _lookup(self, text_hashes: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        for start in range(0, len(text_hashes), _LOOKUP_BATCH_SIZE):
+            batch = text_hashes[start:start + _LOOKUP_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT text_hash, vector FROM embeddings "
+                f"WHERE model = ? AND text_hash IN ({placeholders})",
+                [self.model_name, *batch])
+            for text_hash, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                found[text_hash] = vector.tolist()
+        return found
+
+    def _evict(self) -> None:
+        # Other processes share the file, so the size is counted again inside the write
+        # transaction, where it cannot change before the eviction.
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        overflow = self._entries - self.max_entries
+        if overflow <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY last_access LIMIT ?)",
+            (overflow,))
+        self._entries -= overflow
+        logger.info(f"Evicted {overflow} least recently used embeddings from the cache.")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds a list of texts, computing only the vectors missing from the cache.
+
+        Args:
+            texts (List[str]): The chunk texts to embed.
+
+        Returns:
+            List[List[float]]: One embedding per text, in the input order.
+        """
+        if not self._verified:
+            self.embeddings.verify(texts)
+            self.model_name = self.embeddings.cache_key
+            self._verified = True
+        text_hashes = [hash_text(text) for text in texts]
+        with self._lock:
+            cached = self._lookup(list(set(text_hashes)))
+
+        # Identical texts in the same call are only embedded once.
+        missing = {}
+        for text, text_hash in zip(texts, text_hashes):
+            if text_hash not in cached and text_hash not in missing:
+                missing[text_hash] = text
+        computed = {}
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+
+        tracer.count("embedding_cache", len(texts) - len(missing), result="hit")
+        tracer.count("embedding_cache", len(missing), result="miss")
+        now = time.time()
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+            # Takes the write lock up front, so the count and the eviction see no concurrent insert.
+            self._conn.execute("BEGIN IMMEDIATE")
+            if cached:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                    [(now, self.model_name, text_hash) for text_hash in cached])
+            if computed:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, last_access) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(self.model_name, text_hash, array("f", vector).tobytes(), now)
+                     for text_hash, vector in computed.items()])
+                self._evict()
+            self._conn.commit()
+
+        cached.update(computed)
+        return [cached[text_hash] for text_hash in text_hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embeds a search query with the wrapped model, without going through the cache.
+
+        Args:
+            text (str): The question to embed.
+
+        Returns:
+            List[float]: The query embedding.
+        """
+        return self.embeddings.embed_query(text)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the hit and miss counters of this process and the cache size.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": self._entries,
+            }
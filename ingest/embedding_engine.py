@@ -0,0 +1,358 @@
+# This script embeds chunks on CPU with length-bucketed batches, a pool of worker processes and optional int8 or ONNX models
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from . import config
+from .logger import logger
+
+# "torch" runs the fp32 model, "int8" quantizes its linear layers, "onnx" runs it with ONNX Runtime.
+BACKENDS = ("torch", "int8", "onnx")
+# Longest input of the model in tokens, special tokens included; longer texts are truncated.
+_MAX_SEQ_LENGTH = 512
+
+# The model of the current worker process, loaded once by _init_worker.
+_worker_model = None
+# Also compared with fp32 when a backend is checked, so a check made by a query process (which
+# has no chunks at hand) still covers code and prose.
+_VERIFY_TEXTS = (
+    "def load_documents(file_paths, workers):\n    return [load(path) for path in file_paths]",
+    "class QueryService:\n    def retrieve(self, question: str, k: int = 4) -> list: ...",
+    "## Installation\n\nRun `pip install -r requirements.txt`, then start the app with `python App.py`.",
+    "Fix the race in the embedding cache when two processes write the same chunk.",
+    "How does the ingestion pipeline decide which files to re-embed?",
+    "SELECT chunk_id, vector FROM embeddings WHERE model = ? ORDER BY last_used DESC LIMIT 100",
+)
+
+
+def load_model(model_name: str, backend: str, threads: Optional[int] = None):
+    """
+    Loads a sentence-transformers model for CPU inference.
+
+    Args:
+        model_name (str): The Hugging Face model.
+        backend (str): One of BACKENDS.
+        threads (Optional[int]): The number of torch threads of this process, torch's default if None.
+
+    Returns:
+        SentenceTransformer: The model.
+    """
+    # torch and sentence-transformers take seconds to import, so they are imported here.
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if threads:
+        torch.set_num_threads(threads)
+    if backend == "onnx":
+        # Needs optimum[onnxruntime]; the model is exported to ONNX on first use.
+        return SentenceTransformer(model_name, device="cpu", backend="onnx")
+    model = SentenceTransformer(model_name, device="cpu")
+    if backend == "int8":
+        # Linear layers do most of the work of a BERT model: their weights are stored in
+        # int8 and activations are quantized on the fly.
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def encode(model, texts: Sequence[str]) -> np.ndarray:
+    """
+    Embeds texts as one batch, like HuggingFaceEmbeddings does (newlines replaced, not normalized).
+    """
+    # The same preprocessing as HuggingFaceEmbeddings, so vectors match the stores and cache it filled.
+    texts = [text.replace("\n", " ") for text in texts]
+    return model.encode(texts, batch_size=len(texts), convert_to_numpy=True,
+                        show_progress_bar=False).astype(np.float32, copy=False)
+
+
+def cosine_similarities(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Returns the cosine similarity of each row of a with the same row of b.
+    """
+    norms = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    return np.sum(a * b, axis=1) / np.maximum(norms, 1e-12)
+
+
+def make_batches(lengths: Sequence[int], max_batch_tokens: int, max_batch_size: int) -> List[List[int]]:
+    """
+    Groups texts of similar length, so batches are padded as little as possible.
+
+    Texts are sorted by decreasing length and a batch is closed when its padded
+    size (number of texts times the longest one) would exceed max_batch_tokens:
+    batches of short texts are large, batches of long texts are small, and the
+    memory of a forward pass stays bounded.
+
+    Args:
+        lengths (Sequence[int]): The length of every text in tokens.
+        max_batch_tokens (int): The maximum padded size of a batch.
+        max_batch_size (int): The maximum number of texts of a batch.
+
+    Returns:
+        List[List[int]]: The indices of the texts of each batch, longest batch first.
+    """
+    order = sorted(range(len(lengths)), key=lambda index: lengths[index], reverse=True)
+    batches = []
+    current = []
+    for index in order:
+        # The first text of a batch is its longest, every other text is padded to it.
+        if current and (len(current) >= max_batch_size
+                        or (len(current) + 1) * lengths[current[0]] > max_batch_tokens):
+            batches.append(current)
+            current = []
+        current.append(index)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def load_checks(path: str = config.EMBED_CHECKS_PATH) -> dict:
+    """
+    Reads the saved backend checks: the worst cosine similarity to fp32 of each model@backend.
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable embedding backend checks {path}: {e}")
+        return {}
+
+
+def save_check(key: str, worst: float, sample: int, path: str = config.EMBED_CHECKS_PATH) -> None:
+    """
+    Atomically records the outcome of a backend check, next to the checks of other models.
+    """
+    checks = load_checks(path)
+    checks[key] = {"worst_cosine": worst, "sample": sample}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checks, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _init_worker(model_name: str, backend: str, threads: int) -> None:
+    global _worker_model
+    _worker_model = load_model(model_name, backend, threads)
+
+
+def _encode_in_worker(texts: List[str]) -> np.ndarray:
+    return encode(_worker_model, texts)
+
+
+class CPUEmbeddingEngine(Embeddings):
+    """
+    Embeds documents on CPU as fast as the machine allows.
+
+    Texts are measured with the model's fast tokenizer and grouped into batches
+    of similar length under a padded-token cap (see make_batches). With several
+    workers the batches are encoded in parallel by a pool of processes, each
+    with its own copy of the model and its share of the CPU threads. The model
+    can be the fp32 one, an int8-quantized one or an ONNX export; before the
+    first text is embedded with int8 or ONNX, a sample of the documents (plus
+    a few fixed texts) is also embedded with the fp32 model, and the engine
+    falls back to fp32 if any vector is further than the cosine tolerance from
+    its fp32 counterpart. The outcome is saved to config.EMBED_CHECKS_PATH and
+    reused by every later engine, so query processes embed with the model the
+    stores were filled with instead of checking again.
+
+    Queries are embedded in this process, so the pool is only started by ingestion.
+    """
+
+    def __init__(self, model_name: str = config.EMBEDDING_MODEL_NAME, backend: str = config.EMBED_BACKEND,
+                 workers: int = config.EMBED_WORKERS, max_batch_tokens: int = config.EMBED_MAX_BATCH_TOKENS,
+                 max_batch_size: int = config.EMBED_MAX_BATCH_SIZE,
+                 tolerance: float = config.EMBED_COSINE_TOLERANCE, threads: int = config.EMBED_THREADS):
+        """
+        Args:
+            model_name (str): The Hugging Face model.
+            backend (str): One of BACKENDS.
+            workers (int): The number of encoding processes, 1 encodes in this process.
+            max_batch_tokens (int): The maximum padded size of a batch, which bounds its memory.
+            max_batch_size (int): The maximum number of texts of a batch.
+            tolerance (float): The maximum distance (1 - cosine similarity) to the fp32 vectors.
+            threads (int): The torch threads shared by the encoding processes.
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {BACKENDS}.")
+        self.model_name = model_name
+        self.backend = backend
+        self.workers = workers
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.tolerance = tolerance
+        self.threads = threads
+        self.texts = 0
+        self.seconds = 0.0
+        self._verified = backend == "torch"
+        self._model = None
+        self._executor = None
+        self._token_counter = None
+        self._lock = threading.Lock()
+        self._verify_lock = threading.Lock()
+
+    @property
+    def cache_key(self) -> str:
+        """
+        The model name under which the vectors of this engine are cached, final once verify has run.
+        """
+        return self.model_name if self.backend == "torch" else f"{self.model_name}@{self.backend}"
+
+    def _local_model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    logger.info(f"Loading the {self.backend} embedding model on CPU...")
+                    self._model = load_model(self.model_name, self.backend, self.threads)
+        return self._model
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            threads = max(1, self.threads // self.workers)
+            logger.info(
+                f"Starting {self.workers} embedding workers ({self.backend}, {threads} threads each)...")
+            # Forking a process that already runs torch threads can deadlock, workers are spawned.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker, initargs=(self.model_name, self.backend, threads))
+        return self._executor
+
+    def verify(self, texts: Sequence[str] = ()) -> None:
+        """
+        Checks the int8 or ONNX model against the fp32 one, once, and falls back to fp32 if needed.
+
+        It runs before the first documents or query are embedded. A check saved by
+        an earlier engine (the ingestion, typically) is reused as is, otherwise the
+        first EMBED_VERIFY_SAMPLE documents and a few fixed texts are embedded with
+        both models, and the outcome is saved for later engines. A query process
+        with no saved check compares the fixed texts alone.
+
+        Args:
+            texts (Sequence[str]): Documents about to be embedded, empty before a query.
+        """
+        with self._verify_lock:
+            if self._verified:
+                return
+            key = self.cache_key
+            check = load_checks().get(key)
+            if check is None:
+                sample = list(texts[:config.EMBED_VERIFY_SAMPLE]) + list(_VERIFY_TEXTS)
+                expected = encode(load_model(self.model_name, "torch"), sample)
+                worst = float(cosine_similarities(encode(self._local_model(), sample), expected).min())
+                save_check(key, worst, len(sample))
+                origin = f"on {len(sample)} texts"
+            else:
+                worst = check["worst_cosine"]
+                origin = f"({config.EMBED_CHECKS_PATH})"
+            if worst < 1 - self.tolerance:
+                logger.error(
+                    f"{self.backend} embeddings differ from fp32 beyond the tolerance (cosine {worst:.5f} "
+                    f"< {1 - self.tolerance:.5f} {origin}), falling back to the fp32 model.")
+                with self._lock:
+                    self.backend = "torch"
+                    self._model = None
+            else:
+                logger.info(f"{self.backend} embeddings match fp32 within cosine {worst:.5f} {origin}.")
+            self._verified = True
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds documents in length-bucketed batches, on the worker pool if there is one.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: The vectors, in the order of the texts.
+        """
+        if not texts:
+            return []
+        if not self._verified:
+            self.verify(texts)
+        start_time = time.perf_counter()
+        if self._token_counter is None:
+            from .chunker import TokenCounter
+            self._token_counter = TokenCounter(self.model_name)
+        # Two special tokens are added to every text, and texts are truncated to the model's window.
+        lengths = [min(tokens + 2, _MAX_SEQ_LENGTH) for tokens in self._token_counter.count(texts)]
+        batches = make_batches(lengths, self.max_batch_tokens, self.max_batch_size)
+        batch_texts = [[texts[index] for index in batch] for batch in batches]
+        if self.workers > 1:
+            results = self._pool().map(_encode_in_worker, batch_texts)
+        else:
+            model = self._local_model()
+            results = (encode(model, texts_of_batch) for texts_of_batch in batch_texts)
+
+        vectors = [None] * len(texts)
+        for batch, batch_vectors in zip(batches, results):
+            for index, vector in zip(batch, batch_vectors.tolist()):
+                vectors[index] = vector
+        self.texts += len(texts)
+        self.seconds += time.perf_counter() - start_time
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embeds a query in this process, with the model the documents were embedded with.
+        """
+        if not self._verified:
+            self.verify()
+        return encode(self._local_model(), [text])[0].tolist()
+
+    def close(self) -> None:
+        """
+        Stops the worker pool, if it was started.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def main():
+    """
+    Benchmarks an embedding configuration against the fp32 model on the chunks of a repository.
+    """
+    from .document_loader import load_documents
+    from .file_collector import collect_target_files
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repo", type=str, default=config.TARGET_REPO_PATH, help="Repository to chunk")
+    parser.add_argument("--limit", type=int, default=2000, help="Maximum number of chunks embedded")
+    parser.add_argument("--backend", type=str, choices=BACKENDS, default=config.EMBED_BACKEND)
+    parser.add_argument("--workers", type=int, default=config.EMBED_WORKERS)
+    args = parser.parse_args()
+
+    texts = []
+    for _, chunks in load_documents(collect_target_files(args.repo), config.INGEST_WORKERS):
+        texts.extend(chunk.page_content for chunk in chunks)
+        if len(texts) >= args.limit:
+            break
+    texts = texts[:args.limit]
+
+    results = {}
+    for name, engine in (("fp32, 1 process", CPUEmbeddingEngine(backend="torch", workers=1)),
+                         (f"{args.backend}, {args.workers} processes",
+                          CPUEmbeddingEngine(backend=args.backend, workers=args.workers))):
+        # Warms up the model (and the workers) so loading is not measured.
+        engine.embed_documents(texts[:engine.max_batch_size])
+        engine.texts, engine.seconds = 0, 0.0
+        results[name] = np.array(engine.embed_documents(texts), dtype=np.float32)
+        logger.info(f"{name}: {engine.texts / engine.seconds:.1f} chunks/s")
+        engine.close()
+    baseline, candidate = results.values()
+    similarities = cosine_similarities(baseline, candidate)
+    logger.info(
+        f"Cosine similarity to fp32 over {len(texts)} chunks: min {similarities.min():.5f}, "
+        f"mean {similarities.mean():.5f} (tolerance {1 - config.EMBED_COSINE_TOLERANCE:.5f}).")
+
+
+if __name__ == "__main__":
+    main()
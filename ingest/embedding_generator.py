@@ -1,27 +1,94 @@
 # The script to generate embeddings (for testing purpose)
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING, List
+
 from . import config
-from typing import List
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_core.documents import Document
-import torch
 from ingest.logger import logger
 
-device = "cpu"
-if torch.cuda.is_available():
-    device = "cuda"
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+    from langchain_core.embeddings import Embeddings
+
+# The model is only loaded on first use, importing this module must stay cheap.
+_embedding_model = None
+_embedding_model_lock = threading.Lock()
+
+
+def _create_embedding_model() -> Embeddings:
+    # torch and sentence-transformers take seconds to import, so they are imported here.
+    import torch
+
+    device = "cpu"
+    if torch.cuda.is_available():
+        device = "cuda"
+
+    logger.info(f"Embedding model is using device: {device}")
+    cache_key = config.EMBEDDING_MODEL_NAME
+    if device == "cpu":
+        from ingest.embedding_engine import CPUEmbeddingEngine
+        embedding_model = CPUEmbeddingEngine()
+        # int8 and ONNX vectors are cached apart from the fp32 ones. The backend is checked on the
+        # first chunks embedded, CachedEmbeddings reads the key once it is (see CachedEmbeddings).
+        cache_key = embedding_model.cache_key
+    else:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        embedding_model = HuggingFaceEmbeddings(
+            model_name=config.EMBEDDING_MODEL_NAME, model_kwargs={'device': device})
+
+    # Wrap the model so chunks that were already embedded are read back from disk.
+    if config.EMBEDDING_CACHE_ENABLED:
+        from ingest.embedding_cache import CachedEmbeddings
+        embedding_model = CachedEmbeddings(
+            embedding_model,
+            model_name=cache_key,
+            cache_path=config.EMBEDDING_CACHE_PATH,
+            max_entries=config.EMBEDDING_CACHE_MAX_ENTRIES)
+    return embedding_model
+
+
+def get_embedding_model() -> Embeddings:
+    """
+    Returns the embedding model shared across the application, loading it on first use.
+
+    Returns:
+        Embeddings: The (cached) Hugging Face embedding model.
+    """
+    global _embedding_model
+    if _embedding_model is None:
+        with _embedding_model_lock:
+            # Another thread may have loaded the model while we were waiting for the lock.
+            if _embedding_model is None:
+                _embedding_model = _create_embedding_model()
+    return _embedding_model
+
+
+def set_embedding_model(embedding_model: Embeddings) -> None:
+    """
+    Replaces the shared embedding model, e.g. with a deterministic fake for offline benchmarks.
+
+    Args:
+        embedding_model (Embeddings): The model to use from now on.
+    """
+    global _embedding_model
+    with _embedding_model_lock:
+        _embedding_model = embedding_model
+
 
-logger.info(f"Embedding model is using device: {device}")
-# Initialize the embedding model from Hugging Face once and reuse it across the application.
-embedding_model = HuggingFaceEmbeddings(
-    model_name=config.EMBEDDING_MODEL_NAME, model_kwargs={'device': device})
+def __getattr__(name: str):
+    # Keeps `from ingest.embedding_generator import embedding_model` working, lazily.
+    if name == "embedding_model":
+        return get_embedding_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
-def generate_embeddings(documents: List[Document], embedding_model: HuggingFaceEmbeddings) -> List[List[float]]:
+def generate_embeddings(documents: List[Document], embedding_model: Embeddings) -> List[List[float]]:
     """Generates embeddings for a list of documents using a HuggingFace model.
 
     Args:
         documents (List[Document]): A list of LangChain Document objects.
-        embedding_model (HuggingFaceEmbeddings): The embedding model instance.
+        embedding_model (Embeddings): The embedding model instance.
 
     Returns:
         List[List[float]]: A list of embeddings, where each embedding is a list of floats.
@@ -0,0 +1,116 @@
+# This script searches several knowledge bases at once and merges their hits into one ranking
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from . import config
+from .logger import logger
+from .tracing import tracer
+
+# Shared by every federated search, so searches never create threads.
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=config.FEDERATED_SEARCH_WORKERS, thread_name_prefix="federated-search")
+    return _executor
+
+
+def distance_to_similarity(distance: float, query_norm_sq: float) -> float:
+    """
+    Converts a squared L2 distance into a cosine-like similarity in [-1, 1].
+
+    For normalized embeddings (like the BGE model's), ||q - d||² = 2 - 2·cos, so
+    the similarity does not depend on the index type or the size of the store,
+    and hits of different stores can be ranked together. The query norm makes
+    the conversion hold for unnormalized embeddings of similar length too.
+    """
+    return 1.0 - distance / (2.0 * query_norm_sq)
+
+
+def _load_one(repo_name: str, get_vector_store: Callable[[str], Optional[Any]]):
+    try:
+        return repo_name, get_vector_store(repo_name)
+    except Exception as e:
+        logger.warning(f"Loading knowledge base '{repo_name}' failed: {e}")
+        return repo_name, None
+
+
+def _search_one(repo_name: str, vector_store, query_vector: List[float], k: int):
+    try:
+        return repo_name, vector_store.similarity_search_with_score_by_vector(query_vector, k)
+    except Exception as e:
+        # One broken store must not fail the search of all the others.
+        logger.warning(f"Search in knowledge base '{repo_name}' failed: {e}")
+        return repo_name, []
+
+
+def search_stores(stores: Dict[str, Any], query_vector: List[float], k: int) -> List[Tuple[str, Document, float]]:
+    """
+    Searches the vector stores in parallel and returns the global top-k.
+
+    Args:
+        stores (Dict[str, VectorStore]): The vector store of each repository.
+        query_vector (List[float]): The embedded question.
+        k (int): The number of hits returned.
+
+    Returns:
+        List[Tuple[str, Document, float]]: The repository, chunk and similarity
+        of the best hits over all stores, most similar first.
+    """
+    query_norm_sq = float(np.dot(query_vector, query_vector)) or 1.0
+    futures = [_get_executor().submit(_search_one, repo_name, vector_store, query_vector, k)
+               for repo_name, vector_store in stores.items()]
+    hits = []
+    for future in futures:
+        repo_name, results = future.result()
+        for doc, distance in results:
+            hits.append((repo_name, doc, distance_to_similarity(float(distance), query_norm_sq)))
+    hits.sort(key=lambda hit: hit[2], reverse=True)
+    return hits[:k]
+
+
+class FederatedRetriever(BaseRetriever):
+    """
+    A retriever over several knowledge bases.
+
+    The stores are loaded in parallel on a shared thread pool while the question
+    is embedded once, every store is then searched on the same pool, and the
+    hits are merged by similarity. Each returned
+    chunk carries its repository in metadata["repo"] and its similarity in
+    metadata["score"].
+    """
+
+    repo_names: List[str]
+    k: int = 5
+    get_vector_store: Callable[[str], Optional[Any]]
+    embeddings: Embeddings
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        # Stores not loaded yet are read from disk in parallel, while this thread embeds the question.
+        futures = [_get_executor().submit(_load_one, repo_name, self.get_vector_store)
+                   for repo_name in self.repo_names]
+        query_vector = self.embeddings.embed_query(query)
+        stores = {repo_name: vector_store for repo_name, vector_store in (future.result() for future in futures)
+                  if vector_store is not None}
+        if not stores:
+            return []
+
+        with tracer.span("federated_search", stores=len(stores)):
+            hits = search_stores(stores, query_vector, self.k)
+        return [Document(id=doc.id, page_content=doc.page_content,
+                         metadata={**doc.metadata, "repo": repo_name, "score": score})
+                for repo_name, doc, score in hits]
@@ -1,37 +1,324 @@
+import codecs
 import os
+import re
+import stat
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, NamedTuple, Optional, Tuple
+
 from . import config
 from .logger import logger
-from typing import List
 
+# Extensions read by a dedicated loader; every other file must be text.
+_LOADER_TYPES = {".pdf": "pdf", ".docx": "docx", ".ipynb": "notebook"}
+# The first bytes these binary formats must start with.
+_MAGIC_BYTES = {"pdf": b"%PDF", "docx": b"PK"}
+# str.endswith accepts a tuple, which also matches multi-part extensions like ".tar.gz".
+_IGNORED_SUFFIXES = tuple(ext.lower() for ext in config.IGNORE_EXTS)
 
-def collect_target_files(base_path: str) -> List[str]:
+
+class FileEntry(NamedTuple):
     """
-    Recursively collects all relevant files from a base path, intelligently
-    skipping specified directories and file extensions.
+    A collected file, with the stat results of the walk so later stages do not stat it again.
+    """
+    path: str
+    rel_path: str
+    size: int
+    mtime_ns: int
+    # "text", "pdf", "docx" or "notebook".
+    file_type: str
+
+
+def has_ignored_extension(filename: str) -> bool:
+    """
+    Checks a file name against IGNORE_EXTS, including multi-part extensions like ".tar.gz".
+    """
+    return filename.lower().endswith(_IGNORED_SUFFIXES)
+
+
+def _loader_type(filename: str) -> str:
+    # Cheaper than os.path.splitext, which matters when walking hundreds of thousands of files.
+    dot = filename.rfind(".")
+    return _LOADER_TYPES.get(filename[dot:].lower(), "text") if dot > 0 else "text"
+
+
+def size_limit(filename: str) -> int:
+    """
+    Returns the size above which a file is not indexed, from FILE_SIZE_LIMITS and its type.
+    """
+    return config.FILE_SIZE_LIMITS[_loader_type(filename)]
+
+
+def _translate_glob(pattern: str) -> str:
+    # Translates a gitignore glob to a regex: "*" and "?" never match "/", "**" matches across directories.
+    parts = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**", i) and (i == 0 or pattern[i - 1] == "/") and \
+                    (i + 2 == n or pattern[i + 2] == "/"):
+                if i + 2 == n:
+                    parts.append(".*")
+                    i += 2
+                else:
+                    parts.append("(?:.*/)?")
+                    i += 3
+                continue
+            while i < n and pattern[i] == "*":
+                i += 1
+            parts.append("[^/]*")
+            continue
+        if c == "?":
+            parts.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 2 if pattern[i + 1:i + 2] in ("!", "^") else i + 1)
+            if end == -1:
+                parts.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body[:1] in ("!", "^"):
+                    body = "^" + body[1:]
+                parts.append("[" + body.replace("\\", "\\\\") + "]")
+                i = end
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return "".join(parts)
+
+
+class _IgnoreRule(NamedTuple):
+    regex: "re.Pattern"
+    negated: bool
+    dir_only: bool
+    # Anchored rules match the path relative to their .gitignore, the others only the name.
+    anchored: bool
+    # The repository relative directory of the .gitignore file, "" for the root.
+    base: str
+
+
+def parse_gitignore(text: str, base: str = "") -> List[_IgnoreRule]:
+    """
+    Parses the rules of a .gitignore file.
+
+    Args:
+        text (str): The content of the file.
+        base (str): The repository relative directory holding it, "" for the root.
+
+    Returns:
+        List[_IgnoreRule]: The rules, in file order.
+    """
+    rules = []
+    for line in text.splitlines():
+        # Trailing spaces are ignored unless escaped.
+        line = line.rstrip(" ") if not line.endswith("\\ ") else line
+        if not line or line.startswith("#"):
+            continue
+        negated = line.startswith("!")
+        if negated:
+            line = line[1:]
+        elif line.startswith("\\"):
+            line = line[1:]
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            continue
+        anchored = "/" in line
+        line = line.lstrip("/")
+        try:
+            regex = re.compile(_translate_glob(line) + r"\Z", re.DOTALL)
+        except re.error:
+            continue
+        rules.append(_IgnoreRule(regex, negated, dir_only, anchored, base))
+    return rules
+
+
+def is_ignored_by(rules: List[_IgnoreRule], rel_path: str, is_dir: bool) -> bool:
+    """
+    Applies gitignore rules to a repository relative path; the last matching rule wins.
+    """
+    name = rel_path.rsplit("/", 1)[-1]
+    ignored = False
+    for rule in rules:
+        if rule.dir_only and not is_dir:
+            continue
+        if rule.anchored:
+            if rule.base:
+                if not rel_path.startswith(rule.base + "/"):
+                    continue
+                subject = rel_path[len(rule.base) + 1:]
+            else:
+                subject = rel_path
+        else:
+            subject = name
+        if rule.regex.match(subject):
+            ignored = not rule.negated
+    return ignored
+
+
+def _read_rules(path: str, base: str) -> List[_IgnoreRule]:
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return parse_gitignore(f.read(), base)
+    except OSError:
+        return []
+
+
+def sniff_head(head: bytes, filename: str, complete: bool) -> Optional[str]:
+    """
+    Detects the type of a file from its name and first bytes.
+
+    Args:
+        head (bytes): The first bytes of the file.
+        filename (str): The name of the file.
+        complete (bool): Whether head is the whole file.
+
+    Returns:
+        Optional[str]: "text", "pdf", "docx" or "notebook", or None for a binary
+        file (or one that is not valid UTF-8, which the text loader cannot read).
+    """
+    file_type = _loader_type(filename)
+    magic = _MAGIC_BYTES.get(file_type)
+    if magic is not None:
+        return file_type if head.startswith(magic) else None
+    if b"\0" in head:
+        return None
+    try:
+        # Unless the whole file was read, a multi-byte character cut by the end of the sample is not an error.
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=complete)
+    except UnicodeDecodeError:
+        return None
+    return file_type
+
+
+def sniff_file_type(path: str, filename: str, sniff_bytes: int = config.SNIFF_BYTES) -> Optional[str]:
+    """
+    Detects the type of a file on disk from its extension and first bytes (see sniff_head).
+    """
+    try:
+        with open(path, "rb") as f:
+            head = f.read(sniff_bytes)
+    except OSError:
+        return None
+    return sniff_head(head, filename, complete=len(head) < sniff_bytes)
+
+
+def _scan_dir(dir_path: str, rel_dir: str, rules: List[_IgnoreRule], options: dict
+              ) -> Tuple[List[FileEntry], List[Tuple[str, str, List[_IgnoreRule]]], dict]:
+    # Scans one directory: returns its files, its subdirectories to walk, and skip counts.
+    files = []
+    subdirs = []
+    skipped = {"ignored": 0, "large": 0, "binary": 0}
+    try:
+        entries = list(os.scandir(dir_path))
+    except OSError as e:
+        logger.warning(f"Could not list directory, skipping: {dir_path} ({e})")
+        return files, subdirs, skipped
+    if options["gitignore"] and any(entry.name == ".gitignore" for entry in entries):
+        # Rules of a .gitignore apply to its directory and everything below it.
+        rules = rules + _read_rules(os.path.join(dir_path, ".gitignore"), rel_dir)
+
+    for entry in entries:
+        name = entry.name
+        rel_path = f"{rel_dir}/{name}" if rel_dir else name
+        try:
+            # Symlinks are not followed, like os.walk.
+            if entry.is_dir(follow_symlinks=False):
+                if name in config.IGNORE_DIRS or (rules and is_ignored_by(rules, rel_path, is_dir=True)):
+                    skipped["ignored"] += 1
+                    continue
+                subdirs.append((entry.path, rel_path, rules))
+                continue
+            # The stat result is cached by scandir on Windows and costs one call elsewhere.
+            entry_stat = entry.stat()
+        except OSError:
+            continue
+        if not stat.S_ISREG(entry_stat.st_mode):
+            continue
+        if has_ignored_extension(name) or (rules and is_ignored_by(rules, rel_path, is_dir=False)):
+            skipped["ignored"] += 1
+            continue
+        if entry_stat.st_size > size_limit(name) or entry_stat.st_size == 0:
+            skipped["large" if entry_stat.st_size else "ignored"] += 1
+            continue
+        file_type = sniff_file_type(entry.path, name) if options["sniff"] else _loader_type(name)
+        if file_type is None:
+            skipped["binary"] += 1
+            continue
+        files.append(FileEntry(entry.path, rel_path, entry_stat.st_size, entry_stat.st_mtime_ns, file_type))
+    return files, subdirs, skipped
+
+
+def scan_target_files(base_path: str, workers: int = config.WALK_WORKERS,
+                      respect_gitignore: bool = True, sniff: bool = True) -> List[FileEntry]:
+    """
+    Walks a repository with os.scandir and collects the files worth indexing.
+
+    Directories in IGNORE_DIRS, files with an extension in IGNORE_EXTS (multi-part
+    ones included), paths ignored by the repository's .gitignore files and
+    .git/info/exclude, empty files and files above the size limit of their type
+    (FILE_SIZE_LIMITS) are skipped using the stat results of the walk. The first
+    bytes of the remaining files are sniffed to skip binaries. With several
+    workers, directories are scanned in parallel on a thread pool.
 
     Args:
         base_path (str): The root directory to start searching from.
+        workers (int): The number of threads scanning directories, 1 scans in this thread.
+        respect_gitignore (bool): Apply the .gitignore rules of the repository.
+        sniff (bool): Read the first bytes of every file to detect binaries.
 
     Returns:
-        List[str]: A list of absolute file paths for all matched files.
+        List[FileEntry]: The collected files, sorted by relative path.
     """
-    matched_files = []
-    # Use os.walk to traverse the directory tree from the base path.
-    for root, dirs, files in os.walk(base_path):
-        # Modify dirs in-place to prevent os.walk from entering ignored directories.
-        dirs[:] = [d for d in dirs if d not in config.IGNORE_DIRS]
+    options = {"gitignore": respect_gitignore, "sniff": sniff}
+    root_rules = []
+    if respect_gitignore:
+        root_rules = _read_rules(os.path.join(base_path, ".git", "info", "exclude"), "")
+
+    collected = []
+    skipped = {"ignored": 0, "large": 0, "binary": 0}
+
+    def add(result):
+        files, subdirs, dir_skipped = result
+        collected.extend(files)
+        for key, value in dir_skipped.items():
+            skipped[key] += value
+        return subdirs
+
+    if workers <= 1:
+        stack = [(base_path, "", root_rules)]
+        while stack:
+            stack.extend(add(_scan_dir(*stack.pop(), options)))
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="walk") as executor:
+            pending = {executor.submit(_scan_dir, base_path, "", root_rules, options)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for subdir in add(future.result()):
+                        pending.add(executor.submit(_scan_dir, *subdir, options))
+
+    collected.sort(key=lambda entry: entry.rel_path)
+    logger.info(
+        f"Skipped {skipped['ignored']} ignored paths, {skipped['large']} large files "
+        f"and {skipped['binary']} binary files.")
+    return collected
 
-        # Iterate through each file found in the current directory.
-        for filename in files:
-            # Split the filename to get its extension.
-            _, file_ext = os.path.splitext(filename)
 
-            # Add the file to the list if its extension is not in the ignore list.
-            if file_ext not in config.IGNORE_EXTS:
-                file_path = os.path.join(root, filename)
-                matched_files.append(file_path)
+def collect_target_files(base_path: str) -> List[str]:
+    """
+    Recursively collects all relevant files from a base path, intelligently
+    skipping ignored directories, files and binaries (see scan_target_files).
+
+    Args:
+        base_path (str): The root directory to start searching from.
 
-    return matched_files
+    Returns:
+        List[str]: A list of file paths for all matched files.
+    """
+    return [entry.path for entry in scan_target_files(base_path)]
 
 
 # This block allows the script to be run directly for testing purposes.
@@ -45,4 +332,4 @@ if __name__ == "__main__":
     # Log the total number of files found and display the first 10.
     logger.info(f"[+] Found {len(files)} files:")
     for f in files:
-        logger.info(f"\u2514\u2500\u2500 {os.path.relpath(f, target_repo)}")
+        logger.info(f"└── {os.path.relpath(f, target_repo)}")
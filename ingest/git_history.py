@@ -0,0 +1,362 @@
+# This script indexes the commit history of a repository, continuing from the last indexed commit on every run
+import json
+import os
+import re
+import subprocess
+from typing import Any, Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from . import config
+from .logger import logger
+from .symbol_index import fuse
+from .tracing import tracer
+
+# The history of a repository is a vector store of its own, in this directory of the repository's store.
+HISTORY_DIRNAME = "history"
+CURSOR_FILENAME = "history.json"
+CURSOR_VERSION = 1
+
+# Every commit of the log starts with a record separator, its fields end with a unit
+# separator: the message spans several lines, and is followed by the changed paths.
+_RECORD = "\x1e"
+_FIELD = "\x1f"
+_LOG_FORMAT = "%x1e%H%x1f%P%x1f%an%x1f%aI%x1f%B%x1f"
+_HEADER_FIELDS = 5
+
+# Questions about how the code came to be, which also search the history.
+_HISTORY_QUESTION_RE = re.compile(
+    r"\b(?:why|history|historical|commits?|committed|introduced|decisions?|decided|reverted?|"
+    r"authors?|authored|who|renamed|regressions?|changelog|when (?:was|were|did|has|have))\b",
+    re.IGNORECASE)
+
+
+class CommitRecord(NamedTuple):
+    """
+    A commit read from the log.
+    """
+    sha: str
+    parents: List[str]
+    author: str
+    # ISO 8601 author date.
+    date: str
+    message: str
+    # The status letter and path of the first changed files, renames as "old -> new".
+    changes: List[Tuple[str, str]]
+    changed_count: int
+    # The start of the patch, empty unless diffs were requested.
+    diff: str
+
+
+def history_path(store_path: str) -> str:
+    """
+    Returns the directory of the history store of a repository's vector store.
+    """
+    return os.path.join(store_path, HISTORY_DIRNAME)
+
+
+def _git(repo_path: str, *args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(["git", *args], cwd=repo_path, capture_output=True, text=True)
+
+
+def iter_commits(repo_path: str, since: Optional[str] = None, rev: str = "HEAD", diffs: bool = False,
+                 max_paths: int = config.HISTORY_MAX_PATHS,
+                 diff_max_chars: int = config.HISTORY_DIFF_MAX_CHARS) -> Iterator[CommitRecord]:
+    """
+    Streams the commits of a repository from a single `git log` process, newest first.
+
+    The log is parsed line by line and only the current commit is held, with at
+    most max_paths changed paths and diff_max_chars characters of its patch, so
+    memory does not depend on the size of the history or of any commit. The
+    changed paths come from the raw diff of the trees, which reads no file
+    content and works in partial clones; diffs read the blobs.
+
+    Args:
+        repo_path (str): A clone, bare or not.
+        since (Optional[str]): Only the commits that are not ancestors of this one, all if None.
+        rev (str): The newest commit.
+        diffs (bool): Also read the start of each commit's patch.
+        max_paths (int): The maximum number of changed paths kept per commit.
+        diff_max_chars (int): The maximum number of patch characters kept per commit.
+
+    Yields:
+        CommitRecord: The commits.
+    """
+    args = ["git", "-c", "core.quotePath=false", "log", f"--format={_LOG_FORMAT}", "--raw",
+            "--no-color", "--no-ext-diff"]
+    if diffs:
+        args.append("-p")
+    args.append(f"{since}..{rev}" if since else rev)
+    process = subprocess.Popen(args, cwd=repo_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               encoding="utf-8", errors="replace")
+
+    header = None
+
+    def record() -> CommitRecord:
+        sha, parents, author, date, message, _ = "".join(header).split(_FIELD, _HEADER_FIELDS)
+        return CommitRecord(sha.strip(), parents.split(), author, date, message.strip(),
+                            changes, changed_count, "".join(diff)[:diff_max_chars])
+
+    try:
+        for line in process.stdout:
+            if line.startswith(_RECORD):
+                if header is not None:
+                    yield record()
+                header, separators = [line[1:]], line.count(_FIELD)
+                changes, changed_count, diff, diff_chars, in_patch = [], 0, [], 0, False
+                continue
+            if header is None:
+                continue
+            if separators < _HEADER_FIELDS:
+                header.append(line)
+                separators += line.count(_FIELD)
+            elif not in_patch and line.startswith(":"):
+                # ":100644 100644 <blob> <blob> M\tpath", with two paths for renames and copies.
+                changed_count += 1
+                if len(changes) < max_paths:
+                    fields = line.rstrip("\n").split("\t")
+                    changes.append((fields[0].split()[-1][:1], " -> ".join(fields[1:])))
+            elif in_patch or line.strip():
+                in_patch = True
+                if diff_chars < diff_max_chars:
+                    diff.append(line)
+                    diff_chars += len(line)
+        if header is not None:
+            yield record()
+        error = process.stderr.read()
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, args, stderr=error)
+    finally:
+        process.stdout.close()
+        process.stderr.close()
+        if process.poll() is None:
+            # The caller stopped early.
+            process.kill()
+            process.wait()
+
+
+def commit_document(commit: CommitRecord) -> Document:
+    """
+    Turns a commit into the text that is embedded: its header, message, changed paths and diff.
+    """
+    kind = "Merge commit" if len(commit.parents) > 1 else "Commit"
+    lines = [f"{kind} {commit.sha[:12]} by {commit.author} on {commit.date[:10]}", "", commit.message]
+    if commit.changed_count:
+        lines += ["", f"Changed files ({commit.changed_count}):"]
+        lines += [f"{status} {path}" for status, path in commit.changes]
+        if commit.changed_count > len(commit.changes):
+            lines.append(f"... and {commit.changed_count - len(commit.changes)} more")
+    if commit.diff:
+        lines += ["", "Diff excerpt:", commit.diff.rstrip()]
+    metadata = {
+        "source": f"commit {commit.sha[:12]}",
+        "commit": commit.sha,
+        "author": commit.author,
+        "date": commit.date,
+    }
+    return Document(page_content="\n".join(lines), metadata=metadata)
+
+
+def load_cursor(path: str) -> Optional[dict]:
+    """
+    Loads the cursor of a history store: the last indexed commit and how the store was built.
+
+    Args:
+        path (str): The directory of the history store.
+
+    Returns:
+        Optional[dict]: The cursor, or None if it is missing or unreadable.
+    """
+    cursor_path = os.path.join(path, CURSOR_FILENAME)
+    if not os.path.exists(cursor_path):
+        return None
+    try:
+        with open(cursor_path, "r", encoding="utf-8") as f:
+            cursor = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read the history cursor at {cursor_path}: {e}")
+        return None
+    return cursor if cursor.get("version") == CURSOR_VERSION else None
+
+
+def save_cursor(path: str, cursor: dict) -> None:
+    """
+    Atomically writes the cursor of a history store, after the store itself.
+    """
+    os.makedirs(path, exist_ok=True)
+    cursor_path = os.path.join(path, CURSOR_FILENAME)
+    tmp_path = cursor_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cursor, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, cursor_path)
+
+
+def _load_history_store(path: str, cursor: Optional[dict], include_diffs: bool, index_type: str):
+    # Returns the existing history store and its index metadata, or Nones when it must be rebuilt.
+    from langchain_community.vectorstores import FAISS
+    from .embedding_generator import get_embedding_model
+    from .index_factory import load_index_meta
+
+    if cursor is None or not os.path.exists(os.path.join(path, "index.faiss")):
+        return None, None
+    if (cursor["embedding_model"] != config.EMBEDDING_MODEL_NAME or cursor["diffs"] != include_diffs
+            or cursor["index_type"] != index_type):
+        logger.warning("History settings changed since the last ingestion, rebuilding the history.")
+        return None, None
+    vector_store = FAISS.load_local(path, embeddings=get_embedding_model(),
+                                    allow_dangerous_deserialization=True)
+    if vector_store.index.ntotal != cursor["index_size"]:
+        logger.warning("History store does not match its cursor (interrupted save?), rebuilding the history.")
+        return None, None
+    return vector_store, load_index_meta(path)
+
+
+def _save_history_store(vector_store, path: str, index_meta: dict, cursor: dict, complete: bool) -> None:
+    from .index_factory import save_index_meta
+    from .mmap_store import export_mmap_store
+
+    with tracer.span("save_history", complete=complete, commits=vector_store.index.ntotal):
+        vector_store.save_local(path)
+        save_index_meta(path, index_meta)
+        if complete and config.MMAP_STORE_ENABLED:
+            export_mmap_store(vector_store, path, index_meta, config.MMAP_VECTOR_DTYPE)
+        cursor["index_size"] = vector_store.index.ntotal
+        cursor["complete"] = complete
+        save_cursor(path, cursor)
+
+
+def run_history_ingestion(repo_path: str, store_save_path: str, index_type: str = config.INDEX_TYPE,
+                          include_diffs: bool = config.HISTORY_DIFFS,
+                          progress: Optional[Callable[[dict], None]] = None) -> Optional[dict]:
+    """
+    Indexes the commits of a repository that are not indexed yet into its history store.
+
+    The cursor records the last commit whose history is fully indexed, so a run
+    only reads `git log <cursor>..HEAD`. Commits are embedded in batches of
+    EMBED_BATCH_SIZE as the log is read, and the store is checkpointed like the
+    main one; an interrupted run reads the same range again and skips the
+    commits that are already in the store. If the cursor is no longer an
+    ancestor of HEAD (rewritten history), the whole reachable history is read
+    and only the missing commits are embedded. Shallow clones are refused: the
+    commits between the cursor and HEAD could be missing from them.
+
+    Args:
+        repo_path (str): A clone with history, bare or not.
+        store_save_path (str): The repository's vector store; the history goes to its "history" directory.
+        index_type (str): The index type of a new history store.
+        include_diffs (bool): Add the start of each commit's diff to its text.
+        progress (Optional[Callable[[dict], None]]): Receives progress updates.
+
+    Returns:
+        Optional[dict]: The number of commits indexed and in the store, or None if
+        the repository has no readable history.
+    """
+    # The writer is shared with the main ingestion, which imports this module.
+    from .create_vectorstore import StoreWriter
+    from .manifest import load_manifest, save_manifest
+
+    head = _git(repo_path, "rev-parse", "--verify", "HEAD^{commit}")
+    if head.returncode != 0:
+        logger.warning(f"No git history to index at {repo_path}: {head.stderr.strip()}")
+        return None
+    head = head.stdout.strip()
+    if _git(repo_path, "rev-parse", "--is-shallow-repository").stdout.strip() == "true":
+        # The commits between a cursor and HEAD may be missing, and moving the cursor past
+        # them would lose them for good: the history is only indexed from complete clones.
+        logger.error(
+            "The clone is shallow, its history is not indexed. Clone with --depth 0 "
+            "(and --filter blob:none to skip old file contents) to index the history.")
+        return None
+
+    path = history_path(store_save_path)
+    cursor = load_cursor(path)
+    vector_store, index_meta = _load_history_store(path, cursor, include_diffs, index_type)
+    since = cursor["commit"] if vector_store is not None else None
+    if since == head:
+        logger.info("The history is up to date.")
+        return {"commits": 0, "total_commits": vector_store.index.ntotal}
+    if since and _git(repo_path, "merge-base", "--is-ancestor", since, head).returncode != 0:
+        logger.warning(
+            f"The last indexed commit {since[:12]} is not an ancestor of HEAD, reading the whole history.")
+        since = None
+    logger.info(f"Indexing the history {'since ' + since[:12] if since else 'from the first commit'} "
+                f"up to {head[:12]}...")
+
+    indexed_ids = set(vector_store.index_to_docstore_id.values()) if vector_store is not None else set()
+    cursor = {"version": CURSOR_VERSION, "embedding_model": config.EMBEDDING_MODEL_NAME,
+              "index_type": index_type, "diffs": include_diffs,
+              "commit": since if vector_store is not None else None}
+    writer = StoreWriter(vector_store, index_meta, index_type)
+    documents, chunk_ids = [], []
+    commits = batches = 0
+    with tracer.span("history", since=since, head=head):
+        for commit in iter_commits(repo_path, since, head, include_diffs):
+            chunk_id = f"commit:{commit.sha}"
+            if chunk_id in indexed_ids:
+                continue
+            documents.append(commit_document(commit))
+            chunk_ids.append(chunk_id)
+            if len(documents) < config.EMBED_BATCH_SIZE:
+                continue
+            writer.add(documents, chunk_ids)
+            commits += len(documents)
+            documents, chunk_ids = [], []
+            batches += 1
+            if progress:
+                progress({"stage": "history", "commits": commits})
+            if writer.vector_store is not None and batches % config.CHECKPOINT_EVERY_BATCHES == 0:
+                # The cursor is left where it was: a resumed run skips what is already stored.
+                _save_history_store(writer.vector_store, path, writer.index_meta, cursor, complete=False)
+                logger.info(f"History checkpoint saved after {commits} commits.")
+        if documents:
+            writer.add(documents, chunk_ids)
+            commits += len(documents)
+        writer.flush()
+    if writer.vector_store is None:
+        logger.info("No commits to index.")
+        return {"commits": 0, "total_commits": 0}
+
+    cursor["commit"] = head
+    _save_history_store(writer.vector_store, path, writer.index_meta, cursor, complete=True)
+    tracer.count("history_commits", commits)
+    logger.info(f"Indexed {commits} commits, the history store at {path} holds "
+                f"{writer.vector_store.index.ntotal}.")
+    manifest = load_manifest(store_save_path)
+    if commits and manifest is not None and manifest.get("complete"):
+        # Running apps reload the knowledge base, and cached answers are dropped, when the generation changes.
+        manifest["generation"] = manifest.get("generation", 0) + 1
+        save_manifest(store_save_path, manifest)
+    return {"commits": commits, "total_commits": writer.vector_store.index.ntotal}
+
+
+def is_history_question(question: str) -> bool:
+    """
+    Tells whether a question asks about the history of the code ("why was X added?").
+    """
+    return bool(_HISTORY_QUESTION_RE.search(question))
+
+
+class HistoryRetriever(BaseRetriever):
+    """
+    Adds the commits matching a question to the chunks of another retriever.
+
+    Questions about the history of the code ("why", "when was", "who", "commit"...)
+    also search the history store, and its commits are fused with the code
+    chunks by reciprocal rank. Other questions only use the wrapped retriever.
+    """
+
+    retriever: BaseRetriever
+    history_store: Any
+    k: int = 5
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        chunks = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        if not is_history_question(query):
+            return chunks
+        with tracer.span("history_search"):
+            commits = self.history_store.similarity_search(query, k=self.k)
+        tracer.count("history_searches")
+        return fuse([chunks, commits], self.k)
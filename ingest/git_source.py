@@ -0,0 +1,276 @@
+# This script downloads repositories with as little history as needed and reads files straight from git objects
+import os
+import shutil
+import subprocess
+import threading
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from git import GitCommandError, InvalidGitRepositoryError, NoSuchPathError, Repo
+
+from . import config
+from .file_collector import has_ignored_extension, size_limit, sniff_head
+from .logger import logger
+
+# Tree entries that are not regular files: symlinks and submodules.
+_SKIPPED_MODES = ("120000", "160000")
+
+
+def _clone_url(url: str) -> str:
+    # Git ignores --depth and --filter for plain local paths, a file:// URL makes them apply.
+    if os.path.isdir(url):
+        return "file://" + os.path.abspath(url).replace(os.sep, "/")
+    return url
+
+
+def _open_existing(clone_path: str, url: str, bare: bool) -> Optional[Repo]:
+    # Returns the existing clone if it can be updated in place, None if it must be cloned again.
+    try:
+        repo = Repo(clone_path)
+    except (InvalidGitRepositoryError, NoSuchPathError):
+        return None
+    try:
+        origin_url = repo.remotes.origin.url
+    except (AttributeError, ValueError):
+        return None
+    if origin_url.rstrip("/") != _clone_url(url).rstrip("/") or repo.bare != bare:
+        return None
+    return repo
+
+
+def is_shallow(repo: Repo) -> bool:
+    """
+    Tells whether a clone only holds the last commits of its history.
+    """
+    return os.path.exists(os.path.join(repo.git_dir, "shallow"))
+
+
+def clone_or_update(url: str, clone_path: str, depth: int = config.GIT_CLONE_DEPTH,
+                    blob_filter: str = config.GIT_CLONE_FILTER, bare: bool = False) -> Repo:
+    """
+    Brings a local copy of a repository to the latest commit of its default branch.
+
+    A new clone only downloads the last depth commits of the default branch
+    (depth 0 downloads the full history) and, with a blob filter such as
+    "blob:none", no file contents of older commits. An existing clone of the same
+    URL is updated in place with a fetch and a hard reset, so only new objects
+    are downloaded and the unchanged files of the working tree are not rewritten.
+    A shallow clone updated with depth 0 is deepened to the full history.
+
+    Args:
+        url (str): The URL (or local path) of the repository.
+        clone_path (str): Where the clone is kept.
+        depth (int): The number of commits fetched, 0 for the full history.
+        blob_filter (str): A partial clone filter (e.g. "blob:none"), empty for none.
+        bare (bool): Clone without a working tree, for GitObjectSource.
+
+    Returns:
+        Repo: The up-to-date clone.
+    """
+    depth_args = [f"--depth={depth}"] if depth > 0 else []
+    repo = _open_existing(clone_path, url, bare) if os.path.exists(clone_path) else None
+    if repo is not None:
+        logger.info(f"Fetching the latest commit into the existing clone at {clone_path}...")
+        fetch_args = depth_args
+        if depth <= 0 and is_shallow(repo):
+            # A plain fetch keeps the clone shallow, only the missing history is downloaded.
+            logger.info("Deepening the shallow clone to the full history...")
+            fetch_args = ["--unshallow"]
+        try:
+            repo.git.fetch("origin", "HEAD", "--prune", "--no-tags", *fetch_args)
+            if bare:
+                # Moves the checked-out branch without touching any working tree.
+                repo.git.update_ref("HEAD", "FETCH_HEAD")
+            else:
+                repo.git.reset("--hard", "FETCH_HEAD")
+                repo.git.clean("-ffdx")
+            return repo
+        except GitCommandError as e:
+            logger.warning(f"Could not update the existing clone, cloning again: {e}")
+
+    if os.path.exists(clone_path):
+        shutil.rmtree(clone_path)
+    os.makedirs(os.path.dirname(os.path.abspath(clone_path)), exist_ok=True)
+    logger.info(f"Cloning repository from {url} into {clone_path}...")
+    clone_args = ["--single-branch", "--no-tags", *depth_args]
+    if blob_filter:
+        clone_args.append(f"--filter={blob_filter}")
+    if bare:
+        clone_args.append("--bare")
+    return Repo.clone_from(_clone_url(url), clone_path, multi_options=clone_args)
+
+
+def is_ignored(rel_path: str) -> bool:
+    """
+    Applies the IGNORE_DIRS and IGNORE_EXTS rules of collect_target_files to a repository relative path.
+    """
+    parts = rel_path.split("/")
+    if any(part in config.IGNORE_DIRS for part in parts[:-1]):
+        return True
+    return has_ignored_extension(parts[-1])
+
+
+class GitBlob:
+    """
+    A blob too large to be read whole, streamed from its own `git cat-file` process when it is loaded.
+    """
+
+    def __init__(self, git_dir: str, blob_id: str, size: int):
+        """
+        Args:
+            git_dir (str): The git directory of the clone.
+            blob_id (str): The object id of the blob.
+            size (int): Its size in bytes.
+        """
+        self.git_dir = git_dir
+        self.blob_id = blob_id
+        self.size = size
+
+    @contextmanager
+    def open(self) -> Iterator[BinaryIO]:
+        """
+        Opens the content of the blob as a binary stream, read as it is consumed.
+        """
+        process = subprocess.Popen(
+            ["git", "cat-file", "blob", self.blob_id], cwd=self.git_dir, stdout=subprocess.PIPE)
+        try:
+            yield process.stdout
+        finally:
+            process.stdout.close()
+            process.kill()
+            process.wait()
+
+    def read(self) -> bytes:
+        """
+        Reads the whole content of the blob, for the formats that cannot be streamed.
+        """
+        with self.open() as stream:
+            return stream.read()
+
+
+class GitObjectSource:
+    """
+    Reads the files of a commit from the git object database, without a checkout.
+
+    Files are listed with one `git ls-tree` call, and their contents are read
+    through a single `git cat-file --batch` process: object ids are written to
+    it by a background thread while the contents are read back, so the whole
+    repository is read in one streaming pass without creating any file. Blobs
+    above STREAM_THRESHOLD_BYTES are not read there but handed out as GitBlob,
+    so the loader streams them window by window like large files on disk.
+    Binary blobs are detected from their first bytes, like files on disk by
+    scan_target_files, and handed out empty.
+    """
+
+    def __init__(self, repo_path: str, rev: str = "HEAD"):
+        """
+        Args:
+            repo_path (str): A clone, bare or not.
+            rev (str): The commit to read.
+        """
+        self.repo_path = repo_path
+        self.repo = Repo(repo_path)
+        self.commit = self.repo.commit(rev).hexsha
+        # The size of every blob listed by list_files, which tells iter_blobs which ones to stream.
+        self.sizes = {}
+
+    def list_files(self) -> Dict[str, str]:
+        """
+        Lists the files of the commit that would be collected from a checkout.
+
+        Files larger than the size limit of their type are left out, so their
+        content is never read.
+
+        Returns:
+            Dict[str, str]: The blob id of each repository relative path.
+        """
+        output = self.repo.git.ls_tree("-r", "-z", "--long", self.commit)
+        files = {}
+        for entry in output.split("\0"):
+            if not entry:
+                continue
+            info, rel_path = entry.split("\t", 1)
+            mode, object_type, blob_id, size = info.split()
+            if object_type != "blob" or mode in _SKIPPED_MODES or is_ignored(rel_path):
+                continue
+            if int(size) > size_limit(rel_path.rsplit("/", 1)[-1]):
+                logger.warning(
+                    f"Skipping large file: {rel_path} ({int(size) / (1024 * 1024):.2f} MB)")
+                continue
+            files[rel_path] = blob_id
+            self.sizes[blob_id] = int(size)
+        return files
+
+    def iter_blobs(self, blob_ids: Iterable[Tuple[str, str]]) -> Iterator[Tuple[str, Union[bytes, GitBlob]]]:
+        """
+        Reads the contents of blobs in one streaming pass.
+
+        Blobs listed by list_files above STREAM_THRESHOLD_BYTES are yielded as
+        GitBlob instead of bytes, and only read when the loader streams them.
+        Binary blobs are yielded as empty bytes, so they produce no chunks but
+        are still recorded in the manifest.
+
+        Args:
+            blob_ids (Iterable[Tuple[str, str]]): (key, blob id) pairs; the key is passed through.
+
+        Yields:
+            Tuple[str, Union[bytes, GitBlob]]: Each key with the content of its blob, in the input order.
+        """
+        items = [(key, blob_id, self.sizes.get(blob_id, 0) > config.STREAM_THRESHOLD_BYTES)
+                 for key, blob_id in blob_ids]
+        if not items:
+            return
+        process = subprocess.Popen(
+            ["git", "cat-file", "--batch"], cwd=self.repo.git_dir,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+        def write_ids():
+            # Written from a thread: git blocks on a full output pipe until it is read below.
+            try:
+                for _, blob_id, large in items:
+                    if large:
+                        continue
+                    process.stdin.write(blob_id.encode("ascii") + b"\n")
+                process.stdin.close()
+            except (BrokenPipeError, ValueError):
+                pass
+
+        writer = threading.Thread(target=write_ids, daemon=True)
+        writer.start()
+        binaries = 0
+        try:
+            for key, blob_id, large in items:
+                name = os.path.basename(key)
+                if large:
+                    blob = GitBlob(self.repo.git_dir, blob_id, self.sizes[blob_id])
+                    # Only the head of the blob is read here, the rest when the loader streams it.
+                    with blob.open() as stream:
+                        head = stream.read(config.SNIFF_BYTES)
+                    if sniff_head(head, name, complete=False) is None:
+                        binaries += 1
+                        yield key, b""
+                    else:
+                        yield key, blob
+                    continue
+                header = process.stdout.readline().split()
+                if len(header) < 3:
+                    # "<id> missing": the object is not in this clone.
+                    logger.warning(f"Could not read {key} from git ({blob_id} missing), skipping.")
+                    yield key, b""
+                    continue
+                size = int(header[2])
+                data = process.stdout.read(size)
+                process.stdout.read(1)  # The newline after every object.
+                if sniff_head(data[:config.SNIFF_BYTES], name, complete=size <= config.SNIFF_BYTES) is None:
+                    binaries += 1
+                    yield key, b""
+                    continue
+                yield key, data
+        finally:
+            process.stdout.close()
+            process.kill()
+            process.wait()
+            writer.join()
+        if binaries:
+            logger.info(f"Skipped {binaries} binary files.")
+
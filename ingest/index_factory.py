@@ -0,0 +1,150 @@
+# This script builds the FAISS index types supported by the vector stores and records their settings
+import json
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+import faiss
+
+from . import config
+from .logger import logger
+
+INDEX_META_FILENAME = "index_meta.json"
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+# FAISS needs about this many training points per centroid to train k-means reliably.
+_MIN_POINTS_PER_CENTROID = 39
+
+
+def needs_training(index_type: str) -> bool:
+    """
+    Tells whether an index type has to be trained on sample vectors before use.
+    """
+    return index_type in ("ivf_flat", "ivf_pq")
+
+
+def index_params(index_type: str) -> dict:
+    """
+    Returns the build parameters of an index type, taken from the config file.
+    """
+    if index_type == "hnsw":
+        return {"m": config.HNSW_M, "ef_construction": config.HNSW_EF_CONSTRUCTION}
+    if index_type == "ivf_flat":
+        return {"nlist": config.IVF_NLIST}
+    if index_type == "ivf_pq":
+        return {"nlist": config.IVF_NLIST, "pq_m": config.PQ_M, "pq_nbits": config.PQ_NBITS}
+    return {}
+
+
+def build_index(index_type: str, params: dict, sample: np.ndarray) -> Tuple[faiss.Index, dict]:
+    """
+    Creates (and trains, if needed) an empty FAISS index of the requested type.
+
+    The number of IVF lists is reduced when the training sample is too small for
+    it, and the store falls back to a flat index when the sample cannot train
+    the requested type at all (e.g. a tiny repository).
+
+    Args:
+        index_type (str): One of INDEX_TYPES.
+        params (dict): The build parameters, see index_params.
+        sample (np.ndarray): The float32 vectors available for training.
+
+    Returns:
+        Tuple[faiss.Index, dict]: The index and its metadata.
+    """
+    dimension = sample.shape[1]
+    params = dict(params)
+    built_type = index_type
+
+    if needs_training(index_type):
+        max_nlist = len(sample) // _MIN_POINTS_PER_CENTROID
+        if index_type == "ivf_pq" and len(sample) < (1 << params["pq_nbits"]) * _MIN_POINTS_PER_CENTROID:
+            max_nlist = 0
+        if max_nlist < 1:
+            logger.warning(
+                f"Only {len(sample)} vectors available to train a {index_type} index, "
+                "falling back to a flat index.")
+            built_type, params = "flat", {}
+        elif params["nlist"] > max_nlist:
+            logger.info(
+                f"Reducing nlist from {params['nlist']} to {max_nlist} for {len(sample)} training vectors.")
+            params["nlist"] = max_nlist
+
+    if built_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, params["m"])
+        index.hnsw.efConstruction = params["ef_construction"]
+    elif built_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(
+            faiss.IndexFlatL2(dimension), dimension, params["nlist"])
+    elif built_type == "ivf_pq":
+        if dimension % params["pq_m"]:
+            raise ValueError(
+                f"PQ_M={params['pq_m']} must divide the embedding dimension {dimension}.")
+        index = faiss.IndexIVFPQ(
+            faiss.IndexFlatL2(dimension), dimension, params["nlist"],
+            params["pq_m"], params["pq_nbits"])
+    else:
+        index = faiss.IndexFlatL2(dimension)
+
+    if not index.is_trained:
+        logger.info(f"Training {built_type} index on {len(sample)} vectors...")
+        index.train(sample)
+
+    meta = {
+        "index_type": built_type,
+        "requested_type": index_type,
+        "params": params,
+        "dimension": dimension,
+        "metric": "l2",
+    }
+    return index, meta
+
+
+def rebuild_index(meta: dict, vectors: np.ndarray):
+    """
+    Creates an empty index with the same settings as an existing one, used to
+    compact indexes that cannot remove vectors in place (HNSW).
+    """
+    if needs_training(meta["index_type"]):
+        raise ValueError("IVF indexes are compacted from their trained quantizer, not rebuilt.")
+    index, _ = build_index(meta["index_type"], meta["params"], vectors)
+    return index
+
+
+def save_index_meta(store_path: str, meta: dict) -> None:
+    """
+    Writes the index metadata next to the vector store.
+    """
+    with open(os.path.join(store_path, INDEX_META_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=1, sort_keys=True)
+
+
+def load_index_meta(store_path: str) -> dict:
+    """
+    Reads the index metadata of a vector store.
+
+    Stores built before index types were configurable have no metadata file,
+    they always hold a flat index.
+    """
+    meta_path = os.path.join(store_path, INDEX_META_FILENAME)
+    if not os.path.exists(meta_path):
+        return {"index_type": "flat", "requested_type": "flat", "params": {}, "metric": "l2"}
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def apply_search_params(index, meta: dict, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> None:
+    """
+    Sets the query-time accuracy/speed trade-off of an index.
+
+    Args:
+        index: The loaded FAISS index.
+        meta (dict): The index metadata.
+        nprobe (Optional[int]): IVF lists visited per query, defaults to config.IVF_NPROBE.
+        ef_search (Optional[int]): HNSW candidate list size, defaults to config.HNSW_EF_SEARCH.
+    """
+    index_type = meta["index_type"]
+    if index_type in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).nprobe = nprobe or config.IVF_NPROBE
+    elif index_type == "hnsw":
+        index.hnsw.efSearch = ef_search or config.HNSW_EF_SEARCH
@@ -0,0 +1,147 @@
+# This script compares the recall and latency of an approximate index against the exact flat baseline
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import faiss
+from langchain_community.vectorstores import FAISS
+
+from .embedding_generator import get_embedding_model
+from .index_factory import load_index_meta, apply_search_params
+from .logger import logger
+
+# Query-time settings swept by the report for each index type.
+NPROBE_SWEEP = [1, 2, 4, 8, 16, 32, 64, 128]
+EF_SEARCH_SWEEP = [16, 32, 64, 128, 256, 512]
+
+
+def _time_searches(index, queries: np.ndarray, k: int):
+    """
+    Runs the queries one at a time, as the chatbot does, and returns the hits
+    and distances with the per-query latencies in milliseconds.
+    """
+    hits = np.empty((len(queries), k), dtype=np.int64)
+    distances = np.empty((len(queries), k), dtype=np.float32)
+    latencies = []
+    for i, query in enumerate(queries):
+        start_time = time.perf_counter()
+        scores, indices = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+        hits[i] = indices[0]
+        distances[i] = scores[0]
+    return hits, distances, np.array(latencies)
+
+
+def _recall(hits: np.ndarray, queries: np.ndarray, vectors: np.ndarray, truth_distances: np.ndarray) -> float:
+    """
+    Fraction of returned hits that are as close as the k-th exact neighbour.
+
+    Comparing exact distances instead of ids counts duplicated chunks (vendored
+    or copied files) as correct whichever copy the index returns.
+    """
+    kth_distance = truth_distances[:, -1:] * (1 + 1e-4) + 1e-6
+    valid = hits >= 0
+    exact = np.sum((vectors[np.where(valid, hits, 0)] - queries[:, None, :]) ** 2, axis=2)
+    return float(np.mean(valid & (exact <= kth_distance)))
+
+
+def build_report(store_path: str, num_queries: int, k: int, seed: int = 0) -> dict:
+    """
+    Measures recall@k and query latency of a vector store's index for a sweep of
+    nprobe / efSearch values, against an exact flat index over the same chunks.
+
+    The exact vectors are obtained by re-embedding the stored chunks, which is
+    cheap when the embedding cache is enabled. Queries are stored chunk vectors
+    with a little noise added, so they are close to, but not exactly on, a chunk.
+
+    Args:
+        store_path (str): The directory of the saved vector store.
+        num_queries (int): Number of sampled queries.
+        k (int): Number of neighbours compared.
+        seed (int): Seed of the query sampling.
+
+    Returns:
+        dict: The index metadata, the flat baseline and one row per setting.
+    """
+    meta = load_index_meta(store_path)
+    vector_store = FAISS.load_local(
+        store_path, embeddings=get_embedding_model(), allow_dangerous_deserialization=True)
+    index = vector_store.index
+
+    # Rebuild the exact vectors in index order to compute the ground truth.
+    chunk_ids = [vector_store.index_to_docstore_id[i] for i in range(index.ntotal)]
+    texts = [vector_store.docstore.search(chunk_id).page_content for chunk_id in chunk_ids]
+    logger.info(f"Embedding {len(texts)} chunks for the exact baseline...")
+    vectors = np.array(get_embedding_model().embed_documents(texts), dtype=np.float32)
+    flat_index = faiss.IndexFlatL2(vectors.shape[1])
+    flat_index.add(vectors)
+
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+    noise = rng.normal(scale=vectors.std() * 0.1, size=(len(sample), vectors.shape[1]))
+    queries = (vectors[sample] + noise).astype(np.float32)
+
+    _, truth_distances, flat_latencies = _time_searches(flat_index, queries, k)
+    report = {
+        "index": meta,
+        "chunks": int(index.ntotal),
+        "queries": len(queries),
+        "k": k,
+        "flat": {"p50_ms": float(np.percentile(flat_latencies, 50)),
+                 "p95_ms": float(np.percentile(flat_latencies, 95))},
+        "settings": [],
+    }
+
+    if meta["index_type"] in ("ivf_flat", "ivf_pq"):
+        sweep = [("nprobe", value) for value in NPROBE_SWEEP if value <= meta["params"]["nlist"]]
+    elif meta["index_type"] == "hnsw":
+        sweep = [("ef_search", value) for value in EF_SEARCH_SWEEP]
+    else:
+        sweep = [(None, None)]
+
+    for name, value in sweep:
+        if name is not None:
+            apply_search_params(index, meta, **{name: value})
+        hits, _, latencies = _time_searches(index, queries, k)
+        report["settings"].append({
+            "param": name,
+            "value": value,
+            f"recall@{k}": _recall(hits, queries, vectors, truth_distances),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+        })
+    return report
+
+
+def main():
+    """
+    Prints the recall@k vs. latency report of a repository's vector store.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repo", type=str, required=True,
+                        help="Name of a folder inside data/vector_stores")
+    parser.add_argument("--queries", type=int, default=200, help="Number of sampled queries")
+    parser.add_argument("--k", type=int, default=5, help="Number of neighbours compared")
+    parser.add_argument("--json", type=str, help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    store_path = os.path.join("data/vector_stores", args.repo)
+    report = build_report(store_path, args.queries, args.k)
+
+    print(f"\nIndex: {report['index']['index_type']} {report['index']['params']} "
+          f"({report['chunks']} chunks, {report['queries']} queries)")
+    print(f"Flat baseline: p50 {report['flat']['p50_ms']:.3f} ms, p95 {report['flat']['p95_ms']:.3f} ms")
+    print(f"{'setting':<18}{'recall@' + str(args.k):>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for row in report["settings"]:
+        setting = f"{row['param']}={row['value']}" if row["param"] else "default"
+        print(f"{setting:<18}{row[f'recall@{args.k}']:>10.3f}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,476 @@
+# This script queues ingestion jobs in SQLite and runs them in the background with a concurrency limit
+import argparse
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from . import config
+from .logger import logger
+
+# Job states. Queued and running jobs are "active": a second job for the same URL is not created.
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+# Only this much of the end of a job log is read back for display.
+_LOG_TAIL_BYTES = 64 * 1024
+
+
+def normalize_url(url: str) -> str:
+    """
+    Returns the key used to recognize two submissions of the same repository.
+    """
+    url = url.strip().rstrip("/")
+    if url.endswith(".git"):
+        url = url[:-len(".git")]
+    return url.lower()
+
+
+def repo_name_from_url(url: str) -> str:
+    """
+    Returns the name of the clone and vector store folders of a repository URL.
+    """
+    return url.strip().rstrip("/").split("/")[-1].replace(".git", "")
+
+
+def _row_to_job(row: sqlite3.Row) -> dict:
+    job = dict(row)
+    job["progress"] = json.loads(job["progress"]) if job["progress"] else {}
+    job["incremental"] = bool(job["incremental"])
+    job["cancel_requested"] = bool(job["cancel_requested"])
+    return job
+
+
+class JobQueue:
+    """
+    A persistent queue of ingestion jobs, stored in a SQLite file.
+
+    The queue is shared by every process that opens the same file: the web app
+    submitting and displaying jobs, the scheduler running them, and the
+    ingestion processes reporting their progress. Each call opens its own short
+    transaction, so any thread or process can use it.
+    """
+
+    def __init__(self, db_path: str = config.JOB_DB_PATH):
+        """
+        Args:
+            db_path (str): The SQLite file holding the jobs.
+        """
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, url_key TEXT NOT NULL, "
+                "repo_name TEXT NOT NULL, incremental INTEGER NOT NULL, status TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, started_at REAL, finished_at REAL, "
+                "next_attempt_at REAL NOT NULL, heartbeat_at REAL, pid INTEGER, "
+                "cancel_requested INTEGER NOT NULL DEFAULT 0, progress TEXT, error TEXT, log_path TEXT)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, next_attempt_at)")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _transaction(self, work: Callable[[sqlite3.Connection], object]):
+        # BEGIN IMMEDIATE takes the write lock up front, so check-then-write steps are atomic across processes.
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+        finally:
+            conn.close()
+
+    def submit(self, url: str, incremental: bool = False,
+               max_attempts: int = config.JOB_MAX_ATTEMPTS) -> Tuple[int, bool]:
+        """
+        Queues an ingestion of a repository, unless one is already queued or running.
+
+        Args:
+            url (str): The GitHub URL of the repository.
+            incremental (bool): Only re-index the files that changed since the last ingestion.
+            max_attempts (int): How many times the job is run before it is marked as failed.
+
+        Returns:
+            Tuple[int, bool]: The id of the job, and whether it was created (False
+            when an active job for the same URL already existed).
+        """
+        url_key = normalize_url(url)
+
+        def work(conn):
+            placeholders = ",".join("?" * len(ACTIVE_STATES))
+            row = conn.execute(
+                f"SELECT id FROM jobs WHERE url_key = ? AND status IN ({placeholders}) ORDER BY id LIMIT 1",
+                (url_key, *ACTIVE_STATES)).fetchone()
+            if row is not None:
+                return row["id"], False
+            now = time.time()
+            cursor = conn.execute(
+                "INSERT INTO jobs (url, url_key, repo_name, incremental, status, max_attempts, "
+                "created_at, next_attempt_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url.strip(), url_key, repo_name_from_url(url), int(incremental), QUEUED,
+                 max_attempts, now, now))
+            return cursor.lastrowid, True
+
+        job_id, created = self._transaction(work)
+        if created:
+            logger.info(f"Queued ingestion job {job_id} for {url}.")
+        return job_id, created
+
+    def get(self, job_id: int) -> Optional[dict]:
+        """
+        Returns a job as a dict, or None if it does not exist.
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return _row_to_job(row) if row is not None else None
+
+    def list_jobs(self, limit: int = 20) -> List[dict]:
+        """
+        Returns the most recent jobs, newest first.
+        """
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        finally:
+            conn.close()
+        return [_row_to_job(row) for row in rows]
+
+    def cancel(self, job_id: int) -> None:
+        """
+        Cancels a job. A queued job is cancelled at once; a running one is stopped
+        by its scheduler, which then marks it as cancelled.
+        """
+        def work(conn):
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                (CANCELLED, time.time(), job_id, QUEUED))
+            conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?",
+                (job_id, RUNNING))
+        self._transaction(work)
+
+    def claim(self, max_running: int) -> Optional[dict]:
+        """
+        Marks the oldest runnable job as running and returns it.
+
+        Nothing is claimed while max_running jobs are running (in any process) or
+        while another job is running for the same repository, since both would
+        write to the same clone and vector store.
+
+        Returns:
+            Optional[dict]: The claimed job, or None if no job can start now.
+        """
+        def work(conn):
+            running = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ?", (RUNNING,)).fetchone()[0]
+            if running >= max_running:
+                return None
+            now = time.time()
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? AND next_attempt_at <= ? AND repo_name NOT IN "
+                "(SELECT repo_name FROM jobs WHERE status = ?) ORDER BY next_attempt_at, id LIMIT 1",
+                (QUEUED, now, RUNNING)).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ?, heartbeat_at = ?, "
+                "pid = NULL, error = NULL WHERE id = ?",
+                (RUNNING, now, now, row["id"]))
+            return row["id"]
+
+        job_id = self._transaction(work)
+        return self.get(job_id) if job_id is not None else None
+
+    def update(self, job_id: int, **fields) -> None:
+        """
+        Sets columns of a job; "progress" is given as a dict.
+        """
+        if "progress" in fields:
+            fields["progress"] = json.dumps(fields["progress"])
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        conn = self._connect()
+        try:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        finally:
+            conn.close()
+
+    def heartbeat(self, job_ids: List[int]) -> Dict[int, bool]:
+        """
+        Records that the given running jobs are still supervised.
+
+        Returns:
+            Dict[int, bool]: Whether cancellation was requested, for each job.
+        """
+        if not job_ids:
+            return {}
+        placeholders = ",".join("?" * len(job_ids))
+
+        def work(conn):
+            conn.execute(f"UPDATE jobs SET heartbeat_at = ? WHERE id IN ({placeholders})",
+                         (time.time(), *job_ids))
+            rows = conn.execute(f"SELECT id, cancel_requested FROM jobs WHERE id IN ({placeholders})",
+                                job_ids).fetchall()
+            return {row["id"]: bool(row["cancel_requested"]) for row in rows}
+        return self._transaction(work)
+
+    def recover_stale(self, stale_seconds: float) -> List[dict]:
+        """
+        Puts back in the queue the running jobs whose scheduler stopped sending
+        heartbeats (e.g. the web app was restarted).
+
+        Returns:
+            List[dict]: The recovered jobs, as they were before recovery.
+        """
+        def work(conn):
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status = ? AND heartbeat_at < ?",
+                (RUNNING, time.time() - stale_seconds)).fetchall()
+            for row in rows:
+                if row["cancel_requested"]:
+                    conn.execute("UPDATE jobs SET status = ?, finished_at = ? WHERE id = ?",
+                                 (CANCELLED, time.time(), row["id"]))
+                else:
+                    # The attempt did not fail on its own, so it is not counted.
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts - 1, next_attempt_at = ? "
+                        "WHERE id = ?", (QUEUED, time.time(), row["id"]))
+            return [_row_to_job(row) for row in rows]
+        return self._transaction(work)
+
+    def progress_reporter(self, job_id: int, min_interval: float = 1.0) -> Callable[[dict], None]:
+        """
+        Returns a callback storing the progress of a job, at most every min_interval seconds.
+
+        Updates with a new "stage" are always stored, so short stages are not missed.
+        """
+        last = {"time": 0.0, "stage": None}
+
+        def report(progress: dict) -> None:
+            now = time.monotonic()
+            if now - last["time"] < min_interval and progress.get("stage") == last["stage"]:
+                return
+            last["time"], last["stage"] = now, progress.get("stage")
+            try:
+                self.update(job_id, progress=progress)
+            except sqlite3.Error as e:
+                # Progress is informative, it must never fail the ingestion.
+                logger.warning(f"Could not record the progress of job {job_id}: {e}")
+        return report
+
+
+def read_log_tail(log_path: Optional[str], max_bytes: int = _LOG_TAIL_BYTES) -> str:
+    """
+    Returns the end of a job log, without reading the whole file.
+    """
+    if not log_path or not os.path.exists(log_path):
+        return ""
+    with open(log_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(size - max_bytes, 0))
+        data = f.read()
+    text = data.decode("utf-8", errors="replace")
+    if size > max_bytes:
+        # Drop the partial first line.
+        text = text.split("\n", 1)[-1]
+    return text
+
+
+def _last_error_line(log_path: str) -> Optional[str]:
+    lines = [line for line in read_log_tail(log_path, 8 * 1024).splitlines() if line.strip()]
+    if not lines:
+        return None
+    # For a traceback, the exception is its first unindented line (its message may span several).
+    starts = [i for i, line in enumerate(lines) if line.startswith("Traceback")]
+    if starts:
+        for line in lines[starts[-1] + 1:]:
+            if not line[0].isspace():
+                return line[:500]
+    return lines[-1][:500]
+
+
+def _kill(process_or_pid) -> None:
+    # Ingestion processes run in their own process group, so their loader workers are stopped too.
+    pid = process_or_pid if isinstance(process_or_pid, int) else process_or_pid.pid
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(pid, signal.SIGTERM)
+        elif isinstance(process_or_pid, int):
+            os.kill(pid, signal.SIGTERM)
+        else:
+            process_or_pid.terminate()
+    except (ProcessLookupError, PermissionError, OSError):
+        pass
+
+
+class JobScheduler:
+    """
+    Runs the queued ingestion jobs in subprocesses, in a background thread.
+
+    At most max_running jobs run at once across every scheduler sharing the
+    queue. Failed jobs are retried with exponential backoff until they reach
+    their maximum number of attempts; a retried ingestion resumes from its last
+    checkpoint. Each job writes its output to its own log file.
+    """
+
+    def __init__(self, queue: JobQueue, max_running: int = config.JOB_MAX_RUNNING,
+                 log_dir: str = config.JOB_LOG_DIR, poll_interval: float = 1.0):
+        """
+        Args:
+            queue (JobQueue): The queue to run jobs from.
+            max_running (int): The maximum number of concurrent ingestions.
+            log_dir (str): The directory receiving one log file per job.
+            poll_interval (float): Seconds between two checks of the queue and of the running jobs.
+        """
+        self.queue = queue
+        self.max_running = max_running
+        self.log_dir = log_dir
+        self.poll_interval = poll_interval
+        self._processes: Dict[int, Tuple[subprocess.Popen, object]] = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> "JobScheduler":
+        """
+        Starts the scheduler thread and returns the scheduler.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="ingestion-jobs", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run(self) -> None:
+        """
+        Runs jobs until stop() is called.
+        """
+        os.makedirs(self.log_dir, exist_ok=True)
+        while not self._stop.is_set():
+            try:
+                self._tick()
+            except Exception as e:
+                logger.error(f"Ingestion scheduler error: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def _tick(self) -> None:
+        for job in self.queue.recover_stale(config.JOB_STALE_SECONDS):
+            if job["pid"]:
+                # Left behind by a scheduler that stopped: nobody can wait for it any more.
+                _kill(job["pid"])
+            logger.warning(f"Ingestion job {job['id']} lost its scheduler, it was queued again.")
+
+        cancel_requested = self.queue.heartbeat(list(self._processes))
+        for job_id, (process, log_file) in list(self._processes.items()):
+            if cancel_requested.get(job_id) and process.poll() is None:
+                logger.info(f"Cancelling ingestion job {job_id}...")
+                _kill(process)
+                process.wait()
+                self._finish(job_id, CANCELLED, "Cancelled by the user.")
+            elif process.poll() is not None:
+                self._on_exit(job_id, process.returncode)
+            else:
+                continue
+            log_file.close()
+            del self._processes[job_id]
+
+        while len(self._processes) < self.max_running:
+            job = self.queue.claim(self.max_running)
+            if job is None:
+                break
+            self._launch(job)
+
+    def _launch(self, job: dict) -> None:
+        log_path = os.path.join(self.log_dir, f"job_{job['id']}.log")
+        command = [sys.executable, "-m", "ingest.create_vectorstore",
+                   "--url", job["url"], "--job-id", str(job["id"])]
+        if job["incremental"]:
+            command.append("--incremental")
+        log_file = open(log_path, "a", encoding="utf-8")
+        log_file.write(f"--- Attempt {job['attempts']} of {job['max_attempts']} ---\n")
+        log_file.flush()
+        try:
+            process = subprocess.Popen(
+                command, stdout=log_file, stderr=subprocess.STDOUT,
+                env={**os.environ, "DEVMENTOR_JOB_DB": self.queue.db_path},
+                start_new_session=hasattr(os, "killpg"))
+        except OSError as e:
+            log_file.close()
+            self._finish(job["id"], FAILED, f"Could not start the ingestion: {e}")
+            return
+        self.queue.update(job["id"], pid=process.pid, log_path=log_path)
+        self._processes[job["id"]] = (process, log_file)
+        logger.info(f"Started ingestion job {job['id']} for {job['url']} (pid {process.pid}).")
+
+    def _on_exit(self, job_id: int, returncode: int) -> None:
+        if returncode == 0:
+            self._finish(job_id, SUCCEEDED, None)
+            return
+        job = self.queue.get(job_id)
+        error = _last_error_line(job["log_path"]) or f"Exit code {returncode}"
+        if job["attempts"] < job["max_attempts"]:
+            delay = config.JOB_RETRY_BACKOFF_SECONDS * 2 ** (job["attempts"] - 1)
+            logger.warning(
+                f"Ingestion job {job_id} failed (attempt {job['attempts']}), retrying in {delay:.0f}s.")
+            self.queue.update(job_id, status=QUEUED, pid=None, error=error,
+                              next_attempt_at=time.time() + delay)
+        else:
+            self._finish(job_id, FAILED, error)
+
+    def _finish(self, job_id: int, status: str, error: Optional[str]) -> None:
+        self.queue.update(job_id, status=status, pid=None, error=error, finished_at=time.time())
+        logger.info(f"Ingestion job {job_id} {status}.")
+
+
+def main():
+    """
+    Runs a standalone ingestion scheduler, or queues a job with --url.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", type=str, help="Queue an ingestion of this GitHub URL and exit")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-index files that changed since the last ingestion")
+    parser.add_argument("--max-running", type=int, default=config.JOB_MAX_RUNNING,
+                        help="Maximum number of concurrent ingestions")
+    args = parser.parse_args()
+
+    queue = JobQueue()
+    if args.url:
+        job_id, created = queue.submit(args.url, args.incremental)
+        print(f"Job {job_id} {'queued' if created else 'is already queued or running'}.")
+        return
+    logger.info(f"Running ingestion jobs, at most {args.max_running} at a time.")
+    JobScheduler(queue, args.max_running).run()
+
+
+if __name__ == "__main__":
+    main()
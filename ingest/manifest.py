@@ -0,0 +1,249 @@
+# This script keeps track of what has already been indexed so re-ingestion only touches changed files
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+from git import Repo, InvalidGitRepositoryError, NoSuchPathError, GitCommandError
+
+from . import config
+from .logger import logger
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def new_manifest() -> dict:
+    """
+    Creates an empty manifest for a vector store that has not been built yet.
+
+    Returns:
+        dict: A manifest with no files and no indexed commit.
+    """
+    return {
+        "version": MANIFEST_VERSION,
+        "embedding_model": config.EMBEDDING_MODEL_NAME,
+        "commit": None,
+        "complete": False,
+        "generation": 0,
+        "files": {},
+    }
+
+
+def load_manifest(store_path: str) -> Optional[dict]:
+    """
+    Loads the manifest saved next to a vector store.
+
+    Args:
+        store_path (str): The directory of the saved vector store.
+
+    Returns:
+        Optional[dict]: The manifest, or None if it is missing or unreadable.
+    """
+    manifest_path = os.path.join(store_path, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read manifest at {manifest_path}: {e}")
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        logger.warning(
+            f"Manifest at {manifest_path} has an unsupported version, ignoring it.")
+        return None
+    return manifest
+
+
+def save_manifest(store_path: str, manifest: dict) -> None:
+    """
+    Atomically writes the manifest next to a vector store.
+
+    Args:
+        store_path (str): The directory of the saved vector store.
+        manifest (dict): The manifest to persist.
+    """
+    os.makedirs(store_path, exist_ok=True)
+    manifest_path = os.path.join(store_path, MANIFEST_FILENAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    # os.replace is atomic, so a crash never leaves a half written manifest behind.
+    os.replace(tmp_path, manifest_path)
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Computes the SHA-256 hash of a file's content, reading it in blocks.
+
+    Args:
+        file_path (str): The file to hash.
+
+    Returns:
+        str: The hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def relative_path(file_path: str, repo_path: str) -> str:
+    """
+    Returns the repository relative path of a file, always using forward slashes.
+    """
+    return os.path.relpath(file_path, repo_path).replace(os.sep, "/")
+
+
+def make_chunk_id(rel_path: str, chunk_index: int) -> str:
+    """
+    Builds a stable id for a chunk, so its vector can be found and deleted later.
+    """
+    return f"{rel_path}::{chunk_index}"
+
+
+def get_head_commit(repo_path: str) -> Optional[str]:
+    """
+    Returns the commit currently checked out in a repository.
+
+    A dirty working tree does not match any commit, so no commit is returned for
+    it and the next incremental run falls back to comparing file hashes.
+
+    Args:
+        repo_path (str): The path of the repository.
+
+    Returns:
+        Optional[str]: The commit sha, or None if the path is not a clean git repository.
+    """
+    try:
+        repo = Repo(repo_path)
+        if repo.is_dirty(untracked_files=True):
+            return None
+        return repo.head.commit.hexsha
+    except (InvalidGitRepositoryError, NoSuchPathError, ValueError):
+        return None
+
+
+def changed_paths_since(repo_path: str, commit: str) -> Optional[Set[str]]:
+    """
+    Lists the files that differ between a commit and the current working tree.
+
+    Untracked files are included as well, because git diff does not report them.
+
+    Args:
+        repo_path (str): The path of the repository.
+        commit (str): The last indexed commit.
+
+    Returns:
+        Optional[Set[str]]: Repository relative paths of changed files, or None if
+        git cannot answer (not a repository, unknown commit, shallow history...).
+    """
+    try:
+        repo = Repo(repo_path)
+        diff_output = repo.git.diff("--name-only", "--no-renames", commit)
+        changed = {line for line in diff_output.splitlines() if line}
+        changed.update(repo.untracked_files)
+        return changed
+    except (InvalidGitRepositoryError, NoSuchPathError, GitCommandError, ValueError):
+        return None
+
+
+def plan_update(manifest: dict, collected_files: List[str], repo_path: str,
+                file_stats: Optional[Dict[str, Tuple[int, int]]] = None) -> Tuple[List[str], List[str], Dict[str, str]]:
+    """
+    Compares the collected files with the manifest to find what has to be re-indexed.
+
+    When the manifest records the last indexed commit, git is asked which files
+    changed so untouched files are not even read. Files whose size and mtime
+    still match the ones recorded in the manifest are not read either. Otherwise
+    every file is hashed and compared with the hash stored in the manifest.
+
+    Args:
+        manifest (dict): The manifest of the existing vector store.
+        collected_files (List[str]): The files collected from the repository.
+        repo_path (str): The path of the repository.
+        file_stats (Optional[Dict[str, Tuple[int, int]]]): The size and mtime (ns) of
+            each collected file, as found by the file walk.
+
+    Returns:
+        Tuple[List[str], List[str], Dict[str, str]]: The files to (re-)index, the
+        relative paths of indexed files that changed or disappeared and whose
+        chunks must be deleted, and the new content hash of every file to index.
+    """
+    indexed_files = manifest["files"]
+    git_changed = None
+    if manifest.get("commit"):
+        git_changed = changed_paths_since(repo_path, manifest["commit"])
+        if git_changed is None:
+            logger.info(
+                "Could not diff against the last indexed commit, comparing file hashes instead.")
+
+    files_to_index = []
+    stale_paths = []
+    new_hashes = {}
+    current_paths = set()
+    for file_path in collected_files:
+        rel_path = relative_path(file_path, repo_path)
+        current_paths.add(rel_path)
+        entry = indexed_files.get(rel_path)
+        # Git already told us this file is untouched, so there is no need to read it.
+        if entry is not None and git_changed is not None and rel_path not in git_changed:
+            continue
+        # Like git's index, an unchanged size and mtime means an unchanged file.
+        if entry is not None and file_stats is not None and "mtime_ns" in entry and \
+                tuple(file_stats.get(file_path, ())) == (entry["size"], entry["mtime_ns"]):
+            continue
+        try:
+            file_hash = hash_file(file_path)
+        except OSError as e:
+            logger.warning(f"Could not hash file, skipping: {file_path} ({e})")
+            continue
+        if entry is not None and entry["hash"] == file_hash:
+            if file_stats is not None and file_path in file_stats:
+                # Touched but not modified: remember the new mtime so it is not hashed again.
+                entry["size"], entry["mtime_ns"] = file_stats[file_path]
+            continue
+        if entry is not None:
+            stale_paths.append(rel_path)
+        files_to_index.append(file_path)
+        new_hashes[rel_path] = file_hash
+
+    # Files that were indexed before but no longer exist.
+    stale_paths.extend(sorted(set(indexed_files) - current_paths))
+    return files_to_index, stale_paths, new_hashes
+
+
+def plan_update_from_hashes(manifest: dict, file_hashes: Dict[str, str],
+                            repo_path: str) -> Tuple[List[str], List[str], Dict[str, str]]:
+    """
+    Same as plan_update, for files whose content hashes are already known (git
+    blob ids read from the object database), so no file has to be read.
+
+    Args:
+        manifest (dict): The manifest of the existing vector store.
+        file_hashes (Dict[str, str]): The content hash of each collected file.
+        repo_path (str): The path of the repository.
+
+    Returns:
+        Tuple[List[str], List[str], Dict[str, str]]: See plan_update.
+    """
+    indexed_files = manifest["files"]
+    files_to_index = []
+    stale_paths = []
+    new_hashes = {}
+    current_paths = set()
+    for file_path, file_hash in file_hashes.items():
+        rel_path = relative_path(file_path, repo_path)
+        current_paths.add(rel_path)
+        entry = indexed_files.get(rel_path)
+        if entry is not None and entry["hash"] == file_hash:
+            continue
+        if entry is not None:
+            stale_paths.append(rel_path)
+        files_to_index.append(file_path)
+        new_hashes[rel_path] = file_hash
+
+    stale_paths.extend(sorted(set(indexed_files) - current_paths))
+    return files_to_index, stale_paths, new_hashes
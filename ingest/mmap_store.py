@@ -0,0 +1,243 @@
+# This script writes and opens the memory-mapped vector store format used at query time
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+import faiss
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from .index_factory import load_index_meta, apply_search_params
+from .logger import logger
+
+MMAP_META_FILENAME = "mmap_store.json"
+MMAP_FORMAT_VERSION = 1
+VECTORS_FILENAME = "vectors.npy"
+NORMS_FILENAME = "norms.npy"
+ANN_INDEX_FILENAME = "vectors.faiss"
+CHUNKS_FILENAME = "chunks.sqlite3"
+
+# Number of vectors converted to float32 at a time, bounds the memory used by exports and searches.
+_BLOCK_SIZE = 65536
+
+
+def has_mmap_store(store_path: str) -> bool:
+    """
+    Tells whether a vector store directory holds the memory-mapped format.
+    """
+    return os.path.exists(os.path.join(store_path, MMAP_META_FILENAME))
+
+
+def export_mmap_store(vector_store, store_path: str, index_meta: dict, dtype: str) -> None:
+    """
+    Writes a FAISS vector store in the memory-mapped format next to it.
+
+    Flat indexes are written as a raw .npy matrix (optionally float16) that is
+    searched with numpy, approximate indexes as a FAISS file opened with mmap.
+    Chunk texts and metadata go to a SQLite file indexed by vector position, so
+    only the top-k hits are ever read. Every file is written under a temporary
+    name and renamed, and the metadata file is renamed last.
+
+    Args:
+        vector_store (FAISS): The vector store built by the ingestion pipeline.
+        store_path (str): The directory of the vector store.
+        index_meta (dict): The metadata of the store's index.
+        dtype (str): "float16" or "float32", the storage type of flat vectors.
+    """
+    index = vector_store.index
+    count = index.ntotal
+    meta = {
+        "version": MMAP_FORMAT_VERSION,
+        "count": count,
+        "dimension": index.d,
+        "index_type": index_meta["index_type"],
+        "dtype": dtype if index_meta["index_type"] == "flat" else None,
+    }
+
+    if index_meta["index_type"] == "flat":
+        vectors_tmp = os.path.join(store_path, VECTORS_FILENAME + ".tmp")
+        norms_tmp = os.path.join(store_path, NORMS_FILENAME + ".tmp")
+        vectors = np.lib.format.open_memmap(
+            vectors_tmp, mode="w+", dtype=dtype, shape=(count, index.d))
+        norms = np.lib.format.open_memmap(
+            norms_tmp, mode="w+", dtype=np.float32, shape=(count,))
+        for start in range(0, count, _BLOCK_SIZE):
+            block = index.reconstruct_n(start, min(_BLOCK_SIZE, count - start))
+            stored = block.astype(dtype)
+            vectors[start:start + len(block)] = stored
+            # Norms of the stored (possibly rounded) vectors keep the distances consistent.
+            norms[start:start + len(block)] = np.sum(
+                stored.astype(np.float32) ** 2, axis=1)
+        vectors.flush()
+        norms.flush()
+        del vectors, norms
+        os.replace(vectors_tmp, os.path.join(store_path, VECTORS_FILENAME))
+        os.replace(norms_tmp, os.path.join(store_path, NORMS_FILENAME))
+    else:
+        index_tmp = os.path.join(store_path, ANN_INDEX_FILENAME + ".tmp")
+        faiss.write_index(index, index_tmp)
+        os.replace(index_tmp, os.path.join(store_path, ANN_INDEX_FILENAME))
+
+    chunks_tmp = os.path.join(store_path, CHUNKS_FILENAME + ".tmp")
+    if os.path.exists(chunks_tmp):
+        os.remove(chunks_tmp)
+    conn = sqlite3.connect(chunks_tmp)
+    conn.execute(
+        "CREATE TABLE chunks (position INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL, "
+        "text TEXT NOT NULL, metadata TEXT NOT NULL)")
+    rows = []
+    for position in range(count):
+        chunk_id = vector_store.index_to_docstore_id[position]
+        doc = vector_store.docstore.search(chunk_id)
+        rows.append((position, chunk_id, doc.page_content, json.dumps(doc.metadata)))
+        if len(rows) == _BLOCK_SIZE:
+            conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", rows)
+            rows = []
+    conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    os.replace(chunks_tmp, os.path.join(store_path, CHUNKS_FILENAME))
+
+    meta_tmp = os.path.join(store_path, MMAP_META_FILENAME + ".tmp")
+    with open(meta_tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=1)
+    os.replace(meta_tmp, os.path.join(store_path, MMAP_META_FILENAME))
+    logger.info(f"Memory-mapped vector store exported ({count} vectors).")
+
+
+class MmapVectorStore(VectorStore):
+    """
+    A read-only vector store opened from the memory-mapped format.
+
+    Opening it only maps files, so it takes milliseconds and the pages are
+    shared by every process through the OS page cache. Nothing is unpickled:
+    chunk texts are read from SQLite for the top-k hits of each search.
+    """
+
+    def __init__(self, store_path: str, embedding: Embeddings):
+        """
+        Args:
+            store_path (str): The directory of the vector store.
+            embedding (Embeddings): The model used to embed queries.
+        """
+        with open(os.path.join(store_path, MMAP_META_FILENAME), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != MMAP_FORMAT_VERSION:
+            raise ValueError(f"Unsupported memory-mapped store version in {store_path}.")
+        self.store_path = store_path
+        self.embedding = embedding
+        self.vectors = None
+        self.norms = None
+        self.index = None
+
+        if self.meta["index_type"] == "flat":
+            self.vectors = np.load(os.path.join(store_path, VECTORS_FILENAME), mmap_mode="r")
+            self.norms = np.load(os.path.join(store_path, NORMS_FILENAME), mmap_mode="r")
+        else:
+            self.index = faiss.read_index(
+                os.path.join(store_path, ANN_INDEX_FILENAME),
+                faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            apply_search_params(self.index, load_index_meta(store_path))
+
+        # Opened read-only, the connection is shared by Streamlit's threads behind a lock.
+        self._conn = sqlite3.connect(
+            f"file:{os.path.join(store_path, CHUNKS_FILENAME)}?mode=ro",
+            uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self.embedding
+
+    def __len__(self) -> int:
+        return self.meta["count"]
+
+    def _search_flat(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(k, len(self.vectors))
+        rows = np.arange(len(queries))[:, None]
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_positions = np.empty((len(queries), 0), dtype=np.int64)
+        query_norms = np.einsum("ij,ij->i", queries, queries)[:, None]
+        for start in range(0, len(self.vectors), _BLOCK_SIZE):
+            block = np.asarray(self.vectors[start:start + _BLOCK_SIZE], dtype=np.float32)
+            # Squared L2 distances, as returned by FAISS flat indexes, for every query at once.
+            scores = self.norms[start:start + len(block)][None, :] - 2 * (queries @ block.T) + query_norms
+            top = np.argpartition(scores, min(k, scores.shape[1]) - 1, axis=1)[:, :k]
+            best_scores = np.concatenate([best_scores, scores[rows, top]], axis=1)
+            best_positions = np.concatenate([best_positions, top + start], axis=1)
+        order = np.argsort(best_scores, axis=1)[:, :k]
+        return best_scores[rows, order], best_positions[rows, order]
+
+    def search_vectors_batch(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Searches several queries at once, reading the vectors a single time.
+
+        Args:
+            queries (np.ndarray): The query vectors, one per row.
+            k (int): The number of neighbours per query.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The squared L2 distances and positions,
+            one row per query. Missing neighbours have the position -1.
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32).reshape(-1, self.meta["dimension"])
+        if self.index is not None:
+            return self.index.search(queries, k)
+        if not len(self.vectors):
+            return (np.empty((len(queries), 0), dtype=np.float32),
+                    np.empty((len(queries), 0), dtype=np.int64))
+        return self._search_flat(queries, k)
+
+    def search_vectors(self, query: List[float], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the squared L2 distances and positions of the k nearest vectors.
+        """
+        scores, positions = self.search_vectors_batch(np.asarray(query, dtype=np.float32), k)
+        keep = positions[0] >= 0
+        return scores[0][keep], positions[0][keep]
+
+    def get_documents(self, positions: Iterable[int]) -> List[Document]:
+        """
+        Reads the chunks stored at the given vector positions, in the same order.
+        """
+        positions = [int(position) for position in positions]
+        if not positions:
+            return []
+        placeholders = ",".join("?" * len(positions))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT position, chunk_id, text, metadata FROM chunks WHERE position IN ({placeholders})",
+                positions).fetchall()
+        by_position = {
+            position: Document(id=chunk_id, page_content=text, metadata=json.loads(metadata))
+            for position, chunk_id, text, metadata in rows}
+        return [by_position[position] for position in positions]
+
+    def similarity_search_with_score_by_vector(
+            self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        scores, positions = self.search_vectors(embedding, k)
+        documents = self.get_documents(positions)
+        return [(doc, float(score)) for doc, score in zip(documents, scores)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        raise NotImplementedError(
+            "Memory-mapped stores are read-only, re-run the ingestion to update them.")
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   **kwargs: Any) -> "MmapVectorStore":
+        raise NotImplementedError(
+            "Memory-mapped stores are written by export_mmap_store.")
@@ -0,0 +1,349 @@
+# This script serves the RAG pipeline over HTTP, sharing the loaded indexes and models across clients
+import argparse
+import asyncio
+import json
+import os
+import time
+from functools import partial
+from typing import List, Optional
+
+from aiohttp import web
+
+from . import config
+from .logger import logger
+from .store_manager import StoreManager
+from .tracing import tracer
+
+VECTOR_STORE_DIR = "data/vector_stores"
+
+
+class RepoResources:
+    """
+    The loaded vector store of one repository, its symbol index and commit history, its answer
+    cache, and the chain answering its questions (see _RepoAnswerChain).
+    """
+
+    def __init__(self, vector_store, answer_cache, symbol_index=None, history_store=None):
+        self.vector_store = vector_store
+        self.answer_cache = answer_cache
+        self.symbol_index = symbol_index
+        self.history_store = history_store
+        self.answer_chain = None
+
+
+class _RepoAnswerChain:
+    """
+    Answers the questions of one repository: yields ("sources", list), then the answer text.
+
+    It is wrapped in a CachedRagChain when the answer cache is enabled, so cached
+    questions skip it and identical concurrent questions share one LLM call.
+    """
+
+    def __init__(self, service: "QueryService", resources: RepoResources):
+        self.service = service
+        self.resources = resources
+
+    async def astream(self, question: str, config=None, k: int = 4):
+        from .chain_setup import format_docs
+
+        results = await self.service.retrieve(self.resources, question, k)
+        yield "sources", [_chunk_json(doc, score, with_text=False) for doc, score in results]
+        context = format_docs([doc for doc, _ in results])
+        async for chunk in self.service._answer_chain.astream(
+                {"context": context, "question": question}, config):
+            yield chunk
+
+
+class QueryService:
+    """
+    Answers questions for any number of clients from a single process.
+
+    Each repository's vector store is loaded once, on first use, and shared by
+    every request, as are the embedding model and the LLM client. Blocking work
+    (loading, embedding, searching, cache access) runs in worker threads, so a
+    slow request never blocks the event loop or the other clients.
+    """
+
+    def __init__(self, embeddings=None, llm=None, store_dir: str = VECTOR_STORE_DIR):
+        """
+        Args:
+            embeddings (Optional[Embeddings]): The embedding model, the shared Hugging Face model by default.
+            llm (Optional[BaseChatModel]): The chat model, Gemini by default. Tests pass a stub.
+            store_dir (str): The directory holding one vector store per repository.
+        """
+        self.embeddings = embeddings
+        self.llm = llm
+        self.store_dir = store_dir
+        self._stores = StoreManager(
+            self._load_repo, store_dir,
+            memory_budget_bytes=config.STORE_MEMORY_BUDGET_MB * 1024 * 1024,
+            check_interval_seconds=config.STORE_RELOAD_CHECK_SECONDS)
+        self._answer_chain = None
+        self._setup_lock = asyncio.Lock()
+
+    def available_repos(self) -> List[str]:
+        """
+        Lists the repositories that have a vector store.
+        """
+        if not os.path.isdir(self.store_dir):
+            return []
+        return sorted(name for name in os.listdir(self.store_dir)
+                      if os.path.isdir(os.path.join(self.store_dir, name)))
+
+    def loaded_repos(self) -> List[str]:
+        return sorted(self._stores.loaded())
+
+    def store_stats(self) -> dict:
+        return self._stores.stats()
+
+    async def _setup(self) -> None:
+        # The embedding model and the LLM client are created once, for all repositories.
+        async with self._setup_lock:
+            if self.embeddings is None:
+                from .embedding_generator import get_embedding_model
+                self.embeddings = await asyncio.to_thread(get_embedding_model)
+            if self._answer_chain is None:
+                from .chain_setup import build_answer_chain, create_llm
+                if self.llm is None:
+                    self.llm = await asyncio.to_thread(create_llm)
+                answer_chain = build_answer_chain(self.llm)
+                if tracer.enabled:
+                    from .trace_callbacks import TracingCallbackHandler
+                    answer_chain = answer_chain.with_config(
+                        callbacks=[TracingCallbackHandler(tracer)])
+                self._answer_chain = answer_chain
+
+    def _load_repo(self, repo_name: str) -> Optional[RepoResources]:
+        from .chain_setup import load_search_indexes, load_vector_store
+
+        store_path = os.path.join(self.store_dir, repo_name)
+        vector_store = load_vector_store(store_path, self.embeddings)
+        if vector_store is None:
+            return None
+        # The same retrieval as the chat: symbol lookups and commit history, when they were built.
+        symbol_index, history_store = load_search_indexes(store_path, self.embeddings)
+        answer_cache = None
+        if config.ANSWER_CACHE_ENABLED:
+            from .answer_cache import ANSWER_CACHE_FILENAME, AnswerCache, CachedRagChain, index_version
+            from .symbol_index import is_identifier_lookup
+            answer_cache = AnswerCache(
+                os.path.join(store_path, ANSWER_CACHE_FILENAME),
+                version=index_version(store_path),
+                embeddings=self.embeddings,
+                similarity_threshold=config.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+                max_entries=config.ANSWER_CACHE_MAX_ENTRIES,
+                ttl_seconds=config.ANSWER_CACHE_TTL_SECONDS,
+                # Identifier lookups are only served on exact repeats, and never embedded.
+                exact_only=partial(is_identifier_lookup, symbol_index) if symbol_index is not None else None)
+        resources = RepoResources(vector_store, answer_cache, symbol_index, history_store)
+        resources.answer_chain = _RepoAnswerChain(self, resources)
+        if answer_cache is not None:
+            resources.answer_chain = CachedRagChain(resources.answer_chain, answer_cache)
+        return resources
+
+    async def get_repo(self, repo_name: str) -> Optional[RepoResources]:
+        """
+        Returns the resources of a repository, loading them on first use. Stores
+        are evicted and reloaded after re-ingestion by the StoreManager.
+
+        Args:
+            repo_name (str): The name of a folder inside the vector store directory.
+
+        Returns:
+            Optional[RepoResources]: The loaded repository, or None if it has no vector store.
+        """
+        # Names come from clients, they must not point outside the vector store directory.
+        if not repo_name or os.path.basename(repo_name) != repo_name or repo_name.startswith("."):
+            return None
+        await self._setup()
+        return await asyncio.to_thread(self._stores.get, repo_name)
+
+    async def retrieve(self, resources: RepoResources, question: str, k: int):
+        """
+        Returns the k most relevant chunks of a question with their distances.
+
+        Retrieval is the same as the chat's (chain_setup.build_retriever): identifier
+        lookups are answered from the symbol index without embedding the question, and
+        history questions also search the commits. Distances are only known for plain
+        vector searches, the chunks of the fused retrievers come with None.
+        """
+        start_time = time.time()
+        started = time.perf_counter()
+        if resources.symbol_index is None and resources.history_store is None:
+            results = await asyncio.to_thread(
+                resources.vector_store.similarity_search_with_score, question, k)
+        else:
+            from .chain_setup import build_retriever
+            retriever = build_retriever(resources.vector_store, resources.symbol_index,
+                                        resources.history_store, k)
+            documents = await asyncio.to_thread(retriever.invoke, question)
+            results = [(doc, None) for doc in documents]
+        tracer.add_span("retrieve", start_time, time.perf_counter() - started, chunks=len(results))
+        return results
+
+    async def stream_answer(self, resources: RepoResources, question: str, k: int):
+        """
+        Answers a question, yielding ("sources", list), ("token", str) and ("done", dict) events.
+
+        Cached answers come without sources. A question asked while the same one is
+        being answered follows that answer, sources included, instead of calling the LLM.
+        """
+        start_time = time.perf_counter()
+        cached = True
+        async for item in resources.answer_chain.astream(question, k=k):
+            if isinstance(item, str):
+                yield "token", item
+            else:
+                cached = False
+                yield item
+        yield "done", {"cached": cached, "seconds": time.perf_counter() - start_time}
+
+
+# The QueryService of an application, set by create_app.
+SERVICE_KEY = web.AppKey("service", QueryService)
+
+
+def _chunk_json(doc, score: Optional[float], with_text: bool = True) -> dict:
+    chunk = {
+        "id": doc.id,
+        "source": doc.metadata.get("source"),
+        "start_index": doc.metadata.get("start_index"),
+        "start_line": doc.metadata.get("start_line"),
+        "end_line": doc.metadata.get("end_line"),
+        "score": None if score is None else float(score),
+    }
+    if with_text:
+        chunk["text"] = doc.page_content
+    return chunk
+
+
+async def _read_request(request: web.Request):
+    # Returns the repository, question and k of a request, or raises an HTTP 400 / 404 error.
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        raise web.HTTPBadRequest(text="The request body must be JSON.")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="The request body must be a JSON object.")
+    repo_name, question = body.get("repo"), body.get("question")
+    if not isinstance(repo_name, str) or not isinstance(question, str) or not question.strip():
+        raise web.HTTPBadRequest(text='"repo" and "question" are required.')
+    try:
+        k = max(1, min(int(body.get("k", 5)), 50))
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text='"k" must be an integer.')
+
+    service = request.app[SERVICE_KEY]
+    resources = await service.get_repo(repo_name)
+    if resources is None:
+        raise web.HTTPNotFound(text=f"No vector store for repository '{repo_name}'.")
+    return resources, question, k
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    service = request.app[SERVICE_KEY]
+    return web.json_response({"status": "ok", "loaded_repos": service.loaded_repos(),
+                              "stores": service.store_stats()})
+
+
+async def handle_repos(request: web.Request) -> web.Response:
+    service = request.app[SERVICE_KEY]
+    return web.json_response({"repos": service.available_repos()})
+
+
+async def handle_retrieve(request: web.Request) -> web.Response:
+    """
+    POST /retrieve {"repo", "question", "k"}: returns the retrieved chunks as JSON.
+    """
+    resources, question, k = await _read_request(request)
+    service = request.app[SERVICE_KEY]
+    results = await service.retrieve(resources, question, k)
+    return web.json_response({"chunks": [_chunk_json(doc, score) for doc, score in results]})
+
+
+async def handle_query(request: web.Request) -> web.StreamResponse:
+    """
+    POST /query {"repo", "question", "k"}: streams the answer as server-sent events.
+
+    Events: "sources" (the retrieved chunks), "token" (answer text, in order),
+    then "done", or "error" if the answer could not be generated.
+    """
+    resources, question, k = await _read_request(request)
+    service = request.app[SERVICE_KEY]
+    tracer.count("service_queries")
+
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    await response.prepare(request)
+    try:
+        async for event, data in service.stream_answer(resources, question, k):
+            await response.write(_sse(event, {"text": data} if event == "token" else data))
+    except ConnectionResetError:
+        # The client went away, there is nobody left to answer.
+        logger.info("Client disconnected during a streamed answer.")
+        return response
+    except Exception as e:
+        logger.error(f"Query failed: {e}")
+        await response.write(_sse("error", {"error": f"{type(e).__name__}: {e}"}))
+    await response.write_eof()
+    return response
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=tracer.prometheus_text(), content_type="text/plain")
+
+
+def _sse(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def create_app(service: QueryService) -> web.Application:
+    """
+    Creates the aiohttp application serving a QueryService.
+    """
+    app = web.Application()
+    app[SERVICE_KEY] = service
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/repos", handle_repos)
+    app.router.add_post("/retrieve", handle_retrieve)
+    app.router.add_post("/query", handle_query)
+    if tracer.enabled:
+        app.router.add_get("/metrics", handle_metrics)
+    return app
+
+
+def main():
+    """
+    Runs the query service.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="0.0.0.0", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=config.SERVICE_PORT, help="Port to listen on")
+    parser.add_argument("--preload", type=str, nargs="*", default=[],
+                        help="Repositories to load before accepting requests")
+    parser.add_argument("--stub-llm", action="store_true",
+                        help="Answer with a deterministic fake LLM, for offline testing")
+    args = parser.parse_args()
+
+    llm = None
+    if args.stub_llm:
+        from .stubs import FakeStreamingChatModel
+        llm = FakeStreamingChatModel()
+    service = QueryService(llm=llm)
+    app = create_app(service)
+
+    async def preload(app):
+        for repo_name in args.preload:
+            if await service.get_repo(repo_name) is None:
+                logger.warning(f"Cannot preload '{repo_name}': no vector store found.")
+    app.on_startup.append(preload)
+
+    logger.info(f"Query service listening on http://{args.host}:{args.port}")
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
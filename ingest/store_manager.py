@@ -0,0 +1,211 @@
+# This script keeps the loaded knowledge bases within a memory budget and reloads them after re-ingestion
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .logger import logger
+from .manifest import MANIFEST_FILENAME, load_manifest
+from .mmap_store import ANN_INDEX_FILENAME, NORMS_FILENAME, VECTORS_FILENAME, has_mmap_store
+
+# The files a loaded store keeps in memory, for each format.
+_MMAP_RESIDENT_FILES = (VECTORS_FILENAME, NORMS_FILENAME, ANN_INDEX_FILENAME)
+_FAISS_RESIDENT_FILES = ("index.faiss", "index.pkl")
+
+
+def read_store_version(store_path: str) -> Optional[Tuple[int, int]]:
+    """
+    Identifies the on-disk version of a vector store.
+
+    Returns:
+        Optional[Tuple[int, int]]: The generation written by the ingestion and the
+        manifest mtime, or None while an ingestion is still writing the store.
+    """
+    manifest = load_manifest(store_path)
+    if manifest is None:
+        # Stores built before manifests existed are versioned by their index file.
+        index_path = os.path.join(store_path, "index.faiss")
+        return (0, os.stat(index_path).st_mtime_ns) if os.path.exists(index_path) else (0, 0)
+    if not manifest.get("complete", True):
+        return None
+    mtime = os.stat(os.path.join(store_path, MANIFEST_FILENAME)).st_mtime_ns
+    return manifest.get("generation", 0), mtime
+
+
+def estimate_store_bytes(store_path: str) -> int:
+    """
+    Estimates the memory held by a loaded vector store from the size of its index files.
+    """
+    names = _MMAP_RESIDENT_FILES if has_mmap_store(store_path) else _FAISS_RESIDENT_FILES
+    total = 0
+    for name in names:
+        path = os.path.join(store_path, name)
+        if os.path.exists(path):
+            total += os.path.getsize(path)
+    return total
+
+
+class _Entry:
+    __slots__ = ("resource", "version", "size", "checked_at", "reloading")
+
+    def __init__(self, resource: Any, version: Optional[Tuple[int, int]], size: int):
+        self.resource = resource
+        self.version = version
+        self.size = size
+        self.checked_at = time.monotonic()
+        self.reloading = False
+
+
+class StoreManager:
+    """
+    Caches what is loaded for each knowledge base (a RAG chain, a vector store...)
+    under a memory budget.
+
+    The least recently used stores are evicted once the estimated footprint of
+    the loaded stores exceeds the budget; the store being used is always kept.
+    When a store is used and its on-disk version (the generation number written
+    by the ingestion) has changed, the new version is loaded in the background
+    and swapped in once ready. Queries keep using the old version until then, and
+    queries already running on it finish on it.
+    """
+
+    def __init__(self, loader: Callable[[str], Any], store_dir: str, memory_budget_bytes: int,
+                 check_interval_seconds: float):
+        """
+        Args:
+            loader (Callable[[str], Any]): Loads a repository by name, returns None if it has no store.
+            store_dir (str): The directory holding one vector store per repository.
+            memory_budget_bytes (int): The footprint above which stores are evicted.
+            check_interval_seconds (float): Minimum time between two version checks of a store.
+        """
+        self.loader = loader
+        self.store_dir = store_dir
+        self.memory_budget_bytes = memory_budget_bytes
+        self.check_interval_seconds = check_interval_seconds
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _store_path(self, repo_name: str) -> str:
+        return os.path.join(self.store_dir, repo_name)
+
+    def _load(self, repo_name: str) -> Optional[_Entry]:
+        store_path = self._store_path(repo_name)
+        # Read before loading: if the store changes meanwhile, the next check reloads it again.
+        version = read_store_version(store_path) if os.path.isdir(store_path) else None
+        start_time = time.perf_counter()
+        resource = self.loader(repo_name)
+        if resource is None:
+            return None
+        size = estimate_store_bytes(store_path)
+        logger.info(
+            f"Loaded knowledge base '{repo_name}' ({size / (1024 * 1024):.1f} MB) "
+            f"in {time.perf_counter() - start_time:.2f}s.")
+        return _Entry(resource, version, size)
+
+    def _evict_over_budget(self, keep: str) -> None:
+        # Called with self._lock held.
+        total = sum(entry.size for entry in self._entries.values())
+        for repo_name in list(self._entries):
+            if total <= self.memory_budget_bytes:
+                break
+            if repo_name == keep:
+                continue
+            entry = self._entries.pop(repo_name)
+            total -= entry.size
+            # Queries still holding the resource keep it alive until they finish.
+            logger.info(
+                f"Evicted knowledge base '{repo_name}' to stay within the memory budget "
+                f"({total / (1024 * 1024):.1f} MB loaded).")
+
+    def _reload(self, repo_name: str, old_entry: _Entry) -> None:
+        try:
+            new_entry = self._load(repo_name)
+        except Exception as e:
+            logger.error(f"Reloading knowledge base '{repo_name}' failed, keeping the loaded version: {e}")
+            new_entry = None
+        finally:
+            old_entry.reloading = False
+        if new_entry is None:
+            return
+        with self._lock:
+            # The store may have been evicted while it was reloading.
+            if self._entries.get(repo_name) is old_entry:
+                self._entries[repo_name] = new_entry
+                self._evict_over_budget(keep=repo_name)
+        logger.info(f"Knowledge base '{repo_name}' reloaded after re-ingestion.")
+
+    def _check_for_update(self, repo_name: str, entry: _Entry) -> None:
+        entry.checked_at = time.monotonic()
+        try:
+            version = read_store_version(self._store_path(repo_name))
+        except OSError:
+            return
+        if version is None or version == entry.version or entry.reloading:
+            return
+        entry.reloading = True
+        threading.Thread(target=self._reload, args=(repo_name, entry), daemon=True).start()
+
+    def get(self, repo_name: str) -> Optional[Any]:
+        """
+        Returns what is loaded for a repository, loading it on first use.
+
+        Args:
+            repo_name (str): The name of a folder inside the store directory.
+
+        Returns:
+            Optional[Any]: The loaded resource, or None if the repository has no store.
+        """
+        with self._lock:
+            entry = self._entries.get(repo_name)
+            if entry is not None:
+                self._entries.move_to_end(repo_name)
+                load_lock = None
+            else:
+                load_lock = self._load_locks.setdefault(repo_name, threading.Lock())
+        if entry is not None:
+            if time.monotonic() - entry.checked_at >= self.check_interval_seconds:
+                self._check_for_update(repo_name, entry)
+            return entry.resource
+
+        # Concurrent first requests for the same repository load it only once.
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(repo_name)
+            if entry is None:
+                entry = self._load(repo_name)
+                if entry is None:
+                    return None
+                with self._lock:
+                    self._entries[repo_name] = entry
+                    self._evict_over_budget(keep=repo_name)
+        return entry.resource
+
+    def evict(self, repo_name: str) -> None:
+        """
+        Unloads a repository, e.g. before deleting its store.
+        """
+        with self._lock:
+            self._entries.pop(repo_name, None)
+
+    def loaded(self) -> List[str]:
+        """
+        Lists the loaded repositories, least recently used first.
+        """
+        with self._lock:
+            return list(self._entries)
+
+    def stats(self) -> dict:
+        """
+        Returns the footprint and version of each loaded store and the budget.
+        """
+        with self._lock:
+            stores = {repo_name: {"bytes": entry.size,
+                                  "generation": entry.version[0] if entry.version else None}
+                      for repo_name, entry in self._entries.items()}
+        return {
+            "stores": stores,
+            "total_bytes": sum(store["bytes"] for store in stores.values()),
+            "budget_bytes": self.memory_budget_bytes,
+        }
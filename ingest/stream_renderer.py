@@ -0,0 +1,120 @@
+# This script displays streamed answers at a bounded frame rate instead of once per character
+import time
+from typing import Callable, Dict, Optional
+
+from . import config
+from .tracing import tracer
+
+CURSOR = "▌"
+
+
+class StreamRenderer:
+    """
+    Buffers the chunks of a streamed answer and redraws it at most max_fps times per second.
+
+    Every redraw re-renders the whole answer, so drawing once per chunk (or per
+    character) makes streaming quadratic in the answer length. Here a chunk is
+    only drawn when the last frame is at least 1 / max_fps seconds old, and
+    finish() draws whatever is left. The optional typewriter effect reveals
+    the text at chars_per_second; what remains to reveal when the stream ends
+    is revealed within typewriter_max_seconds, so the effect never delays the
+    full answer by more than that.
+
+    Time to first token, streaming time, total time, the time spent drawing and
+    the number of frames are returned by finish() and recorded by the tracer.
+    """
+
+    def __init__(self, render: Callable[[str], None], max_fps: float = config.STREAM_MAX_FPS,
+                 typewriter: bool = False, chars_per_second: float = config.TYPEWRITER_CHARS_PER_SECOND,
+                 typewriter_max_seconds: float = config.TYPEWRITER_MAX_SECONDS,
+                 clock: Callable[[], float] = time.perf_counter, sleep: Callable[[float], None] = time.sleep):
+        """
+        Args:
+            render (Callable[[str], None]): Draws the text, e.g. a Streamlit placeholder's markdown method.
+            max_fps (float): The maximum number of redraws per second.
+            typewriter (bool): Reveal the text progressively instead of as it arrives.
+            chars_per_second (float): The reveal speed of the typewriter effect.
+            typewriter_max_seconds (float): The longest the reveal may continue after the stream ends.
+            clock (Callable[[], float]): The monotonic clock, replaceable in benchmarks.
+            sleep (Callable[[float], None]): Waits between the final typewriter frames.
+        """
+        self.render = render
+        self.frame_interval = 1.0 / max_fps
+        self.typewriter = typewriter
+        self.chars_per_second = chars_per_second
+        self.typewriter_max_seconds = typewriter_max_seconds
+        self.clock = clock
+        self.sleep = sleep
+        self.text = ""
+        self.frames = 0
+        self.render_seconds = 0.0
+        self.first_token_seconds: Optional[float] = None
+        self._shown = 0
+        self._last_frame: Optional[float] = None
+        self._started = clock()
+        self._started_at = time.time()
+
+    def _draw(self, text: str) -> None:
+        draw_started = self.clock()
+        self.render(text)
+        self.render_seconds += self.clock() - draw_started
+        self.frames += 1
+
+    def _frame(self, now: float) -> None:
+        if self.typewriter:
+            elapsed = now - self._last_frame if self._last_frame is not None else self.frame_interval
+            # At least one character per frame, so a slow speed cannot stall the display.
+            self._shown = min(len(self.text), self._shown + max(1, int(elapsed * self.chars_per_second)))
+        else:
+            self._shown = len(self.text)
+        self._last_frame = now
+        self._draw(self.text[:self._shown] + CURSOR)
+
+    def feed(self, chunk: str) -> None:
+        """
+        Adds a streamed chunk, drawing a frame if the last one is old enough.
+        """
+        if not chunk:
+            return
+        now = self.clock()
+        if self.first_token_seconds is None:
+            self.first_token_seconds = now - self._started
+        self.text += chunk
+        if self._last_frame is None or now - self._last_frame >= self.frame_interval:
+            self._frame(now)
+
+    def finish(self) -> Dict[str, float]:
+        """
+        Draws the complete answer, without the cursor, once the stream has ended.
+
+        Returns:
+            Dict[str, float]: The time to first token, the streaming, total and
+            drawing times in seconds, and the number of frames.
+        """
+        stream_seconds = self.clock() - self._started
+        remaining = len(self.text) - self._shown
+        if self.typewriter and remaining > 0:
+            duration = min(remaining / self.chars_per_second, self.typewriter_max_seconds)
+            frames = max(1, int(duration / self.frame_interval))
+            start = self._shown
+            for frame in range(1, frames):
+                self.sleep(duration / frames)
+                self._shown = start + remaining * frame // frames
+                self._draw(self.text[:self._shown] + CURSOR)
+            self.sleep(duration / frames)
+        self._shown = len(self.text)
+        self._draw(self.text)
+
+        stats = {
+            "first_token_seconds": self.first_token_seconds,
+            "stream_seconds": stream_seconds,
+            "total_seconds": self.clock() - self._started,
+            "render_seconds": self.render_seconds,
+            "frames": self.frames,
+        }
+        if self.first_token_seconds is not None:
+            tracer.add_span("first_token", self._started_at, self.first_token_seconds)
+        tracer.add_span("render_answer", self._started_at, stats["total_seconds"],
+                        frames=self.frames, chars=len(self.text), render_seconds=self.render_seconds)
+        tracer.count("rendered_frames", self.frames)
+        return stats
@@ -0,0 +1,50 @@
+# This script provides a deterministic stand-in for the chat model, to run the query service offline
+import re
+import time
+import zlib
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """
+    A chat model that streams a deterministic answer with a configurable latency.
+
+    It waits time_to_first_token seconds, then emits answer_tokens words with
+    seconds_per_token between them, roughly like a hosted LLM.
+    """
+
+    time_to_first_token: float = 0.3
+    seconds_per_token: float = 0.01
+    answer_tokens: int = 80
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming-chat"
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        prompt = "".join(str(message.content) for message in messages)
+        words = _TOKEN_PATTERN.findall(prompt) or ["answer"]
+        seed = zlib.crc32(prompt.encode("utf-8"))
+        return [words[(seed + i * 7919) % len(words)] + " " for i in range(self.answer_tokens)]
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[Any] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.time_to_first_token)
+        for number, token in enumerate(self._tokens(messages)):
+            if number:
+                time.sleep(self.seconds_per_token)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[Any] = None, **kwargs: Any) -> ChatResult:
+        content = "".join(chunk.message.content for chunk in self._stream(messages, stop))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
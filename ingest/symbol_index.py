@@ -0,0 +1,304 @@
+# This script indexes the identifiers, definitions and file names of a vector store for exact lookups
+import json
+import os
+import re
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from .chunker import document_kind
+from .logger import logger
+from .tracing import tracer
+
+SYMBOL_INDEX_FILENAME = "symbols.json"
+SYMBOL_INDEX_VERSION = 1
+
+# The name of a function, class, type or module being defined, in most languages.
+_DEFINITION_NAME_RE = re.compile(
+    r"^[ \t]*(?:(?:export|default|public|private|protected|internal|static|final|abstract|async|"
+    r"pub(?:\([\w:]+\))?|unsafe|open|data|suspend)\s+)*"
+    r"(?:def|class|function\*?|func(?:\s*\([^)]*\))?|fn|fun|interface|struct|enum|trait|type|module|object)"
+    r"\s+([A-Za-z_$][\w$]*)", re.MULTILINE)
+# Constants and variables assigned at the top level of a file ("CHUNK_SIZE = 500", "const x = ...").
+_ASSIGNMENT_NAME_RE = re.compile(
+    r"^(?:(?:export\s+)?(?:const|let|var)\s+)?([A-Za-z_$][\w$]*)\s*(?::[^=\n]+)?=(?!=)", re.MULTILINE)
+_IDENTIFIER_RE = re.compile(r"[A-Za-z_$][\w$]*")
+# snake_case, camelCase and PascalCase with an inner capital: never plain English words.
+_CODE_LIKE_RE = re.compile(r"\w+_\w+|_\w+|\w*[a-z][A-Z]\w*|[A-Z]+[a-z]+[A-Z]\w*")
+# A file name with an extension, optionally with directories ("chunker.py", "ingest/config.py").
+_PATH_RE = re.compile(r"[\w./-]*\w\.[A-Za-z]{1,5}")
+_BACKTICK_RE = re.compile(r"`([^`]+)`")
+_WORD_RE = re.compile(r"[\w./$-]+(?:\(\))?")
+
+# Words of questions that only ask where something is or what uses it.
+_LOOKUP_WORDS = {
+    "where", "is", "are", "the", "a", "an", "defined", "define", "definition", "definitions",
+    "declared", "declaration", "of", "find", "show", "me", "what", "which", "who", "calls", "call",
+    "called", "callers", "caller", "uses", "use", "used", "usages", "usage", "references", "reference",
+    "referenced", "implemented", "implementation", "located", "location", "lives", "in", "file",
+    "function", "method", "class", "variable", "constant", "symbol", "module", "source", "code",
+    "for", "look", "up", "at", "does", "do", "to", "get",
+}
+# Words asking for the places using an identifier rather than its definition.
+_REFERENCE_WORDS = {"calls", "call", "called", "callers", "caller", "uses", "use", "used", "usages",
+                    "usage", "references", "reference", "referenced"}
+# Reciprocal rank fusion constant: ranks further down both lists matter less, but never nothing.
+_RRF_K = 60
+
+
+class SymbolQuery(NamedTuple):
+    """
+    The identifiers and file names named by a question.
+    """
+    identifiers: List[str]
+    paths: List[str]
+    # The question only asks where they are defined or used: no semantic search is needed.
+    pure: bool
+    # The question asks what uses them rather than where they are defined.
+    references: bool
+
+
+class SymbolIndex:
+    """
+    An inverted index of the definitions, identifiers and file names of a vector store's chunks.
+
+    Each chunk is referred to by its position in the store's index. Definitions
+    are found with language-agnostic patterns (def, class, function, fn, func,
+    struct... and top-level assignments in code files). References only cover
+    identifiers that cannot be English words (snake_case, camelCase, or any
+    name defined somewhere in the repository), which keeps the index compact.
+    """
+
+    def __init__(self, chunk_ids: List[str], definitions: Dict[str, List[int]],
+                 references: Dict[str, List[int]], paths: Dict[str, List[int]]):
+        """
+        Args:
+            chunk_ids (List[str]): The chunk id at each position of the store's index.
+            definitions (Dict[str, List[int]]): The chunks defining each identifier.
+            references (Dict[str, List[int]]): The chunks mentioning each identifier.
+            paths (Dict[str, List[int]]): The chunks of each file, by lower-cased file name.
+        """
+        self.chunk_ids = chunk_ids
+        self.definitions = definitions
+        self.references = references
+        self.paths = paths
+        # Lower-cased identifiers, for questions that do not respect the case of a name.
+        self._folded = {name.lower(): name for name in (*definitions, *references)}
+
+    @classmethod
+    def build(cls, vector_store) -> "SymbolIndex":
+        """
+        Indexes every chunk of a FAISS vector store.
+        """
+        chunk_ids = [vector_store.index_to_docstore_id[position]
+                     for position in range(vector_store.index.ntotal)]
+        documents = [vector_store.docstore.search(chunk_id) for chunk_id in chunk_ids]
+
+        definitions: Dict[str, List[int]] = {}
+        paths: Dict[str, List[int]] = {}
+        for position, doc in enumerate(documents):
+            if not isinstance(doc, Document):
+                continue
+            source = doc.metadata.get("source", "")
+            for other_source in doc.metadata.get("sources", [source]):
+                file_name = os.path.basename(other_source).lower()
+                if file_name:
+                    paths.setdefault(file_name, []).append(position)
+            names = set(_DEFINITION_NAME_RE.findall(doc.page_content))
+            if document_kind(source) in ("python", "code"):
+                names.update(_ASSIGNMENT_NAME_RE.findall(doc.page_content))
+            for name in names:
+                definitions.setdefault(name, []).append(position)
+
+        references: Dict[str, List[int]] = {}
+        for position, doc in enumerate(documents):
+            if not isinstance(doc, Document):
+                continue
+            for name in set(_IDENTIFIER_RE.findall(doc.page_content)):
+                if name in definitions or _CODE_LIKE_RE.fullmatch(name):
+                    references.setdefault(name, []).append(position)
+        return cls(chunk_ids, definitions, references, paths)
+
+    def save(self, store_path: str) -> None:
+        """
+        Writes the index next to the vector store, replacing the previous one atomically.
+        """
+        data = {"version": SYMBOL_INDEX_VERSION, "chunk_ids": self.chunk_ids,
+                "definitions": self.definitions, "references": self.references, "paths": self.paths}
+        tmp_path = os.path.join(store_path, SYMBOL_INDEX_FILENAME + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, os.path.join(store_path, SYMBOL_INDEX_FILENAME))
+        logger.info(
+            f"Symbol index saved: {len(self.definitions)} definitions, "
+            f"{len(self.references)} identifiers, {len(self.paths)} file names.")
+
+    @classmethod
+    def load(cls, store_path: str) -> Optional["SymbolIndex"]:
+        """
+        Reads the index of a vector store, or returns None if it has none (or an outdated one).
+        """
+        try:
+            with open(os.path.join(store_path, SYMBOL_INDEX_FILENAME), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != SYMBOL_INDEX_VERSION:
+            return None
+        return cls(data["chunk_ids"], data["definitions"], data["references"], data["paths"])
+
+    def _identifier(self, word: str) -> Optional[str]:
+        # The indexed identifier a word of a question refers to, if any.
+        if word in self.definitions or word in self.references:
+            return word
+        return self._folded.get(word.lower())
+
+    def parse_query(self, question: str) -> SymbolQuery:
+        """
+        Finds the identifiers and file names of a question that are in the index.
+
+        Backticked words, code-like words (snake_case, camelCase, calls like
+        "name()") and capitalized words that are defined in the repository count
+        as identifiers; other plain words never do, so "how do I run the tests"
+        is not a lookup of a function called run.
+        """
+        identifiers, paths = [], []
+        quoted = {match.strip().rstrip("()") for match in _BACKTICK_RE.findall(question)}
+        leftover = []
+        for word in _WORD_RE.findall(question.replace("`", " ")):
+            word = word.strip(".-/")
+            if not word:
+                continue
+            bare = word[:-2] if word.endswith("()") else word
+            if _PATH_RE.fullmatch(bare) and os.path.basename(bare).lower() in self.paths:
+                paths.append(bare)
+                continue
+            # "module.function" names both.
+            names = [part for part in bare.split(".") if part]
+            found = []
+            for name in names:
+                identifier = self._identifier(name)
+                if identifier is None:
+                    continue
+                if (name in quoted or bare in quoted or bare != word or _CODE_LIKE_RE.fullmatch(name)
+                        or (name[:1].isupper() and identifier in self.definitions)):
+                    found.append(identifier)
+            if found:
+                identifiers.extend(name for name in found if name not in identifiers)
+            else:
+                leftover.append(word.lower())
+
+        pure = bool(identifiers or paths) and all(word in _LOOKUP_WORDS for word in leftover)
+        references = any(word in _REFERENCE_WORDS for word in leftover)
+        return SymbolQuery(identifiers, paths, pure, references)
+
+    def lookup(self, query: SymbolQuery, limit: int) -> List[int]:
+        """
+        Returns the positions of the chunks answering a query, best first.
+
+        Definitions come first, unless the question asks what uses the
+        identifiers, then the chunks mentioning them, then the chunks of the
+        named files (matched by file name). Chunks matching several identifiers rank first within a group.
+        """
+        definitions = [self.definitions.get(name, []) for name in query.identifiers]
+        references = [self.references.get(name, []) for name in query.identifiers]
+        defined = {position for postings in definitions for position in postings}
+        # A definition also mentions the name, it is not a use of it.
+        references = [[position for position in postings if position not in defined]
+                      for postings in references]
+        groups = [references, definitions] if query.references else [definitions, references]
+        groups.append([self.paths.get(os.path.basename(path).lower(), []) for path in query.paths])
+
+        ranked = []
+        seen = set()
+        for group in groups:
+            matches: Dict[int, int] = {}
+            for postings in group:
+                for position in postings:
+                    matches[position] = matches.get(position, 0) + 1
+            for position in sorted(matches, key=lambda position: (-matches[position], position)):
+                if position not in seen:
+                    seen.add(position)
+                    ranked.append(position)
+                    if len(ranked) == limit:
+                        return ranked
+        return ranked
+
+    def documents(self, vector_store, positions: Iterable[int]) -> List[Document]:
+        """
+        Reads the chunks at the given positions of the vector store the index was built from.
+        """
+        positions = list(positions)
+        if hasattr(vector_store, "get_documents"):
+            # The memory-mapped store reads them by position.
+            return vector_store.get_documents(positions)
+        documents = []
+        for position in positions:
+            doc = vector_store.docstore.search(self.chunk_ids[position])
+            if isinstance(doc, Document):
+                documents.append(Document(id=self.chunk_ids[position], page_content=doc.page_content,
+                                          metadata=doc.metadata))
+        return documents
+
+
+def _fusion_key(doc: Document):
+    return doc.id or (doc.metadata.get("source"), doc.metadata.get("page"), doc.metadata.get("start_index"))
+
+
+def fuse(ranked_lists: List[List[Document]], k: int) -> List[Document]:
+    """
+    Merges ranked lists of chunks by reciprocal rank fusion and returns the top k.
+    """
+    scores: Dict[Any, float] = {}
+    documents = {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked):
+            key = _fusion_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (_RRF_K + rank + 1)
+            documents.setdefault(key, doc)
+    best = sorted(scores, key=lambda key: scores[key], reverse=True)[:k]
+    return [documents[key] for key in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    A retriever combining the symbol index of a vector store with its semantic search.
+
+    Questions that only look an identifier or a file up ("where is
+    `load_rag_chain` defined?") are answered from the symbol index alone, without
+    embedding the question. Other questions naming indexed identifiers get the
+    symbol hits fused with the vector hits by reciprocal rank; the others are
+    plain vector searches.
+    """
+
+    vector_store: Any
+    symbol_index: SymbolIndex
+    k: int = 5
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        with tracer.span("symbol_lookup"):
+            symbol_query = self.symbol_index.parse_query(query)
+            positions = self.symbol_index.lookup(symbol_query, self.k)
+            symbol_hits = self.symbol_index.documents(self.vector_store, positions)
+        if symbol_hits and symbol_query.pure:
+            tracer.count("symbol_lookups", result="pure")
+            return symbol_hits
+        vector_hits = self.vector_store.similarity_search(query, k=self.k)
+        if not symbol_hits:
+            tracer.count("symbol_lookups", result="none")
+            return vector_hits
+        tracer.count("symbol_lookups", result="fused")
+        return fuse([symbol_hits, vector_hits], self.k)
+
+
+def is_identifier_lookup(symbol_index: Optional[SymbolIndex], question: str) -> bool:
+    """
+    Tells whether a question is a pure identifier or file lookup answered without embeddings.
+    """
+    if symbol_index is None:
+        return False
+    symbol_query = symbol_index.parse_query(question)
+    return symbol_query.pure and bool(symbol_index.lookup(symbol_query, 1))
@@ -0,0 +1,105 @@
+# This script splits large text files window by window, so they are indexed with constant memory
+import codecs
+from typing import BinaryIO, Iterator, List, NamedTuple
+
+from langchain_core.documents import Document
+
+from . import config
+
+
+class TextWindow(NamedTuple):
+    """
+    A decoded slice of a file, with the position of its first character in the file.
+    """
+    text: str
+    # Offsets of the first character: bytes and characters from the start, and newlines before it.
+    byte_offset: int
+    char_offset: int
+    line_offset: int
+
+
+def iter_text_windows(stream: BinaryIO, window_bytes: int = config.STREAM_WINDOW_BYTES) -> Iterator[TextWindow]:
+    """
+    Reads a UTF-8 file in windows of about window_bytes, decoding it incrementally.
+
+    A window ends on the last blank line of its final quarter, or else on its
+    last newline, so paragraphs and lines are rarely cut between two windows.
+    Only one window and the bytes carried over to the next are held at a time.
+    Invalid bytes are replaced, a stray byte in a large log should not drop it.
+
+    Args:
+        stream (BinaryIO): The file, opened in binary mode.
+        window_bytes (int): The number of bytes read at a time.
+
+    Yields:
+        TextWindow: The windows, in file order.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    byte_offset = char_offset = line_offset = 0
+    carry = b""
+    while True:
+        block = stream.read(window_bytes)
+        data = carry + block if carry else block
+        at_end = not block
+        if not data:
+            break
+        if at_end:
+            cut = len(data)
+        else:
+            cut = data.rfind(b"\n\n", len(data) * 3 // 4)
+            if cut == -1:
+                cut = data.rfind(b"\n")
+            cut = cut + 1 if cut != -1 else len(data)
+        piece, carry = data[:cut], data[cut:]
+        # A character cut by a window without newlines is held by the decoder, its bytes start the text.
+        pending = len(decoder.getstate()[0])
+        text = decoder.decode(piece, final=at_end)
+        if text:
+            yield TextWindow(text, byte_offset - pending, char_offset, line_offset)
+        byte_offset += len(piece)
+        char_offset += len(text)
+        line_offset += piece.count(b"\n")
+        if at_end:
+            break
+
+
+def iter_stream_chunks(stream: BinaryIO, source: str, text_splitter,
+                       window_bytes: int = config.STREAM_WINDOW_BYTES) -> Iterator[List[Document]]:
+    """
+    Splits a large text file into chunks, one window at a time.
+
+    Each window is split by the text splitter like a whole file would be, and
+    the positions of its chunks are shifted to the file: start_index (in
+    characters), start_line and end_line (1-based), and start_byte.
+
+    Args:
+        stream (BinaryIO): The file, opened in binary mode.
+        source (str): The file path recorded as the chunks' source.
+        text_splitter: The splitter from document_loader.make_text_splitter.
+        window_bytes (int): The number of bytes read at a time.
+
+    Yields:
+        List[Document]: The chunks of each window, in file order.
+    """
+    for window in iter_text_windows(stream, window_bytes):
+        chunks = text_splitter.split_documents(
+            [Document(page_content=window.text, metadata={"source": source})])
+        # Byte and line positions are counted incrementally from the start of the window.
+        position, byte_offset, line_offset = 0, window.byte_offset, window.line_offset
+        for chunk in sorted(chunks, key=lambda chunk: chunk.metadata.get("start_index", 0)):
+            start = chunk.metadata.get("start_index", position)
+            if start > position:
+                byte_offset += len(window.text[position:start].encode("utf-8"))
+                line_offset += window.text.count("\n", position, start)
+                position = start
+            metadata = chunk.metadata
+            metadata["start_index"] = window.char_offset + start
+            metadata["start_byte"] = byte_offset
+            if "start_line" in metadata:
+                metadata["start_line"] += window.line_offset
+                metadata["end_line"] += window.line_offset
+            else:
+                metadata["start_line"] = line_offset + 1
+                metadata["end_line"] = line_offset + 1 + chunk.page_content.rstrip().count("\n")
+        if chunks:
+            yield chunks
@@ -0,0 +1,91 @@
+# This script turns the LangChain callbacks of the RAG chain into tracing spans
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .tracing import Tracer
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Records the stages of each question answered by the RAG chain.
+
+    Spans: "query" (the whole chain), "retrieve", "prompt_build", "llm",
+    "llm_first_token" (LLM start to first streamed token) and "llm_stream"
+    (first token to the end of the answer). Counters: queries, retrieved
+    chunks and streamed LLM tokens.
+    """
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+        # run id -> [span name, start timestamp, start perf counter, first token perf counter]
+        self._runs: Dict[UUID, list] = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id: UUID, name: str) -> None:
+        with self._lock:
+            self._runs[run_id] = [name, time.time(), time.perf_counter(), None]
+
+    def _end(self, run_id: UUID, **attributes) -> Optional[list]:
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return None
+        name, start, started, _ = run
+        self.tracer.add_span(name, start, time.perf_counter() - started, **attributes)
+        return run
+
+    def on_chain_start(self, serialized: Optional[Dict[str, Any]], inputs: Any, *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        if parent_run_id is None:
+            self.tracer.count("queries")
+            self._start(run_id, "query")
+        elif kwargs.get("name") == "PromptTemplate":
+            self._start(run_id, "prompt_build")
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error=type(error).__name__)
+
+    def on_retriever_start(self, serialized: Optional[Dict[str, Any]], query: str, *,
+                           run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, "retrieve")
+
+    def on_retriever_end(self, documents: List[Any], *, run_id: UUID, **kwargs: Any) -> None:
+        self.tracer.count("retrieved_chunks", len(documents))
+        self._end(run_id, chunks=len(documents))
+
+    def on_retriever_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error=type(error).__name__)
+
+    def on_chat_model_start(self, serialized: Optional[Dict[str, Any]], messages: Any, *,
+                            run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, "llm")
+
+    def on_llm_start(self, serialized: Optional[Dict[str, Any]], prompts: List[str], *,
+                     run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, "llm")
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        self.tracer.count("llm_tokens")
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None or run[3] is not None:
+                return
+            run[3] = time.perf_counter()
+        self.tracer.add_span("llm_first_token", run[1], run[3] - run[2])
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._end(run_id)
+        if run is not None and run[3] is not None:
+            _, start, started, first_token = run
+            self.tracer.add_span("llm_stream", start + (first_token - started),
+                                 time.perf_counter() - first_token)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error=type(error).__name__)
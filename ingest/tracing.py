@@ -0,0 +1,268 @@
+# This script records timing spans and counters of the ingest and query pipelines
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from . import config
+from .logger import logger
+
+# Only the most recent spans are kept, so a long-running app does not grow without bound.
+_MAX_SPANS = 100_000
+
+
+class _NoopSpan:
+    """
+    The span returned when tracing is disabled, shared so disabled spans cost one call.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attributes) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    """
+    A timed section of code, recorded on the tracer when the with block exits.
+    """
+
+    __slots__ = ("tracer", "name", "attributes", "start", "_started")
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer.add_span(self.name, self.start,
+                             time.perf_counter() - self._started, **self.attributes)
+        return False
+
+    def set(self, **attributes) -> None:
+        """
+        Adds attributes known only once the span is running, e.g. a number of chunks.
+        """
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    """
+    Collects timing spans and counters.
+
+    Spans can be exported as a JSON trace (the Chrome trace event format, viewable
+    in chrome://tracing or Perfetto), and span totals and counters as Prometheus
+    text. When disabled, span() returns a shared no-op object and count() returns
+    immediately, so instrumented code pays almost nothing.
+    """
+
+    def __init__(self, enabled: bool, max_spans: int = _MAX_SPANS):
+        """
+        Args:
+            enabled (bool): Whether spans and counters are recorded.
+            max_spans (int): Number of most recent spans kept for the JSON trace.
+        """
+        self.enabled = enabled
+        self._spans = deque(maxlen=max_spans)
+        # name -> [count, total seconds]
+        self._span_totals = {}
+        # (name, sorted label items) -> value
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def span(self, name: str, **attributes):
+        """
+        Returns a context manager timing the code it wraps.
+
+        Args:
+            name (str): The stage name, e.g. "embed" or "retrieve".
+            **attributes: Details stored with the span in the JSON trace.
+        """
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, name, attributes)
+
+    def add_span(self, name: str, start: float, duration: float, pid: Optional[int] = None,
+                 **attributes) -> None:
+        """
+        Records a span measured elsewhere, e.g. in a worker process or by a callback.
+
+        Args:
+            name (str): The stage name.
+            start (float): The start time as a Unix timestamp.
+            duration (float): The duration in seconds.
+            pid (Optional[int]): The process that ran the span, this one by default.
+            **attributes: Details stored with the span in the JSON trace.
+        """
+        if not self.enabled:
+            return
+        span = {
+            "name": name,
+            "start": start,
+            "duration": duration,
+            "pid": pid or os.getpid(),
+            # Spans of worker processes are all shown on one row per worker.
+            "tid": threading.get_ident() if pid is None else 0,
+            "attributes": attributes,
+        }
+        with self._lock:
+            self._spans.append(span)
+            totals = self._span_totals.setdefault(name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += duration
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        """
+        Increments a counter, e.g. count("chunks", 12) or count("answer_cache", result="miss").
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self) -> dict:
+        """
+        Returns the span totals and counters recorded so far.
+        """
+        with self._lock:
+            return {
+                "spans": {name: {"count": count, "seconds": seconds}
+                          for name, (count, seconds) in self._span_totals.items()},
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in self._counters.items()],
+            }
+
+    def export_json(self, path: str) -> None:
+        """
+        Writes the recorded spans and counters as a Chrome trace event JSON file.
+        """
+        with self._lock:
+            spans = list(self._spans)
+        events = [{
+            "name": span["name"],
+            "ph": "X",
+            "ts": span["start"] * 1e6,
+            "dur": span["duration"] * 1e6,
+            "pid": span["pid"],
+            "tid": span["tid"],
+            "args": span["attributes"],
+        } for span in spans]
+        trace = {"traceEvents": events, "displayTimeUnit": "ms", "metrics": self.snapshot()}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(trace, f, default=str)
+
+    def prometheus_text(self) -> str:
+        """
+        Renders the span totals and counters in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP devmentor_span_seconds Time spent in each pipeline stage.",
+            "# TYPE devmentor_span_seconds summary",
+        ]
+        for name, totals in sorted(snapshot["spans"].items()):
+            labels = _format_labels({"stage": name})
+            lines.append(f"devmentor_span_seconds_sum{labels} {totals['seconds']:.6f}")
+            lines.append(f"devmentor_span_seconds_count{labels} {totals['count']}")
+
+        by_name = {}
+        for counter in snapshot["counters"]:
+            by_name.setdefault(_metric_name(counter["name"]), []).append(counter)
+        for metric, counters in sorted(by_name.items()):
+            lines.append(f"# TYPE devmentor_{metric}_total counter")
+            for counter in counters:
+                lines.append(
+                    f"devmentor_{metric}_total{_format_labels(counter['labels'])} {counter['value']}")
+        return "\n".join(lines) + "\n"
+
+    def start_metrics_server(self, port: int) -> None:
+        """
+        Serves prometheus_text() on http://0.0.0.0:<port>/metrics from a background thread.
+        Calling it again (e.g. on a Streamlit rerun) does nothing.
+        """
+        if not self.enabled or self._server is not None:
+            return
+        # Only the query side serves metrics, so the HTTP server is imported on demand.
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = tracer.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        with self._lock:
+            if self._server is not None:
+                return
+            try:
+                self._server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+            except OSError as e:
+                logger.warning(f"Could not start the metrics endpoint on port {port}: {e}")
+                return
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logger.info(f"Metrics endpoint listening on port {port} (/metrics).")
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _format_labels(labels: Dict[str, object]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in sorted(labels.items()):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{_metric_name(key)}="{escaped}"')
+    return "{" + ",".join(parts) + "}"
+
+
+# The tracer shared by the whole process.
+tracer = Tracer(config.TRACING_ENABLED)
+
+
+def _export_at_exit() -> None:
+    if not tracer.snapshot()["spans"]:
+        return
+    path = os.path.join(
+        config.TRACE_DIR, f"trace-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.json")
+    tracer.export_json(path)
+    logger.info(f"Trace written to {path}")
+
+
+if tracer.enabled:
+    atexit.register(_export_at_exit)
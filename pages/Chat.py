@@ -1,7 +1,8 @@
 import streamlit as st
-import time
 import os
-from ingest.chain_setup import load_rag_chain
+from ingest import config
+from ingest.chain_setup import load_federated_chain, load_rag_chain
+from ingest.stream_renderer import StreamRenderer
 
 
 def get_available_github_repos():
@@ -40,11 +41,24 @@ if not github_repos:
     )
     st.stop()
 
-# Create the dropdown menu for the user to select a knowledge base.
-selected_repo = st.selectbox(
-    "Select a Knowledge Base to Chat With:",
-    options=github_repos
-)
+# Let the user search one knowledge base, or several at once.
+multi_repo = st.toggle("Search across multiple knowledge bases", value=False)
+if multi_repo:
+    selected_repos = st.multiselect(
+        "Select the Knowledge Bases to Chat With:",
+        options=github_repos,
+        default=github_repos
+    )
+    if not selected_repos:
+        st.info("Select at least one knowledge base.")
+        st.stop()
+    selected_repo = ", ".join(sorted(selected_repos))
+else:
+    # Create the dropdown menu for the user to select a knowledge base.
+    selected_repo = st.selectbox(
+        "Select a Knowledge Base to Chat With:",
+        options=github_repos
+    )
 
 # Block for change detection and history reset
 if st.session_state.active_repo != selected_repo:
@@ -55,7 +69,10 @@ if st.session_state.active_repo != selected_repo:
     
 # Load the RAG chain once and cache it for performance using a spinner for user feedback.
 with st.spinner("Loading AI model and vector store..."):
-    rag_chain = load_rag_chain(selected_repo)
+    if multi_repo:
+        rag_chain = load_federated_chain(tuple(sorted(selected_repos)))
+    else:
+        rag_chain = load_rag_chain(selected_repo)
 
 # Handle the case where the vector store might be missing or corrupted.
 if not rag_chain:
@@ -65,10 +82,37 @@ if not rag_chain:
     )
     st.stop()
 
+# Show how often questions are answered from the answer cache.
+if hasattr(rag_chain, "stats"):
+    cache_stats = rag_chain.stats()
+    st.sidebar.caption(
+        f"Answer cache: {cache_stats['hit_rate']:.0%} hit rate "
+        f"({cache_stats['exact_hits'] + cache_stats['semantic_hits']} hits, "
+        f"{cache_stats['misses']} misses)"
+    )
+
+# The typewriter effect is cosmetic: answers are shown as fast as they stream without it.
+typewriter = st.sidebar.toggle("Typewriter effect", value=config.TYPEWRITER_ENABLED)
+
+
+def show_timings(timings):
+    """
+    Shows how long an answer took to start and to be displayed.
+    """
+    if timings["first_token_seconds"] is None:
+        return
+    st.caption(
+        f"First token after {timings['first_token_seconds']:.2f}s, "
+        f"displayed in {timings['total_seconds']:.2f}s ({timings['frames']} frames)"
+    )
+
+
 # Display the past messages from the chat history on each script rerun.
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
+        if "timings" in message:
+            show_timings(message["timings"])
 
 # Handle new user input from the chat box at the bottom of the screen.
 if prompt := st.chat_input("Ask a question about the codebase..."):
@@ -78,18 +122,17 @@ if prompt := st.chat_input("Ask a question about the codebase..."):
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    # Stream the assistant's response to create a smooth, character-by-character typing effect.
+    # Stream the assistant's response, redrawn at a bounded frame rate rather than per chunk.
     with st.chat_message("assistant"):
         placeholder = st.empty()
-        full_response = ""
+        renderer = StreamRenderer(placeholder.markdown, typewriter=typewriter)
         for chunk in rag_chain.stream(prompt):
-            for char in chunk:
-                full_response += char
-                placeholder.markdown(full_response + "▌")
-                time.sleep(0.005)
+            renderer.feed(chunk)
         # After the stream is complete, display the final response without the cursor.
-        placeholder.markdown(full_response)
+        timings = renderer.finish()
+        full_response = renderer.text
+        show_timings(timings)
 
     # Add the final, complete assistant's response to the chat history.
     st.session_state.messages.append(
-        {"role": "assistant", "content": full_response})
+        {"role": "assistant", "content": full_response, "timings": timings})
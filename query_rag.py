@@ -1,7 +1,45 @@
 # This script can be used as CLI and also used for debugging
 from ingest.logger import logger
-from ingest.chain_setup import load_rag_chain
+from ingest import config
 import argparse
+import asyncio
+import os
+import sys
+
+
+def _print_missing_store():
+    print("\n--- ERROR ---")
+    print("The Vector Store was not found.")
+    print("Please run the data ingestion script first to create it.")
+    print("\nExample Command:")
+    print("python -m ingest.create_vectorstore --url https://github.com/some/repo")
+    print("-------------")
+
+
+def run_batch_mode(args):
+    """
+    Answers every question of a JSONL file and writes the answers and their sources to another one.
+    """
+    from ingest.batch_query import read_questions, run_batch
+    from ingest.chain_setup import create_llm, load_search_indexes, load_vector_store
+    from ingest.embedding_generator import get_embedding_model
+
+    store_path = os.path.join("data/vector_stores", args.repo)
+    vector_store = load_vector_store(store_path, get_embedding_model())
+    if vector_store is None:
+        _print_missing_store()
+        sys.exit(1)
+    symbol_index, history_store = load_search_indexes(store_path, get_embedding_model())
+
+    with open(args.batch, "r", encoding="utf-8") as f:
+        records = read_questions(f)
+    logger.info(f"Answering {len(records)} questions with up to {args.concurrency} concurrent LLM calls...")
+    with open(args.output, "w", encoding="utf-8") as f:
+        summary = asyncio.run(run_batch(
+            vector_store, create_llm(), records, f, args.k, args.concurrency,
+            symbol_index, history_store))
+    print(f"{summary['answered']} answered, {summary['failed']} failed in "
+          f"{summary['seconds']:.1f}s. Results written to {args.output}")
 
 
 def main():
@@ -10,15 +48,24 @@ def main():
     """
     parser = argparse.ArgumentParser()
     parser.add_argument("--repo", type=str, help="Path to desired repository", required=True)
+    parser.add_argument("--batch", type=str,
+                        help="Answer the questions of this JSONL file instead of asking interactively")
+    parser.add_argument("--output", type=str, default="answers.jsonl",
+                        help="JSONL file receiving the batch answers")
+    parser.add_argument("--concurrency", type=int, default=config.BATCH_CONCURRENCY,
+                        help="Maximum number of concurrent LLM calls in batch mode")
+    parser.add_argument("--k", type=int, default=5, help="Number of chunks retrieved per question")
     args = parser.parse_args()
+
+    if args.batch:
+        run_batch_mode(args)
+        return
+
+    # Imported after parsing the arguments, so usage errors are reported instantly.
+    from ingest.chain_setup import load_rag_chain
     rag_chain = load_rag_chain(args.repo)
     if not rag_chain:
-        print("\n--- ERROR ---")
-        print("The Vector Store was not found.")
-        print("Please run the data ingestion script first to create it.")
-        print("\nExample Command:")
-        print("python -m ingest.create_vectorstore --url https://github.com/some/repo")
-        print("-------------")
+        _print_missing_store()
         return
     print("\n--- DevMentor AI Assistant ---")
     print("Ask questions about the codebase. Type 'quit' or 'exit' to end the session.")
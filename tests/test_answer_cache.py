@@ -0,0 +1,126 @@
+# This script checks that the answer cache embeds each question at most once and coalesces identical questions
+import asyncio
+import threading
+
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from benchmarks.fakes import FakeEmbeddings
+from ingest.answer_cache import AnswerCache, CachedRagChain, CoalescedRequestFailed
+
+
+def _cache(tmp_path, embeddings, exact_only=None):
+    return AnswerCache(str(tmp_path / "answers.sqlite3"), version="v1", embeddings=embeddings,
+                       similarity_threshold=0.85, max_entries=100, ttl_seconds=3600,
+                       exact_only=exact_only)
+
+
+def test_a_miss_embeds_the_question_once(tmp_path):
+    embeddings = FakeEmbeddings()
+    chain = CachedRagChain(RunnableLambda(lambda question: f"answer to {question}"), _cache(tmp_path, embeddings))
+    assert chain.invoke("How are chunks embedded?") == "answer to How are chunks embedded?"
+    assert embeddings.texts_embedded == 1
+
+    # With entries to compare against, lookup embeds the question and store reuses its vector.
+    assert chain.invoke("Where is the vector store saved?") == "answer to Where is the vector store saved?"
+    assert embeddings.texts_embedded == 2
+
+
+def test_hits(tmp_path):
+    embeddings = FakeEmbeddings()
+    cache = _cache(tmp_path, embeddings)
+    cache.store("How are chunks embedded?", "In batches.")
+    assert cache.lookup("how are chunks embedded") == ("In batches.", None)
+    answer, vector = cache.lookup("How are the chunks embedded?")
+    assert answer == "In batches." and vector is not None
+    assert cache.stats()["exact_hits"] == 1 and cache.stats()["semantic_hits"] == 1
+
+
+def test_exact_only_questions_are_never_embedded(tmp_path):
+    embeddings = FakeEmbeddings()
+    chain = CachedRagChain(RunnableLambda(lambda question: "answer"),
+                           _cache(tmp_path, embeddings, exact_only=lambda question: "`" in question))
+    chain.invoke("How are chunks embedded?")
+    embedded = embeddings.texts_embedded
+    chain.invoke("Where is `load_documents` defined?")
+    chain.invoke("Where is `load_documents` defined?")
+    assert embeddings.texts_embedded == embedded
+
+
+class _Chain:
+    # A chain streaming an answer in words, counting its calls, optionally failing after the first word.
+    def __init__(self, fail_after_first=False):
+        self.calls = 0
+        self.fail_after_first = fail_after_first
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def stream(self, question, config=None, **kwargs):
+        self.calls += 1
+        yield "first "
+        self.started.set()
+        self.release.wait(5)
+        if self.fail_after_first:
+            raise ValueError("LLM error")
+        yield "second"
+
+    async def astream(self, question, config=None, **kwargs):
+        for chunk in self.stream(question, config, **kwargs):
+            yield chunk
+
+
+def test_a_caller_missing_the_cache_just_before_the_store_is_not_a_new_leader(tmp_path):
+    chain = _Chain()
+    chain.release.set()
+    cached_chain = CachedRagChain(chain, _cache(tmp_path, FakeEmbeddings()))
+    assert cached_chain.invoke("What is this?") == "first second"
+    # The lookup ran before the leader stored its answer, _join must find it.
+    cached_chain.cache.lookup = lambda question: (None, None)
+    assert cached_chain.invoke("What is this?") == "first second"
+    assert chain.calls == 1
+
+
+def test_a_follower_never_repeats_what_it_already_streamed(tmp_path):
+    chain = _Chain(fail_after_first=True)
+    cached_chain = CachedRagChain(chain, _cache(tmp_path, FakeEmbeddings()))
+    leader_error = []
+
+    def lead():
+        try:
+            cached_chain.invoke("What is this?")
+        except ValueError as e:
+            leader_error.append(e)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    assert chain.started.wait(5)
+    follower = cached_chain.stream("What is this?")
+    assert next(follower) == "first "
+    chain.release.set()
+    with pytest.raises(CoalescedRequestFailed):
+        list(follower)
+    leader.join()
+    assert leader_error and chain.calls == 1
+
+
+def test_a_follower_with_nothing_streamed_answers_on_its_own(tmp_path):
+    chain = _Chain()
+    chain.release.set()
+    cached_chain = CachedRagChain(chain, _cache(tmp_path, FakeEmbeddings()))
+    # A leader that fails before streaming anything.
+    key, entry, leader, _ = cached_chain._join("What is this?")
+    assert leader
+
+    async def run():
+        follower = asyncio.create_task(_collect(cached_chain.astream("What is this?")))
+        while not entry.listeners:
+            await asyncio.sleep(0.01)
+        cached_chain._finish(key, entry, failed=True)
+        return await follower
+
+    assert asyncio.run(run()) == "first second"
+    assert chain.calls == 1
+
+
+async def _collect(stream):
+    return "".join([chunk async for chunk in stream])
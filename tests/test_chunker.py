@@ -0,0 +1,83 @@
+# This script checks that structure-aware chunks stay within the token budget and tile their document
+import re
+
+import pytest
+from langchain_core.documents import Document
+
+from ingest.chunker import StructureAwareChunker
+
+_BUDGET = 60
+_TOKEN_RE = re.compile(r"[A-Za-z0-9_]+|[^\sA-Za-z0-9_]")
+
+
+class _DenseTokenCounter:
+    # Words and punctuation are one token each, and other characters (CJK) three: far denser
+    # than the average the chunker assumes when it cuts a long line.
+    exact = True
+
+    def count(self, texts):
+        return [sum(3 if not token.isascii() else 1 for token in _TOKEN_RE.findall(text)) for text in texts]
+
+
+def _python():
+    functions = [f"def function_{number}(argument):\n    \"\"\"Doc {number}.\"\"\"\n"
+                 + "".join(f"    value_{line} = argument * {line}\n" for line in range(number % 7 + 1))
+                 + "    return argument\n" for number in range(30)]
+    body = "".join(f"    def method_{number}(self):\n        return {number}\n\n" for number in range(40))
+    return "import os\n\n\n" + "\n\n".join(functions) + "\n\nclass Big:\n" + body
+
+
+def _markdown():
+    sections = [f"## Section {number}\n\n" + "Some prose about the section. " * (number % 5 + 2) + "\n"
+                for number in range(25)]
+    return "# Title\n\n" + "\n".join(sections) + "\n" + "A paragraph without headings. " * 80
+
+
+def _notebook():
+    cells = [f"'code' cell: '['print({number})', 'x = {number} * 2']'\n\n"
+             f"'markdown' cell: '['# Step {number}', 'Explains step {number} in a few words.']'"
+             for number in range(30)]
+    return "\n\n".join(cells)
+
+
+def _minified():
+    # One line mixing sparse and dense text, so proportional cuts land over the budget.
+    return ";".join(f"var a{number}=b({number})" for number in range(300)) + "结构化分块" * 400
+
+
+@pytest.mark.parametrize("source, text", [
+    ("module.py", _python()),
+    ("README.md", _markdown()),
+    ("analysis.ipynb", _notebook()),
+    ("bundle.min.js", _minified()),
+    ("notes.txt", "word " * 2000),
+], ids=["python", "markdown", "notebook", "long-line", "text"])
+def test_chunks_fit_the_budget_and_tile_the_document(source, text):
+    counter = _DenseTokenCounter()
+    chunker = StructureAwareChunker(token_budget=_BUDGET, token_counter=counter)
+    chunks = chunker.split_documents([Document(page_content=text, metadata={"source": source})])
+
+    assert len(chunks) > 1
+    assert max(counter.count([chunk.page_content for chunk in chunks])) <= _BUDGET
+    # Chunks follow each other without overlap, only blank stretches are left out.
+    position = 0
+    for chunk in chunks:
+        start = chunk.metadata["start_index"]
+        assert start >= position and not text[position:start].strip()
+        assert text[start:start + len(chunk.page_content)] == chunk.page_content
+        assert chunk.metadata["source"] == source
+        first_line = text.count("\n", 0, start + len(chunk.page_content) - len(chunk.page_content.lstrip())) + 1
+        assert chunk.metadata["start_line"] == first_line
+        assert chunk.metadata["end_line"] >= chunk.metadata["start_line"]
+        position = start + len(chunk.page_content)
+    assert not text[position:].strip()
+
+
+def test_python_definitions_are_not_cut_when_they_fit():
+    chunker = StructureAwareChunker(token_budget=_BUDGET, token_counter=_DenseTokenCounter())
+    chunks = chunker.split_documents([Document(page_content=_python(), metadata={"source": "module.py"})])
+    for chunk in chunks:
+        content = chunk.page_content.strip()
+        if content.startswith("def function_"):
+            # Every function fits the budget, so a chunk starting one also ends one.
+            assert content.endswith("return argument")
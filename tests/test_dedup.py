@@ -0,0 +1,93 @@
+# This script checks exact and near-duplicate detection of files and chunks, and source bookkeeping
+import random
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from benchmarks.fakes import FakeEmbeddings
+from ingest.dedup import Deduplicator, MinHashIndex, remove_sources
+
+_WORDS = [f"word{number}" for number in range(500)]
+
+
+def _text(seed, length=200):
+    return " ".join(random.Random(seed).choices(_WORDS, k=length))
+
+
+def _replace_words(text, positions):
+    words = text.split()
+    for position in positions:
+        words[position] = "changed"
+    return " ".join(words)
+
+
+def _chunk(text, source):
+    return Document(page_content=text, metadata={"source": source})
+
+
+def test_identical_files_are_loaded_once(tmp_path):
+    contents = {"a.py": "x = 1\n", "b.py": "y = 2\n", "copy_of_a.py": "x = 1\n", "indexed_copy.py": "z = 3\n"}
+    for name, content in contents.items():
+        (tmp_path / name).write_text(content)
+    files = [str(tmp_path / name) for name in contents]
+    indexed_files = {"z.py": {"hash": "c1"}}
+    new_hashes = {"indexed_copy.py": "c1"}
+
+    deduplicator = Deduplicator(near_duplicates=False)
+    to_load, copies, indexed_copies = deduplicator.plan_files(files, str(tmp_path), new_hashes, indexed_files)
+    assert to_load == [str(tmp_path / "a.py"), str(tmp_path / "b.py")]
+    assert copies == {str(tmp_path / "a.py"): [str(tmp_path / "copy_of_a.py")]}
+    assert indexed_copies == {str(tmp_path / "indexed_copy.py"): "z.py"}
+    assert deduplicator.duplicate_files == 2 and set(new_hashes) == set(contents)
+
+
+def test_reindented_chunks_are_exact_duplicates():
+    deduplicator = Deduplicator(near_duplicates=False)
+    ids, new = deduplicator.assign([_chunk("def f():\n    return 1", "a.py")], ["a.py::0"])
+    assert ids == ["a.py::0"] and len(new) == 1
+    ids, new = deduplicator.assign([_chunk("def f():\n\treturn 1\n", "b.py")], ["b.py::0"])
+    assert ids == ["a.py::0"] and new == []
+    assert deduplicator.duplicate_chunks == 1 and deduplicator.near_duplicate_chunks == 0
+
+
+def test_near_duplicates_over_and_under_the_threshold():
+    index = MinHashIndex(threshold=0.8)
+    original = _text(0)
+    index.add("original", index.signature(original))
+
+    # One word changed touches 5 of ~200 shingles: Jaccard similarity ~0.95.
+    assert index.query(index.signature(_replace_words(original, [100]))) == "original"
+    # Twelve spread changes touch ~60 shingles: Jaccard similarity ~0.55.
+    assert index.query(index.signature(_replace_words(original, range(5, 200, 16)))) is None
+    assert index.query(index.signature(_text(1))) is None
+    # Texts shorter than a shingle are never compared.
+    assert index.signature("too short") is None
+
+
+def test_near_duplicate_chunks_share_the_first_id():
+    deduplicator = Deduplicator(near_duplicates=True, threshold=0.8)
+    original = _text(0)
+    deduplicator.assign([_chunk(original, "a.py")], ["a.py::0"])
+    ids, new = deduplicator.assign([_chunk(_replace_words(original, [100]), "b.py")], ["b.py::0"])
+    assert ids == ["a.py::0"] and new == []
+    assert deduplicator.near_duplicate_chunks == 1
+
+
+def test_removing_the_representative_source_promotes_the_next_one(tmp_path):
+    repo = str(tmp_path)
+    sources = [str(tmp_path / name) for name in ("a.py", "b.py", "c.py")]
+    deduplicator = Deduplicator(near_duplicates=False)
+    _, new = deduplicator.assign([_chunk("shared = True", sources[0])], ["a.py::0"])
+    for source in sources[1:]:
+        deduplicator.assign([_chunk("shared = True", source)], [f"{source}::0"])
+    store = FAISS.from_documents([chunk for chunk, _ in new], FakeEmbeddings(), ids=[chunk_id for _, chunk_id in new])
+    deduplicator.apply_sources(store)
+    doc = store.docstore.search("a.py::0")
+    assert doc.metadata["sources"] == sources
+
+    # a.py was the chunk's representative source.
+    remove_sources(store, ["a.py::0"], "a.py", repo)
+    assert doc.metadata["source"] == sources[1] and doc.metadata["sources"] == sources[1:]
+    # Removing a source that is not the representative keeps it.
+    remove_sources(store, ["a.py::0"], "c.py", repo)
+    assert doc.metadata["source"] == sources[1] and doc.metadata["sources"] == [sources[1]]
@@ -0,0 +1,37 @@
+# This script checks that a file crashing its loader process is skipped while the other files still load
+import multiprocessing
+import os
+
+import pytest
+
+from ingest import document_loader
+from ingest.document_loader import load_document_parts
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork",
+                    reason="the workers must inherit the patched loader")
+def test_a_file_crashing_its_worker_is_skipped_alone(tmp_path, monkeypatch):
+    load_file_documents = document_loader.load_file_documents
+
+    def crash_on_some_files(file_path, *args, **kwargs):
+        # Like a segfault in a native parser: the worker process dies without raising.
+        if "crash" in os.path.basename(file_path):
+            os._exit(1)
+        return load_file_documents(file_path, *args, **kwargs)
+
+    monkeypatch.setattr(document_loader, "load_file_documents", crash_on_some_files)
+    names = [f"module{number}.py" for number in range(12)]
+    names[3], names[8] = "crash_a.py", "crash_b.py"
+    paths = []
+    for name in names:
+        (tmp_path / name).write_text(f"def {name[:-3]}():\n    return '{name}'\n")
+        paths.append(str(tmp_path / name))
+
+    results = list(load_document_parts(paths, workers=2))
+    assert [file_path for file_path, _, _ in results] == paths
+    assert all(last for _, _, last in results)
+    for file_path, chunks, _ in results:
+        if "crash" in os.path.basename(file_path):
+            assert chunks == []
+        else:
+            assert chunks and os.path.basename(file_path) in chunks[0].page_content
@@ -0,0 +1,60 @@
+# This script checks the on-disk embedding cache: keys, verification before the first lookup, and eviction
+from benchmarks.fakes import FakeEmbeddings
+from ingest.embedding_cache import CachedEmbeddings
+
+
+class _CheckedEmbeddings(FakeEmbeddings):
+    # Mimics CPUEmbeddingEngine: int8 is rejected by its check on the first documents.
+    def __init__(self):
+        super().__init__()
+        self.backend = "int8"
+        self.verified_on = None
+
+    @property
+    def cache_key(self):
+        return "model" if self.backend == "torch" else f"model@{self.backend}"
+
+    def verify(self, texts=()):
+        if self.verified_on is None:
+            self.verified_on = list(texts)
+            self.backend = "torch"
+
+
+def _models(cache):
+    return [model for (model,) in cache._conn.execute("SELECT DISTINCT model FROM embeddings")]
+
+
+def test_vectors_are_cached_under_the_verified_backend(tmp_path):
+    embeddings = _CheckedEmbeddings()
+    cache = CachedEmbeddings(embeddings, model_name=embeddings.cache_key,
+                             cache_path=str(tmp_path / "cache.sqlite3"), max_entries=100)
+    cache.embed_documents(["def f(): pass", "class A: pass"])
+    assert embeddings.verified_on == ["def f(): pass", "class A: pass"]
+    assert _models(cache) == ["model"]
+
+
+def test_repeated_texts_are_read_back(tmp_path):
+    embeddings = FakeEmbeddings()
+    cache = CachedEmbeddings(embeddings, model_name="model", cache_path=str(tmp_path / "cache.sqlite3"),
+                             max_entries=100)
+    first = cache.embed_documents(["a b", "c d", "a b"])
+    assert embeddings.texts_embedded == 2
+    assert cache.embed_documents(["c d", "a b"]) == [first[1], first[0]]
+    assert embeddings.texts_embedded == 2 and cache.hits == 3
+
+
+def test_eviction_counts_the_entries_of_every_process(tmp_path):
+    # Two caches on one file, as two ingestion processes would open it.
+    path = str(tmp_path / "cache.sqlite3")
+    first = CachedEmbeddings(FakeEmbeddings(), model_name="model", cache_path=path, max_entries=4)
+    second = CachedEmbeddings(FakeEmbeddings(), model_name="model", cache_path=path, max_entries=4)
+    first.embed_documents(["one", "two", "three"])
+    second.embed_documents(["four", "five", "six"])
+    assert second.stats()["entries"] == 4
+    assert first._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] == 4
+
+    # The least recently used entries were evicted.
+    embeddings = FakeEmbeddings()
+    reader = CachedEmbeddings(embeddings, model_name="model", cache_path=path, max_entries=4)
+    reader.embed_documents(["three", "four", "five", "six"])
+    assert embeddings.texts_embedded == 0
@@ -0,0 +1,62 @@
+# This script checks that federated search loads stores in parallel and merges their hits by similarity
+import threading
+
+import numpy as np
+import pytest
+from langchain_community.vectorstores import FAISS
+
+from benchmarks.fakes import FakeEmbeddings
+from ingest.federated_search import FederatedRetriever, distance_to_similarity
+
+_REPOS = {
+    "loader": ["def load_documents(file_paths): return parse(file_paths)",
+               "def load_document_parts(path): yield from split(path)"],
+    "store": ["def save_vector_store(store, path): store.save_local(path)",
+              "def load_vector_store(path): return FAISS.load_local(path)",
+              "The vector store is saved under data/vector_stores."],
+}
+
+
+@pytest.fixture
+def stores():
+    embeddings = FakeEmbeddings()
+    return embeddings, {repo_name: FAISS.from_texts(texts, embeddings) for repo_name, texts in _REPOS.items()}
+
+
+def test_distance_to_similarity_is_the_cosine_of_normalized_vectors():
+    query, doc = np.array([0.6, 0.8]), np.array([1.0, 0.0])
+    distance = float(np.sum((query - doc) ** 2))
+    assert distance_to_similarity(distance, 1.0) == pytest.approx(0.6)
+
+
+def test_hits_of_all_stores_are_merged_by_similarity_and_tagged(stores):
+    embeddings, vector_stores = stores
+    retriever = FederatedRetriever(repo_names=["loader", "store", "missing"], k=3,
+                                   get_vector_store=vector_stores.get, embeddings=embeddings)
+    question = "How is the vector store loaded from its path?"
+    docs = retriever.invoke(question)
+
+    query_vector = np.array(embeddings.embed_query(question))
+    expected = sorted(((repo_name, text, float(np.dot(query_vector, embeddings.embed_query(text))))
+                       for repo_name, texts in _REPOS.items() for text in texts),
+                      key=lambda hit: hit[2], reverse=True)[:3]
+    assert [(doc.metadata["repo"], doc.page_content) for doc in docs] == [hit[:2] for hit in expected]
+    assert [doc.metadata["score"] for doc in docs] == pytest.approx([hit[2] for hit in expected], abs=1e-5)
+    assert {doc.metadata["repo"] for doc in docs} == {"loader", "store"}
+
+
+def test_stores_are_loaded_in_parallel_and_a_failing_load_is_skipped(stores):
+    embeddings, vector_stores = stores
+    # Both loads must be running at once to pass the barrier.
+    barrier = threading.Barrier(2, timeout=5)
+
+    def get_vector_store(repo_name):
+        if repo_name == "broken":
+            raise OSError("index.faiss is truncated")
+        barrier.wait()
+        return vector_stores[repo_name]
+
+    retriever = FederatedRetriever(repo_names=["loader", "broken", "store"], k=5,
+                                   get_vector_store=get_vector_store, embeddings=embeddings)
+    docs = retriever.invoke("load documents")
+    assert len(docs) == 5 and {doc.metadata["repo"] for doc in docs} == {"loader", "store"}
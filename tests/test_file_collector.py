@@ -0,0 +1,72 @@
+# This script checks the repository walk: gitignore rules, skipped files and binary sniffing
+import pytest
+
+from ingest.file_collector import scan_target_files, sniff_head
+
+_TREE = {
+    ".gitignore": "*.log\n!keep.log\nout/\ncache\n/root_only.py\n",
+    "main.py": "print('main')\n",
+    "debug.log": "ignored\n",
+    "keep.log": "negated, so kept\n",
+    "root_only.py": "anchored to the root\n",
+    "out/output.py": "in an ignored directory\n",
+    # A file named like a directory-only pattern is kept, a name-only pattern matches both.
+    "src/out": "a file, not a directory\n",
+    "src/cache": "ignored by name\n",
+    "src/root_only.py": "the anchored rule does not match here\n",
+    "src/.gitignore": "generated_*.py\n!generated_keep.py\n/local.txt\n",
+    "src/generated_models.py": "ignored by the nested .gitignore\n",
+    "src/generated_keep.py": "negated by the nested .gitignore\n",
+    "src/local.txt": "anchored to src\n",
+    "src/deep/local.txt": "not matched by the anchored nested rule\n",
+    "docs/generated_api.py": "the nested rules do not apply outside src\n",
+    "empty.py": "",
+}
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for rel_path, content in _TREE.items():
+        path = tmp_path / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+    (tmp_path / "logo.svg.txt").write_bytes(b"GIF89a\x01\x00\x00\x00")
+    (tmp_path / "latin1.txt").write_bytes("caf\xe9".encode("latin-1"))
+    (tmp_path / "report.pdf").write_bytes(b"%PDF-1.4\n")
+    (tmp_path / "fake.pdf").write_bytes(b"not a pdf\n")
+    return tmp_path
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_gitignore_rules_and_binaries(tree, workers):
+    entries = scan_target_files(str(tree), workers=workers)
+    assert [entry.rel_path for entry in entries] == [
+        ".gitignore", "docs/generated_api.py", "keep.log", "main.py", "report.pdf",
+        "src/.gitignore", "src/deep/local.txt", "src/generated_keep.py", "src/out", "src/root_only.py"]
+    assert {entry.rel_path: entry.file_type for entry in entries}["report.pdf"] == "pdf"
+
+
+def test_gitignore_can_be_disabled(tree):
+    rel_paths = {entry.rel_path for entry in scan_target_files(str(tree), workers=1, respect_gitignore=False)}
+    assert {"debug.log", "out/output.py", "src/generated_models.py"} <= rel_paths
+
+
+def test_info_exclude_applies_to_the_whole_tree(tree):
+    (tree / ".git" / "info").mkdir(parents=True)
+    (tree / ".git" / "info" / "exclude").write_text("*.py\n")
+    rel_paths = {entry.rel_path for entry in scan_target_files(str(tree), workers=1)}
+    assert "main.py" not in rel_paths and "docs/generated_api.py" not in rel_paths
+    # The .gitignore files are read after the exclude file, so their negations win.
+    assert "src/generated_keep.py" in rel_paths
+
+
+def test_sniff_head():
+    assert sniff_head(b"def f():\n", "module.py", complete=True) == "text"
+    assert sniff_head(b"text\0with a null byte", "data.txt", complete=True) is None
+    assert sniff_head(b"%PDF-1.7", "paper.pdf", complete=False) == "pdf"
+    assert sniff_head(b"PK\x03\x04", "notes.docx", complete=False) == "docx"
+    assert sniff_head(b"{\"cells\": []}", "analysis.ipynb", complete=True) == "notebook"
+    # A multi-byte character cut by the end of the sample is only an error in a complete file.
+    cut = "naïve".encode("utf-8")[:3]
+    assert sniff_head(cut, "notes.txt", complete=False) == "text"
+    assert sniff_head(cut, "notes.txt", complete=True) is None
@@ -0,0 +1,94 @@
+# This script checks cloning, in-place updates and checkout-free reading against a local bare repository
+import subprocess
+
+import pytest
+
+from ingest import config
+from ingest.git_source import GitBlob, GitObjectSource, clone_or_update, is_shallow
+
+
+def _git(cwd, *args):
+    return subprocess.run(["git", "-c", "user.name=Test", "-c", "user.email=test@example.com", *args],
+                          cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+@pytest.fixture
+def upstream(tmp_path):
+    # A bare "remote" and a work tree pushing commits to it.
+    remote = tmp_path / "upstream.git"
+    _git(tmp_path, "init", "--bare", "-b", "main", str(remote))
+    work = tmp_path / "work"
+    _git(tmp_path, "clone", str(remote), str(work))
+
+    def commit(name, content):
+        (work / name).write_text(content)
+        _git(work, "add", name)
+        _git(work, "commit", "-m", f"Add {name}")
+        _git(work, "push", "origin", "HEAD:main")
+        return _git(work, "rev-parse", "HEAD")
+
+    for number in range(3):
+        commit(f"module{number}.py", f"def f{number}():\n    return {number}\n")
+    return remote, commit
+
+
+def test_bare_clone_is_updated_in_place(upstream, tmp_path):
+    remote, commit = upstream
+    clone_path = str(tmp_path / "clone")
+    repo = clone_or_update(str(remote), clone_path, depth=1, bare=True)
+    assert repo.bare and is_shallow(repo)
+    assert _git(clone_path, "rev-list", "--count", "HEAD") == "1"
+
+    # A marker in the git directory survives, so the clone was not deleted and cloned again.
+    marker = tmp_path / "clone" / "marker"
+    marker.write_text("kept")
+    head = commit("module3.py", "def f3():\n    return 3\n")
+    repo = clone_or_update(str(remote), clone_path, depth=1, bare=True)
+    assert repo.head.commit.hexsha == head
+    assert marker.exists()
+
+    source = GitObjectSource(clone_path)
+    files = source.list_files()
+    assert sorted(files) == [f"module{number}.py" for number in range(4)]
+    contents = dict(source.iter_blobs((path, blob_id) for path, blob_id in files.items()))
+    assert contents["module3.py"] == b"def f3():\n    return 3\n"
+
+
+def test_shallow_clone_is_deepened_with_depth_zero(upstream, tmp_path):
+    remote, _ = upstream
+    clone_path = str(tmp_path / "clone")
+    clone_or_update(str(remote), clone_path, depth=1, bare=True)
+    repo = clone_or_update(str(remote), clone_path, depth=0, bare=True)
+    assert not is_shallow(repo)
+    assert _git(clone_path, "rev-list", "--count", "HEAD") == "3"
+
+
+def test_checkout_is_reset_to_the_new_commit(upstream, tmp_path):
+    remote, commit = upstream
+    clone_path = tmp_path / "clone"
+    clone_or_update(str(remote), str(clone_path), depth=1)
+    (clone_path / "module0.py").write_text("local edit\n")
+    (clone_path / "untracked.txt").write_text("left over\n")
+    head = commit("module3.py", "def f3():\n    return 3\n")
+
+    repo = clone_or_update(str(remote), str(clone_path), depth=1)
+    assert repo.head.commit.hexsha == head
+    assert (clone_path / "module0.py").read_text() == "def f0():\n    return 0\n"
+    assert (clone_path / "module3.py").exists() and not (clone_path / "untracked.txt").exists()
+
+
+def test_binary_blobs_are_handed_out_empty(upstream, tmp_path, monkeypatch):
+    remote, commit = upstream
+    commit("data.txt", "header\0" + "x" * 100)
+    commit("large.txt", "line of text\n" * 100)
+    commit("large_binary.txt", "\0" * 1300)
+    # Blobs above the threshold are streamed, their head is sniffed on its own.
+    monkeypatch.setattr(config, "STREAM_THRESHOLD_BYTES", 1000)
+    clone_path = str(tmp_path / "clone")
+    clone_or_update(str(remote), clone_path, depth=1, bare=True)
+
+    source = GitObjectSource(clone_path)
+    contents = dict(source.iter_blobs(source.list_files().items()))
+    assert contents["data.txt"] == b"" and contents["large_binary.txt"] == b""
+    assert isinstance(contents["large.txt"], GitBlob) and contents["large.txt"].read().startswith(b"line of text")
+    assert contents["module0.py"] == b"def f0():\n    return 0\n"
@@ -0,0 +1,138 @@
+# This script checks the ingestion job queue and scheduler against a temporary SQLite file and trivial subprocesses
+import subprocess
+import sys
+import time
+import types
+
+import pytest
+
+from ingest import config, jobs
+from ingest.jobs import CANCELLED, FAILED, QUEUED, RUNNING, SUCCEEDED, JobQueue, JobScheduler
+
+# What the "ingestion" of each URL does.
+_SCRIPTS = {
+    "https://github.com/org/works": "print('indexed')",
+    "https://github.com/org/fails": "raise ValueError('clone failed')",
+    "https://github.com/org/hangs": "import time; time.sleep(60)",
+}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"))
+
+
+@pytest.fixture
+def scheduler(queue, tmp_path, monkeypatch):
+    # Every job runs a one-line script instead of create_vectorstore, with the same Popen options.
+    def popen(command, **kwargs):
+        return subprocess.Popen([sys.executable, "-c", _SCRIPTS[command[command.index("--url") + 1]]], **kwargs)
+    monkeypatch.setattr(jobs, "subprocess", types.SimpleNamespace(Popen=popen, STDOUT=subprocess.STDOUT))
+    scheduler = JobScheduler(queue, max_running=2, log_dir=str(tmp_path / "logs"))
+    (tmp_path / "logs").mkdir()
+    yield scheduler
+    for process, log_file in scheduler._processes.values():
+        jobs._kill(process)
+        process.wait()
+        log_file.close()
+
+
+def _run_to_exit(scheduler):
+    # Launches the runnable jobs, waits for them to exit, and lets the scheduler record it.
+    scheduler._tick()
+    for process, _ in list(scheduler._processes.values()):
+        process.wait(30)
+    scheduler._tick()
+
+
+def test_submit_dedupes_on_the_active_url(queue):
+    job_id, created = queue.submit("https://github.com/Org/Repo.git")
+    assert created
+    assert queue.submit("https://github.com/org/repo/ ") == (job_id, False)
+    queue.update(job_id, status=SUCCEEDED)
+    new_id, created = queue.submit("https://github.com/org/repo")
+    assert created and new_id != job_id
+
+
+def test_claim_never_runs_two_jobs_of_one_repo(queue):
+    first, _ = queue.submit("https://github.com/alice/tools")
+    second, _ = queue.submit("https://github.com/bob/tools")
+    third, _ = queue.submit("https://github.com/bob/other")
+    assert queue.claim(max_running=3)["id"] == first
+    # bob/tools shares the clone and vector store folder of alice/tools.
+    assert queue.claim(max_running=3)["id"] == third
+    assert queue.claim(max_running=3) is None
+    queue.update(first, status=SUCCEEDED)
+    assert queue.claim(max_running=2)["id"] == second
+
+
+def test_claim_respects_max_running(queue):
+    for name in ("one", "two"):
+        queue.submit(f"https://github.com/org/{name}")
+    job = queue.claim(max_running=1)
+    assert job["status"] == RUNNING and job["attempts"] == 1
+    assert queue.claim(max_running=1) is None
+
+
+def test_failed_jobs_are_retried_with_backoff(queue, scheduler, monkeypatch):
+    monkeypatch.setattr(config, "JOB_RETRY_BACKOFF_SECONDS", 100.0)
+    job_id, _ = queue.submit("https://github.com/org/fails", max_attempts=3)
+    for attempt, delay in ((1, 100.0), (2, 200.0)):
+        started = time.time()
+        _run_to_exit(scheduler)
+        job = queue.get(job_id)
+        assert job["status"] == QUEUED and job["attempts"] == attempt
+        assert job["error"] == "ValueError: clone failed"
+        assert started + delay <= job["next_attempt_at"] <= time.time() + delay
+        # Not runnable before its backoff is over.
+        scheduler._tick()
+        assert not scheduler._processes
+        queue.update(job_id, next_attempt_at=time.time())
+
+    _run_to_exit(scheduler)
+    job = queue.get(job_id)
+    assert job["status"] == FAILED and job["attempts"] == 3 and job["finished_at"] is not None
+    assert "--- Attempt 3 of 3 ---" in jobs.read_log_tail(job["log_path"])
+
+
+def test_successful_job(queue, scheduler):
+    job_id, _ = queue.submit("https://github.com/org/works")
+    _run_to_exit(scheduler)
+    job = queue.get(job_id)
+    assert job["status"] == SUCCEEDED and job["error"] is None and job["pid"] is None
+    assert "indexed" in jobs.read_log_tail(job["log_path"])
+
+
+def test_stale_running_jobs_are_recovered(queue):
+    lost, _ = queue.submit("https://github.com/org/lost")
+    cancelled, _ = queue.submit("https://github.com/org/cancelled")
+    alive, _ = queue.submit("https://github.com/org/alive")
+    for _ in range(3):
+        queue.claim(max_running=3)
+    queue.cancel(cancelled)
+    for job_id in (lost, cancelled):
+        queue.update(job_id, heartbeat_at=time.time() - 60)
+
+    recovered = queue.recover_stale(stale_seconds=30)
+    assert sorted(job["id"] for job in recovered) == [lost, cancelled]
+    # The interrupted attempt is not counted.
+    assert queue.get(lost)["status"] == QUEUED and queue.get(lost)["attempts"] == 0
+    assert queue.get(cancelled)["status"] == CANCELLED
+    assert queue.get(alive)["status"] == RUNNING
+
+
+def test_cancellation(queue, scheduler):
+    queued, _ = queue.submit("https://github.com/org/works")
+    queue.cancel(queued)
+    assert queue.get(queued)["status"] == CANCELLED
+
+    running, _ = queue.submit("https://github.com/org/hangs")
+    scheduler._tick()
+    process, _ = scheduler._processes[running]
+    assert queue.get(running)["pid"] == process.pid
+    queue.cancel(running)
+    assert queue.get(running)["status"] == RUNNING and queue.get(running)["cancel_requested"]
+    scheduler._tick()
+    assert process.poll() is not None and running not in scheduler._processes
+    job = queue.get(running)
+    assert job["status"] == CANCELLED and job["error"] == "Cancelled by the user."
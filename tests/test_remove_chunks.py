@@ -0,0 +1,86 @@
+# This script checks that deleting and re-adding chunks keeps every index type consistent with its docstore
+import faiss
+import numpy as np
+import pytest
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from benchmarks.fakes import FakeEmbeddings
+from ingest.create_vectorstore import remove_chunks
+from ingest.index_factory import INDEX_TYPES, build_index, needs_training
+
+_DIMENSION = 32
+_PARAMS = {
+    "flat": {},
+    "hnsw": {"m": 16, "ef_construction": 40},
+    "ivf_flat": {"nlist": 4},
+    "ivf_pq": {"nlist": 4, "pq_m": 8, "pq_nbits": 4},
+}
+
+
+def _vectors(count, seed):
+    return np.random.default_rng(seed).normal(size=(count, _DIMENSION)).astype(np.float32)
+
+
+def _add(vector_store, vectors, ids):
+    vector_store.add_embeddings(zip(ids, vectors.tolist()), metadatas=[{"source": i} for i in ids], ids=ids)
+
+
+def _stored_vectors(vector_store, index_type):
+    # What the index holds under each chunk id (the decoded codes for IVF-PQ).
+    if needs_training(index_type):
+        faiss.extract_index_ivf(vector_store.index).make_direct_map()
+    stored = {chunk_id: vector_store.index.reconstruct(position)
+              for position, chunk_id in vector_store.index_to_docstore_id.items()}
+    if needs_training(index_type):
+        faiss.extract_index_ivf(vector_store.index).set_direct_map_type(faiss.DirectMap.NoMap)
+    return stored
+
+
+@pytest.mark.parametrize("index_type", INDEX_TYPES)
+def test_delete_then_add_keeps_ids_consistent(index_type):
+    vectors = _vectors(800, seed=0)
+    index, meta = build_index(index_type, _PARAMS[index_type], vectors)
+    assert meta["index_type"] == index_type
+    vector_store = FAISS(FakeEmbeddings(), index, InMemoryDocstore(), {})
+    ids = [f"chunk{i}" for i in range(len(vectors))]
+    _add(vector_store, vectors, ids)
+    expected = _stored_vectors(vector_store, index_type)
+
+    # A first incremental run deletes stale chunks and adds new ones...
+    deleted = set(ids[100:160]) | {ids[0], ids[799]}
+    remove_chunks(vector_store, sorted(deleted), meta)
+    new_ids = [f"new{i}" for i in range(50)]
+    _add(vector_store, _vectors(len(new_ids), seed=1), new_ids)
+    expected.update((chunk_id, vector) for chunk_id, vector in _stored_vectors(vector_store, index_type).items()
+                    if chunk_id in new_ids)
+    # ...and a second one deletes some of both.
+    deleted |= set(new_ids[:5]) | set(ids[200:210])
+    remove_chunks(vector_store, new_ids[:5] + ids[200:210], meta)
+
+    kept = [chunk_id for chunk_id in ids + new_ids if chunk_id not in deleted]
+    assert vector_store.index.ntotal == len(kept)
+    assert sorted(vector_store.index_to_docstore_id) == list(range(len(kept)))
+    assert set(vector_store.index_to_docstore_id.values()) == set(kept)
+    for chunk_id, vector in _stored_vectors(vector_store, index_type).items():
+        np.testing.assert_allclose(vector, expected[chunk_id], rtol=1e-5, atol=1e-5)
+        assert vector_store.docstore.search(chunk_id).metadata["source"] == chunk_id
+
+
+@pytest.mark.parametrize("index_type", ("flat", "ivf_flat"))
+def test_search_finds_chunks_added_after_a_delete(index_type):
+    vectors = _vectors(800, seed=2)
+    index, meta = build_index(index_type, _PARAMS[index_type], vectors)
+    vector_store = FAISS(FakeEmbeddings(), index, InMemoryDocstore(), {})
+    ids = [f"chunk{i}" for i in range(len(vectors))]
+    _add(vector_store, vectors, ids)
+    remove_chunks(vector_store, ids[:40], meta)
+    new_vectors = _vectors(40, seed=3)
+    new_ids = [f"new{i}" for i in range(len(new_vectors))]
+    _add(vector_store, new_vectors, new_ids)
+
+    if needs_training(index_type):
+        faiss.extract_index_ivf(vector_store.index).nprobe = _PARAMS[index_type]["nlist"]
+    for chunk_id, vector in zip(new_ids + ids[40:80], np.vstack([new_vectors, vectors[40:80]])):
+        document, _ = vector_store.similarity_search_with_score_by_vector(vector.tolist(), k=1)[0]
+        assert document.metadata["source"] == chunk_id
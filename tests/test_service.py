@@ -0,0 +1,102 @@
+# This script checks the query service end to end, offline, with fake embeddings and the stub LLM
+import asyncio
+import json
+
+from aiohttp.test_utils import TestClient, TestServer
+from langchain_community.vectorstores import FAISS
+
+from benchmarks.fakes import FakeEmbeddings
+from ingest import config
+from ingest.service import QueryService, create_app
+from ingest.stubs import FakeStreamingChatModel
+
+_CHUNKS = [
+    "def load_documents(file_paths, workers):\n    return list(load_document_parts(file_paths, workers))",
+    "def collect_target_files(repo_path):\n    return sorted(walk(repo_path))",
+    "The vector store is saved in data/vector_stores/<repo>.",
+]
+
+
+def _events(body: str):
+    # Parses a server-sent event stream into (event, data) pairs.
+    events = []
+    for message in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in message.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+async def _post_query(client, question):
+    response = await client.post("/query", json={"repo": "repo", "question": question, "k": 2})
+    assert response.status == 200
+    assert response.headers["Content-Type"].startswith("text/event-stream")
+    return _events(await response.text())
+
+
+def _query(service, question):
+    async def run():
+        async with TestClient(TestServer(create_app(service))) as client:
+            return await _post_query(client, question)
+    return asyncio.run(run())
+
+
+class _CountingChatModel(FakeStreamingChatModel):
+    # Records every LLM call in calls.
+    calls: list = []
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls.append(messages)
+        yield from super()._stream(messages, stop, run_manager, **kwargs)
+
+
+def _service(tmp_path, llm):
+    embeddings = FakeEmbeddings()
+    FAISS.from_texts(_CHUNKS, embeddings, metadatas=[{"source": f"file{i}.py"} for i in range(len(_CHUNKS))]
+                     ).save_local(str(tmp_path / "repo"))
+    return QueryService(embeddings=embeddings, llm=llm, store_dir=str(tmp_path))
+
+
+def test_query_streams_sources_tokens_then_done(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", True)
+    llm = FakeStreamingChatModel(time_to_first_token=0, seconds_per_token=0, answer_tokens=5)
+    service = _service(tmp_path, llm)
+
+    events = _query(service, "How are documents loaded?")
+    names = [name for name, _ in events]
+    assert names == ["sources"] + ["token"] * (len(names) - 2) + ["done"]
+    assert len(events[0][1]) == 2 and all("source" in chunk for chunk in events[0][1])
+    answer = "".join(data["text"] for name, data in events if name == "token")
+    assert len(answer.split()) == 5
+    assert events[-1][1]["cached"] is False
+
+    # The same question is answered from the cache, without sources.
+    events = _query(service, "How are documents loaded?")
+    assert [name for name, _ in events] == ["token", "done"]
+    assert events[0][1]["text"] == answer and events[1][1]["cached"] is True
+
+
+def test_identical_concurrent_queries_share_one_llm_call(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "ANSWER_CACHE_ENABLED", True)
+    llm = _CountingChatModel(time_to_first_token=0.3, seconds_per_token=0.01, answer_tokens=5, calls=[])
+    service = _service(tmp_path, llm)
+
+    async def run():
+        async with TestClient(TestServer(create_app(service))) as client:
+            return await asyncio.gather(*(_post_query(client, "How are documents loaded?") for _ in range(3)))
+
+    results = asyncio.run(run())
+    assert len(llm.calls) == 1
+    for events in results:
+        # Followers get the leader's sources and tokens, nothing is served twice.
+        assert [name for name, _ in events][0] == "sources" and events[-1][0] == "done"
+        assert events[:-1] == results[0][:-1]
+
+
+def test_query_of_an_unknown_repo_is_rejected(tmp_path):
+    service = QueryService(embeddings=FakeEmbeddings(), llm=FakeStreamingChatModel(), store_dir=str(tmp_path))
+
+    async def run():
+        async with TestClient(TestServer(create_app(service))) as client:
+            response = await client.post("/query", json={"repo": "missing", "question": "Hi?"})
+            return response.status
+    assert asyncio.run(run()) == 404
@@ -0,0 +1,70 @@
+# This script checks that streamed windows and chunks keep multibyte characters whole and their offsets exact
+import io
+
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from ingest.chunker import StructureAwareChunker
+from ingest.text_stream import iter_stream_chunks, iter_text_windows
+
+# Two, three and four bytes per character, so windows of any size cut some of them.
+_MULTIBYTE = "é€😀"
+
+
+def _lines(count):
+    return "".join(f"line {number} {_MULTIBYTE * (number % 4)}\n" + ("\n" if number % 9 == 0 else "")
+                   for number in range(count))
+
+
+def _check_windows(text, window_bytes):
+    data = text.encode("utf-8")
+    windows = list(iter_text_windows(io.BytesIO(data), window_bytes))
+    assert "".join(window.text for window in windows) == text
+    for window in windows:
+        assert window.byte_offset == len(text[:window.char_offset].encode("utf-8"))
+        assert window.line_offset == text.count("\n", 0, window.char_offset)
+        assert data[window.byte_offset:].startswith(window.text.encode("utf-8"))
+    return windows
+
+
+@pytest.mark.parametrize("window_bytes", [1, 2, 5, 7, 64])
+def test_characters_cut_by_windows_without_newlines_are_kept_whole(window_bytes):
+    windows = _check_windows(_MULTIBYTE * 50, window_bytes)
+    assert len(windows) > 1
+
+
+@pytest.mark.parametrize("window_bytes", [64, 100, 1000])
+def test_windows_end_on_newlines(window_bytes):
+    # Every line is shorter than a window.
+    text = _lines(200)
+    windows = _check_windows(text, window_bytes)
+    assert all(window.text.endswith("\n") for window in windows)
+
+
+def test_invalid_bytes_are_replaced():
+    windows = list(iter_text_windows(io.BytesIO(b"ok\n\xff\xfe still read\n"), 4))
+    assert "".join(window.text for window in windows) == "ok\n�� still read\n"
+
+
+@pytest.mark.parametrize("text_splitter", [
+    RecursiveCharacterTextSplitter(chunk_size=80, chunk_overlap=0, add_start_index=True),
+    StructureAwareChunker(token_budget=20),
+], ids=["recursive", "structure-aware"])
+def test_chunk_offsets_point_into_the_file(text_splitter):
+    text = _lines(300)
+    data = text.encode("utf-8")
+    parts = list(iter_stream_chunks(io.BytesIO(data), "big.log", text_splitter, window_bytes=1000))
+    assert len(parts) > 1
+    chunks = [chunk for part in parts for chunk in part]
+    for chunk in chunks:
+        start = chunk.metadata["start_index"]
+        assert text[start:start + len(chunk.page_content)] == chunk.page_content
+        content = chunk.page_content.encode("utf-8")
+        assert data[chunk.metadata["start_byte"]:chunk.metadata["start_byte"] + len(content)] == content
+        # Lines count from the first non-blank character of the chunk.
+        first = start + len(chunk.page_content) - len(chunk.page_content.lstrip())
+        assert chunk.metadata["start_line"] == text.count("\n", 0, first) + 1
+        assert chunk.metadata["end_line"] == text.count("\n", 0, start + len(chunk.page_content.rstrip())) + 1
+        assert chunk.metadata["source"] == "big.log"
+    assert [chunk.metadata["start_index"] for chunk in chunks] == sorted(chunk.metadata["start_index"]
+                                                                        for chunk in chunks)